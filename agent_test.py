@@ -4,7 +4,7 @@ from core.config import config
 from core.llms.qwen_llm import QwenCoT
 from core.tools import GetWeather, RAGTool, MCPClients, PlanningTool
 from core.mem import ListMemory
-from core.schema import AgentDone, QueueEnd, Message
+from core.events import EventType
 
 async def main():
     llm_config = config.llm_providers["qwen"]
@@ -29,22 +29,16 @@ async def main():
     # mcp = MCPClients()
     # await mcp.connect_sse("https://mcp-8b5eddad-053e-451b.api-inference.modelscope.cn/sse")
     assistant.available_tools.add_tool(PlanningTool())
-    queue = await assistant.run_stream("创建一个合理的计划，具有清晰的步骤，以完成任务: 从杭州出发到重庆的十一假期旅游计划")
+    events = await assistant.run_stream("创建一个合理的计划，具有清晰的步骤，以完成任务: 从杭州出发到重庆的十一假期旅游计划")
     
-    while True:
-        chunk = await queue.get()
-        if isinstance(chunk, AgentDone):
-            break
-        if isinstance(chunk, asyncio.Queue):
-            while True:
-                result = await chunk.get()
-                if isinstance(result, QueueEnd):
-                    break
-                if result.thinking:
-                    print("thinking:", result.thinking)
-                if result.content:
-                    print("content:", result.content)
-                if result.tool_calls:
-                    print("tool_calls:", result.tool_calls)
+    async for event in events:
+        if event.type == EventType.STEP_START:
+            print(f"\n[{event.source}] step {event.step}: {event.text}")
+        elif event.type in (EventType.THINKING_DELTA, EventType.CONTENT_DELTA, EventType.TOOL_OUTPUT):
+            print(event.text, end="", flush=True)
+        elif event.type == EventType.TOOL_CALL:
+            print("\ntool_call:", event.tool_call)
+        elif event.type in (EventType.TOOL_RESULT, EventType.ERROR, EventType.DONE):
+            print(f"\n{event.type.value}:", event.text)
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
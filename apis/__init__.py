@@ -4,7 +4,8 @@ from .event import event_router
 from .guide import guide_router
 from .competition import competition_router
 from .course import course_router
+from .monitor import monitor_router
 
-all_routers = [law_router, files_router, event_router, guide_router, competition_router, course_router]
+all_routers = [law_router, files_router, event_router, guide_router, competition_router, course_router, monitor_router]
 
 __all__ = ["all_routers"]
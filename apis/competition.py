@@ -1,13 +1,14 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
-from core.llms import AsyncBaseChatCOTModel
-from .utils import get_llm, get_llm_cot
+from core.llms import AsyncBaseChatCOTModel, StreamAssembler, tag_request, caller_id
+from core.llms.prompt import PromptBuilder
+from .utils import get_llm, get_llm_cot, scoped_stream
+from .sse import SSEWriter, get_sse_protocol
 from utils.log import logger
 import json
 from apis.competition_utils.schema import Competition, CompetitionBaseInfo
 from apis.competition_utils.check import analyze_competition_completeness, process_user_input
 from fastapi.responses import StreamingResponse
-from core.schema import Message
 import time
 
 competition_router = APIRouter(prefix="/competition")
@@ -49,14 +50,38 @@ class CreateCompetitionRequest(BaseModel):
     use_cot_model: bool = False
     token: str = ""
 
-@competition_router.post("/create_competition")
-async def create_competition(createCompetitionRequest: CreateCompetitionRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
-    """创建比赛"""
-    logger.debug(f"收到创建竞赛请求: {createCompetitionRequest}")
-    system_prompt = f"""你是一个竞赛创建助手，需要根据用户当前的竞赛配置情况和对话历史，引导用户填写剩余的竞赛信息。要创建的竞赛为网络安全相关竞赛，用来体现选手的网络安全攻防能力。
+CREATE_COMPETITION_INSTRUCTIONS = """
+你是一个竞赛创建助手，需要根据用户当前的竞赛配置情况和对话历史，引导用户填写剩余的竞赛信息。要创建的竞赛为网络安全相关竞赛，用来体现选手的网络安全攻防能力。
 通常竞赛分为CTF、AWD、BTC，每种类型有不同的赛题设置和答题模式。
 比赛创建完成不用说其他内容，只需要返回竞赛的详细信息。
+
+# 配置未完成时
+请生成一个友好的响应，引导用户完成竞赛创建过程。响应应当:
+1. 确认已经填写/更新的内容
+2. 清晰指出下一步需要填写什么内容
+3. 如果需要，提供填写示例或选项
+4. 使用友好的对话语气
+5. 一个比赛可以有多个阶段，但是最少有一个阶段，请引导用户创建相应的阶段，如果有一个也可以继续添加。阶段可以有CTF（夺旗赛）、AWD（攻防赛）、BTC（闯关赛）。引导用户添加阶段的时候，仅引导用户输入阶段类型，比如CTF、AWD、BTC。
+6. 在还有未填写字段的内容时候，请勿向用户介绍可以提交。
+7. 给出适当的样例，但是不要建议用户使用默认配置。
+
+# 配置完成时
+请对竞赛配置数据进行整理，以清晰、结构化的方式呈现关键信息，包括但不限于：
+1. 竞赛名称、时间、简介等基本信息
+2. 竞赛阶段和类型
+3. 赛题设置和评分规则
+4. 其他重要配置
+
+注意：不要直接返回JSON格式，而是将数据转换为易于阅读的文本形式，使用适当的标题、分段和格式化。
 """
+
+@competition_router.post("/create_competition")
+async def create_competition(http_request: Request, createCompetitionRequest: CreateCompetitionRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
+    """创建比赛"""
+    logger.debug(f"收到创建竞赛请求: {createCompetitionRequest}")
+    if createCompetitionRequest.token:
+        # 按平台用户统计LLM用量
+        tag_request(caller=caller_id(createCompetitionRequest.token))
     llm = cot_llm if createCompetitionRequest.use_cot_model else llm
     
     # 从请求中提取信息
@@ -76,62 +101,29 @@ async def create_competition(createCompetitionRequest: CreateCompetitionRequest,
     # 检查竞赛配置的完整性，确定下一步需要填写的信息
     next_step, missing_fields = await analyze_competition_completeness(competition, user_input, llm)
     logger.debug(f"竞赛配置完整性检查结果: {next_step}, {missing_fields}")
+    # 固定的指令放在system消息中保持前缀稳定，每轮变化的配置状态放在最后的user消息中
+    prompt = PromptBuilder(CREATE_COMPETITION_INSTRUCTIONS)
     if next_step == "竞赛配置完成":
         is_completed = True
-        prompt = f"""
-竞赛配置已经完成，可以提交创建。请将以下竞赛配置信息转换为用户友好的格式：
-
-# 竞赛配置数据
-{competition.model_dump()}
-
-请对上述配置数据进行整理，以清晰、结构化的方式呈现关键信息，包括但不限于：
-1. 竞赛名称、时间、简介等基本信息
-2. 竞赛阶段和类型
-3. 赛题设置和评分规则
-4. 其他重要配置
-
-注意：不要直接返回JSON格式，而是将数据转换为易于阅读的文本形式，使用适当的标题、分段和格式化。
-"""
+        prompt.request(None, "竞赛配置已经完成，可以提交创建。请按照“配置完成时”的要求，将以下竞赛配置信息转换为用户友好的格式。")
+        prompt.request("竞赛配置数据", competition)
     else:
-        prompt = f"""
-当前竞赛配置状态:
-{competition.model_dump()}
-
-用户最新输入:
-{user_input}
-
-更新信息:
-{update_message}
-
-下一步需要询问的内容:
-{next_step}
-
-未填写的字段:
-{missing_fields}
-
-请生成一个友好的响应，引导用户完成竞赛创建过程。响应应当:
-1. 确认已经填写/更新的内容
-2. 清晰指出下一步需要填写什么内容
-3. 如果需要，提供填写示例或选项
-4. 使用友好的对话语气
-5. 一个比赛可以有多个阶段，但是最少有一个阶段，请引导用户创建相应的阶段，如果有一个也可以继续添加。阶段可以有CTF（夺旗赛）、AWD（攻防赛）、BTC（闯关赛）。引导用户添加阶段的时候，仅引导用户输入阶段类型，比如CTF、AWD、BTC。
-6. 在还有未填写字段的内容时候，请勿向用户介绍可以提交。
-7. 给出适当的样例，但是不要建议用户使用默认配置。
-"""
+        prompt.request(None, "竞赛配置尚未完成，请按照“配置未完成时”的要求生成响应。")
+        prompt.request("当前竞赛配置状态", competition)
+        prompt.request("用户最新输入", user_input)
+        prompt.request("更新信息", update_message)
+        prompt.request("下一步需要询问的内容", next_step)
+        prompt.request("未填写的字段", missing_fields)
     # 将Competition对象转换为JSON
     competition_json = competition.model_dump_json()
     async def generate():
-        history.insert(0, Message.system_message(system_prompt))
-        history.append(Message.user_message(prompt))
-        all_answer = ""
-        thinking = ""
-        async for chunk_thinking, chunk_response, _ in await llm.chat(messages=history, stream=True, temperature=0.01):
-            thinking += chunk_thinking
-            all_answer += chunk_response
-            if createCompetitionRequest.use_cot_model:
-                yield f"data: {json.dumps({'answer': all_answer, 'thinking': thinking})}\n\n"
-            else:
-                yield f"data: {json.dumps({'answer': all_answer})}\n\n"
+        history.insert(0, prompt.system_message())
+        history.append(prompt.user_message())
+        writer = SSEWriter(sse_protocol, thinking=createCompetitionRequest.use_cot_model)
+        assembler = StreamAssembler()
+        async for frame in writer.relay(await llm.chat(messages=llm.fit_messages(history), stream=True, temperature=0.01), assembler):
+            yield frame
+        all_answer = assembler.content
         
         history.pop(0)
         history.pop()
@@ -150,7 +142,7 @@ async def create_competition(createCompetitionRequest: CreateCompetitionRequest,
             "competition": competition_json,
             "history": history
         }
-        yield f"data: {json.dumps(result)}\n\n"
+        yield writer.end(result, assembler)
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream")
 
@@ -42,7 +42,7 @@ async def analyze_competition_completeness(competition: Competition, user_input:
 
 注意: 不要仅因为没有缺失字段就判定为完成，必须用户明确确认才返回"竞赛配置完成"。
 """
-    thinking, next_step, _ = await llm.chat(prompt, stream=False, temperature=0.01)
+    thinking, next_step, _ = await llm.chat(prompt, stream=False, temperature=0.01, use_cache=True)
     
     # 检查返回的内容，如果包含"竞赛配置完成"就标准化
     if "竞赛配置完成" in next_step:
@@ -115,7 +115,7 @@ async def process_user_input(competition: Competition, user_input: str, history:
 请尽量准确解析用户意图，即使用户输入格式不规范或信息不完整。
 """
     
-    thinking, parse_result, _ = await llm.chat(prompt, stream=False, temperature=0.01)
+    thinking, parse_result, _ = await llm.chat(prompt, stream=False, temperature=0.01, use_cache=True)
     logger.debug(f"解析用户输入结果: {parse_result}")
     
     try:
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
-from core.llms import AsyncBaseChatCOTModel
-from .utils import get_llm, get_llm_cot
+from core.llms import AsyncBaseChatCOTModel, StreamAssembler, tag_request, caller_id
+from core.llms.prompt import PromptBuilder
+from .utils import get_llm, get_llm_cot, scoped_stream
+from .sse import SSEWriter, get_sse_protocol
 from utils.log import logger
 from apis.course_utils.schema import Course, CourseBaseInfo
 from apis.course_utils.check import analyze_course_completeness, process_user_input, get_tags
 from fastapi.responses import StreamingResponse
-from core.schema import Message
 import json
 
 course_router = APIRouter(prefix="/course")
@@ -18,10 +19,27 @@ class CreateCourseRequest(BaseModel):
     use_cot_model: bool = False
     token: str
 
+CREATE_COURSE_INSTRUCTIONS = """
+你是一个课程创建助手，需要根据用户当前的课程配置情况和对话历史，引导用户填写剩余的课程信息，并确保课程配置的完整性。
+
+# 配置未完成时
+请生成一个友好的响应，引导用户完成课程创建过程。响应应当:
+1. 确认已经填写/更新的内容
+2. 清晰指出下一步需要填写什么内容
+3. 如果需要，提供填写示例或选项
+4. 使用友好的对话语气
+5. 在用户没有输入名称前，不要提示用户输入标签相关信息
+
+# 配置完成时
+向用户展示课程配置信息即可，不需要用户确认。
+"""
+
 @course_router.post("/create_course")
-async def create_course(createCourseRequest: CreateCourseRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+async def create_course(http_request: Request, createCourseRequest: CreateCourseRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
     """创建课程"""
-    system_prompt = "你是一个课程创建助手，需要根据用户当前的课程配置情况和对话历史，引导用户填写剩余的课程信息，并确保课程配置的完整性。"
+    if createCourseRequest.token:
+        # 按平台用户统计LLM用量
+        tag_request(caller=caller_id(createCourseRequest.token))
     llm = cot_llm if createCourseRequest.use_cot_model else llm
     
     course_json = createCourseRequest.course
@@ -39,57 +57,30 @@ async def create_course(createCourseRequest: CreateCourseRequest, llm: AsyncBase
     logger.debug(f"next_step: {next_step}")
     tags = await get_tags(createCourseRequest.token)
     
+    # 固定的指令放在system消息中保持前缀稳定，每轮变化的配置状态放在最后的user消息中
+    prompt = PromptBuilder(CREATE_COURSE_INSTRUCTIONS)
     if "课程配置完成" in next_step:
         is_completed = True
-        prompt = f"""
-课程配置已经完成，可以提交创建。以下是您的课程配置信息：
-
-# 课程信息
-{course.model_dump()}
-
-向用户展示信息即可，不需要用户确认。
-"""
+        prompt.request(None, "课程配置已经完成，可以提交创建。请按照“配置完成时”的要求展示以下课程配置信息。")
+        prompt.request("课程信息", course)
     else:
-        prompt = f"""
-当前课程配置状态:
-{course.model_dump()}
-
-用户最新输入:
-{user_input}
-
-更新信息:
-{update_message}
-
-下一步需要询问的内容:
-{next_step}
-
-未填写的字段:
-{missing_fields}
-
-当前课程标签:
-{tags}
-
-请生成一个友好的响应，引导用户完成课程创建过程。响应应当:
-1. 确认已经填写/更新的内容
-2. 清晰指出下一步需要填写什么内容
-3. 如果需要，提供填写示例或选项
-4. 使用友好的对话语气
-5. 在用户没有输入名称前，不要提示用户输入标签相关信息
-"""
+        prompt.request(None, "课程配置尚未完成，请按照“配置未完成时”的要求生成响应。")
+        prompt.request("当前课程配置状态", course)
+        prompt.request("用户最新输入", user_input)
+        prompt.request("更新信息", update_message)
+        prompt.request("下一步需要询问的内容", next_step)
+        prompt.request("未填写的字段", missing_fields)
+        prompt.request("当前课程标签", tags)
     # 将Course对象转换为JSON
     course_json = course.model_dump_json()
     async def generate():
-        history.insert(0, Message.system_message(system_prompt))
-        history.append(Message.user_message(prompt))
-        all_answer = ""
-        thinking = ""
-        async for chunk_thinking, chunk_response, _ in await llm.chat(messages=history, stream=True, temperature=0.01):
-            thinking += chunk_thinking
-            all_answer += chunk_response
-            if createCourseRequest.use_cot_model:
-                yield f"data: {json.dumps({'answer': all_answer, 'thinking': thinking})}\n\n"
-            else:
-                yield f"data: {json.dumps({'answer': all_answer})}\n\n"
+        history.insert(0, prompt.system_message())
+        history.append(prompt.user_message())
+        writer = SSEWriter(sse_protocol, thinking=createCourseRequest.use_cot_model)
+        assembler = StreamAssembler()
+        async for frame in writer.relay(await llm.chat(messages=llm.fit_messages(history), stream=True, temperature=0.01), assembler):
+            yield frame
+        all_answer = assembler.content
         history.pop(0)
         history.pop()
         history.append({
@@ -106,6 +97,6 @@ async def create_course(createCourseRequest: CreateCourseRequest, llm: AsyncBase
             "course": course_json,
             "history": history
         }
-        yield f"data: {json.dumps(result)}\n\n"
+        yield writer.end(result, assembler)
         logger.debug(f"创建完成: {result}")
-    return StreamingResponse(generate(), media_type="text/event-stream")
\ No newline at end of file
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream")
\ No newline at end of file
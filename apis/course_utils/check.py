@@ -36,7 +36,7 @@ async def analyze_course_completeness(course: Course, user_input: str, llm: Asyn
    - 可添加/修改的内容建议
    - 询问用户是否确认完成创建
 """
-    thinking, next_step, _ = await llm.chat(prompt, stream=False, temperature=0.01)
+    thinking, next_step, _ = await llm.chat(prompt, stream=False, temperature=0.01, use_cache=True)
     
     # 检查返回的内容，如果包含"竞赛配置完成"就标准化
     if "课程配置完成" in next_step:
@@ -94,7 +94,7 @@ async def process_user_input(course: Course, user_input: str, history: list[dict
     
     messages = deepcopy(history)
     messages.append(Message.user_message(prompt))
-    thinking, parse_result, _ = await llm.chat(messages=messages, stream=False, temperature=0.01)
+    thinking, parse_result, _ = await llm.chat(messages=messages, stream=False, temperature=0.01, use_cache=True)
     logger.debug(f"解析用户输入结果: {parse_result}")
     
     try:
@@ -187,7 +187,7 @@ web安全,sql注入,xss攻击
 
 请生成：
 """
-    thinking, result, _ = await llm.chat(prompt, stream=False, temperature=0.01)
+    thinking, result, _ = await llm.chat(prompt, stream=False, temperature=0.01, use_cache=True)
     keywords = result.split(",")
     course_list = []
     error_message = ""
@@ -261,7 +261,7 @@ async def add_chapter(course_dict: dict, update_value: str, llm: AsyncBaseChatCO
 请确保总课时不超过用户要求，同时保持章节内容与用户需求相匹配。
 """
     
-    thinking, yaml_result, _ = await llm.chat(prompt, stream=False, temperature=0.01)
+    thinking, yaml_result, _ = await llm.chat(prompt, stream=False, temperature=0.01, use_cache=True)
     chapters = parse_markdown_yaml(yaml_result)
     if not chapters:
         return course_dict, False, "生成的章节格式不正确，应为列表"
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends
-from pydantic import BaseModel
-from core.llms import AsyncBaseChatCOTModel
+from pydantic import BaseModel, Field
+from core.llms import AsyncBaseChatCOTModel, BatchRunner, make_job_id, batch_jobs
+from core.llms.batch import JOB_LABEL_PATTERN
 from .utils import get_llm, get_llm_cot, parse_markdown_json, parse_markdown_yaml
 from events import ParserFactory, ParserType, Frame, Event
 from utils.log import logger
@@ -13,14 +14,13 @@ class EventPost(BaseModel):
     request_id: str
     parser_type: ParserType = ParserType.MERGE
 
-@event_router.post("/event_analysis")
-async def event_analysis(events: EventPost, llm:AsyncBaseChatCOTModel = Depends(get_llm),cot_llm:AsyncBaseChatCOTModel = Depends(get_llm_cot)):
-    """事件分析，将frame转换成event"""
+def build_event_prompt(events: EventPost) -> str:
+    """把frame解析后填入事件分析提示词"""
     logger.debug(f"frame_list: {events.frame_list}")
     parser = ParserFactory.create_parser(events.parser_type, events.frame_list)
     frame_list = parser.parse()
     logger.debug(f"Parse frame_list: {frame_list}")
-    prompt = f"""
+    return f"""
 # 任务说明
 你是一个专业的终端操作分析专家。你的任务是从连续的终端日志中识别和分析用户的操作序列。
 
@@ -66,16 +66,64 @@ async def event_analysis(events: EventPost, llm:AsyncBaseChatCOTModel = Depends(
 6. 输出中不应该显示控制字符（如\\r\\n），应清理这些字符或替换为适当的描述
 7. 对于Tab补全等操作，应将其视为命令输入的一部分，与后续执行合并为一个事件
 """
-    use_llm = cot_llm if events.use_cot_model else llm
-    _, resp, _ = await use_llm.chat(prompt=prompt, stream=False, temperature=0.01)
+
+def parse_event_response(resp: str) -> tuple[list, str]:
+    """解析模型输出的事件列表，返回（事件列表，错误信息）"""
     if resp == "无":
-        return {"code": 200, "error": "", "data": {"event_list": [], "request_id": events.request_id}}
+        return [], ""
     try:
         result = parse_markdown_yaml(resp)
         if isinstance(result, str):
-            return {"code": 200, "error": "", "data": {"event_list": [], "request_id": events.request_id}}
-        result = [Event(**item).model_dump() for item in result]
-        return {"code": 200, "error": "", "data": {"event_list": result, "request_id": events.request_id}}
+            return [], ""
+        return [Event(**item).model_dump() for item in result], ""
     except Exception as e:
-        return {"code": 500, "error": f"YAML解析失败\n{resp}\n错误信息: {str(e)}", "data": {"event_list": [], "request_id": events.request_id}}
+        return [], f"YAML解析失败\n{resp}\n错误信息: {str(e)}"
+
+@event_router.post("/event_analysis")
+async def event_analysis(events: EventPost, llm:AsyncBaseChatCOTModel = Depends(get_llm),cot_llm:AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+    """事件分析，将frame转换成event"""
+    prompt = build_event_prompt(events)
+    use_llm = cot_llm if events.use_cot_model else llm
+    _, resp, _ = await use_llm.chat(prompt=prompt, stream=False, temperature=0.01, use_cache=True)
+    event_list, error = parse_event_response(resp)
+    if error:
+        return {"code": 500, "error": error, "data": {"event_list": [], "request_id": events.request_id}}
+    return {"code": 200, "error": "", "data": {"event_list": event_list, "request_id": events.request_id}}
+
+class EventBatchPost(BaseModel):
+    items: list[EventPost]
+    use_cot_model: bool = False
+    use_batch_api: bool = False  # 提供商支持时使用批处理文件接口
+    # 可选的任务标签，任务ID由接口、标签和内容生成，相同的批量任务重复提交会从断点续跑
+    job_id: str | None = Field(default=None, pattern=JOB_LABEL_PATTERN)
+
+@event_router.post("/event_analysis/batch")
+async def event_analysis_batch(batch: EventBatchPost, llm:AsyncBaseChatCOTModel = Depends(get_llm),cot_llm:AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+    """批量事件分析，有界并发执行并记录断点。任务在后台执行，立即返回job_id，通过 GET /event/event_analysis/batch/{job_id} 查询结果"""
+    use_llm = cot_llm if batch.use_cot_model else llm
+    job_id = make_job_id("event_analysis", [item.model_dump(mode="json") for item in batch.items], label=batch.job_id)
+    requests = [
+        {"custom_id": str(index), "messages": [{"role": "user", "content": build_event_prompt(item)}]}
+        for index, item in enumerate(batch.items)
+    ]
+    runner = BatchRunner(use_llm, job_id)
+
+    async def run():
+        results = await runner.run(requests, use_batch_api=batch.use_batch_api, temperature=0.01, use_cache=True)
+        data = []
+        for item, record in zip(batch.items, results):
+            event_list, error = parse_event_response(record["content"]) if record["error"] is None else ([], record["error"])
+            data.append({"request_id": item.request_id, "event_list": event_list, "error": error})
+        return data
+
+    job = batch_jobs.submit(job_id, runner, run())
+    return {"code": 200, "error": "", "data": job.to_dict()}
+
+@event_router.get("/event_analysis/batch/{job_id}")
+async def event_analysis_batch_result(job_id: str):
+    """查询批量事件分析的状态，任务完成后返回结果"""
+    job = batch_jobs.get(job_id) if job_id.startswith("event_analysis-") else None
+    if job is None:
+        return {"code": 404, "error": f"批量任务 {job_id} 不存在或已过期", "data": None}
+    return {"code": 200, "error": "", "data": job.to_dict(with_results=True)}
 
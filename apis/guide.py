@@ -1,38 +1,21 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
-from core.llms import AsyncBaseChatCOTModel
-from .utils import get_llm, get_llm_cot
+from core.llms import AsyncBaseChatCOTModel, StreamAssembler
+from core.llms.prompt import PromptBuilder
+from .utils import get_llm, get_llm_cot, scoped_stream
+from .sse import SSEWriter, get_sse_protocol
 from events import Event
 from utils.log import logger
 from fastapi.responses import StreamingResponse
 import datetime
-import json
 
 guide_router = APIRouter(prefix="/guide")
 
-class GuideRequest(BaseModel):
-    wp: str  # 题目的WP，用于指导模型理解题目和解题思路
-    description: str  # 题目描述
-    events: list[Event]  # 学员操作event
-    history: list[dict] = []  # 对话历史记录
-    question: str  # 学员的问题
-    use_cot_model: bool = False
-
-@guide_router.post("/student_guide")
-async def student_guide(request: GuideRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
-    """
-    学员引导接口，根据题目信息、学员操作和问题提供引导或解答
-    """
-    # 构建系统提示
-    system_prompt = f"""
+STUDENT_GUIDE_INSTRUCTIONS = """
 你是一个专业的网络安全靶场导师。你的任务是根据学员的操作和问题提供适当的引导或解答。
 
-# 题目信息
-题目描述: {request.description}
-题目WP: {request.wp}
-
 # 指导原则
-1. 你可以参考WP来理解题目的解题思路和关键步骤，但在回答中绝不直接复制或透露WP中的具体操作步骤
+1. 你可以参考题目信息中的WP来理解题目的解题思路和关键步骤，但在回答中绝不直接复制或透露WP中的具体操作步骤
 2. 对于学员的问题，提供启发性的引导而非直接的解决方案
 3. 根据学员的当前进度，适当引导他们思考下一个可能的方向
 4. 即使学员直接询问解题步骤，也只给出方向性提示，而不是具体操作指令
@@ -55,37 +38,65 @@ async def student_guide(request: GuideRequest, llm: AsyncBaseChatCOTModel = Depe
    - 避免使用过于技术性的术语，除非必要
    - 回答要简洁明了，重点突出
 """
-    
+
+class GuideRequest(BaseModel):
+    wp: str  # 题目的WP，用于指导模型理解题目和解题思路
+    description: str  # 题目描述
+    events: list[Event]  # 学员操作event
+    history: list[dict] = []  # 对话历史记录
+    question: str  # 学员的问题
+    use_cot_model: bool = False
+
+USER_GUIDE_INSTRUCTIONS = """
+你是安恒数字人才创研院研发的AI私教，为平台用户提供以下三大能力，助力教育创新。
+第一，智能化课程搭建。 AI私教能够根据您的课程需求，设计课程大纲，并关联平台相关知识点，实现系统自动排课。无需繁琐的后台操作，轻松解放您的教学生产力！
+第二，智能化竞赛创建。 AI私教支持根据用户的竞赛需求，进行竞赛的自动化创建并选题，即便是新手小白也可轻松完成一场竞赛的创建！
+第三，智能化实验助教。AI私教支持实验过程中的答疑解惑；在遇到阻滞时，能够引导式地推动实验进程而非直接给出答案；同时，AI私教支持实验过程的纠错和问题的总结分析，有效提升学生的学习效果！
+让AI私教成为您教学的得力助手，开启智能教育的新篇章！
+
+你是一个专业的智能助手，能够回答用户的各种问题，提供准确、有用的信息。
+
+在回答时，请注意以下几点：
+- 当前时间见用户消息。
+- 根据用户问题提供最相关、最准确的回答。
+- 对于列举类问题(如列举旅游景点、编程库等)，将答案控制在10个要点以内，优先提供最相关、信息最完整的选项。
+- 如果回答很长，请结构化、分段落总结。如果需要分点作答，尽量控制在5个点以内，并合并相关内容。
+- 对于客观类问答，如果答案非常简短，可以适当补充一到两句相关信息，丰富内容。
+- 选择美观、易读的回答格式，确保可读性强。
+- 保持与用户提问相同的语言回答。
+- 对于编程相关问题，提供简洁、有效的代码示例和解释。
+- 对于旅游、生活类问题，提供实用的建议和信息。
+- 输出使用markdown格式。
+
+请始终以礼貌、专业的态度回应用户，提供最有帮助的信息。
+"""
+
+@guide_router.post("/student_guide")
+async def student_guide(http_request: Request, request: GuideRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
+    """
+    学员引导接口，根据题目信息、学员操作和问题提供引导或解答
+    """
+    # 固定指令在前，题目信息在后，学员操作和问题放在最后的user消息中，保持system前缀稳定
+    prompt = PromptBuilder(STUDENT_GUIDE_INSTRUCTIONS)
+    prompt.context("题目信息", f"题目描述: {request.description}\n题目WP: {request.wp}")
+    prompt.request("学员操作记录", request.events)
+    prompt.request("学员问题", request.question)
+    prompt.request("重要提示", "记住：参考WP内容理解题目，但不要在回答中直接透露具体解题步骤，只提供启发性的引导，让学员自己思考解决方案。")
+
     # 初始化历史记录
     history = request.history
     if len(history) == 0:
-        history.append({'role': "system", 'content': system_prompt})
+        history.append(prompt.system_message())
     elif history[0]['role'] != "system":
-        history.insert(0, {'role': "system", 'content': system_prompt})
-    
-    # 构建包含操作记录的用户消息
-    user_msg = f"""
-# 学员操作记录
-{request.events}
-
-# 学员问题
-{request.question}
-
-# 重要提示
-记住：参考WP内容理解题目，但不要在回答中直接透露具体解题步骤，只提供启发性的引导，让学员自己思考解决方案。
-"""
-    history.append({'role': "user", 'content': user_msg})
+        history.insert(0, prompt.system_message())
+    history.append(prompt.user_message())
     llm = cot_llm if request.use_cot_model else llm
     async def generate():
-        all_answer = ""
-        thinking = ""
-        async for think, resp, _ in await llm.chat(messages=history, stream=True):
-            thinking += think
-            all_answer += resp
-            if request.use_cot_model:
-                yield f"data: {json.dumps({'answer': all_answer, 'thinking': thinking})}\n\n"
-            else:
-                yield f"data: {json.dumps({'answer': all_answer})}\n\n"
+        writer = SSEWriter(sse_protocol, thinking=request.use_cot_model)
+        assembler = StreamAssembler()
+        async for frame in writer.relay(await llm.chat(messages=llm.fit_messages(history), stream=True), assembler):
+            yield frame
+        all_answer = assembler.content
 
         # pop system message
         history.pop(0)
@@ -93,9 +104,9 @@ async def student_guide(request: GuideRequest, llm: AsyncBaseChatCOTModel = Depe
         history.pop()
         history.append({'role': "user", 'content': request.question})
         history.append({'role': "assistant", 'content': all_answer})
-        yield f"data: {json.dumps({'answer': '<end>', 'history': history})}\n\n"
+        yield writer.end({'answer': '<end>', 'history': history}, assembler)
 
-    return StreamingResponse(generate(), media_type="text/event-stream") 
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream") 
 
 class ConversationSummaryRequest(BaseModel):
     history: list[dict]  # 对话历史记录
@@ -123,7 +134,7 @@ async def conversation_summary(request: ConversationSummaryRequest, llm: AsyncBa
 {request.history}
 """
     use_llm = cot_llm if request.use_cot_model else llm
-    _, resp, _ = await use_llm.chat(prompt=system_prompt, stream=False, temperature=0.01)
+    _, resp, _ = await use_llm.chat(prompt=system_prompt, stream=False, temperature=0.01, use_cache=True)
     return {
         "code": 200,
         "error": "",
@@ -139,54 +150,28 @@ class UserGuideRequest(BaseModel):
     system_prompt: str = ""  # 系统提示
 
 @guide_router.post("/user_guide")
-async def user_guide(request: UserGuideRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+async def user_guide(http_request: Request, request: UserGuideRequest, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
     """平台用户对话接口，解答用户的问题"""
     history = request.history
     llm = cot_llm if request.use_cot_model else llm
     cur_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    system_prompt_template = f"""
-你是安恒数字人才创研院研发的AI私教，为平台用户提供以下三大能力，助力教育创新。
-第一，智能化课程搭建。 AI私教能够根据您的课程需求，设计课程大纲，并关联平台相关知识点，实现系统自动排课。无需繁琐的后台操作，轻松解放您的教学生产力！
-第二，智能化竞赛创建。 AI私教支持根据用户的竞赛需求，进行竞赛的自动化创建并选题，即便是新手小白也可轻松完成一场竞赛的创建！
-第三，智能化实验助教。AI私教支持实验过程中的答疑解惑；在遇到阻滞时，能够引导式地推动实验进程而非直接给出答案；同时，AI私教支持实验过程的纠错和问题的总结分析，有效提升学生的学习效果！
-让AI私教成为您教学的得力助手，开启智能教育的新篇章！
-"""
-    system_prompt = system_prompt_template + request.system_prompt
-    prompt = f"""
-你是一个专业的智能助手，能够回答用户的各种问题，提供准确、有用的信息。
-
-在回答时，请注意以下几点：
-- 当前时间：{cur_time}
-- 根据用户问题提供最相关、最准确的回答。
-- 对于列举类问题(如列举旅游景点、编程库等)，将答案控制在10个要点以内，优先提供最相关、信息最完整的选项。
-- 如果回答很长，请结构化、分段落总结。如果需要分点作答，尽量控制在5个点以内，并合并相关内容。
-- 对于客观类问答，如果答案非常简短，可以适当补充一到两句相关信息，丰富内容。
-- 选择美观、易读的回答格式，确保可读性强。
-- 保持与用户提问相同的语言回答。
-- 对于编程相关问题，提供简洁、有效的代码示例和解释。
-- 对于旅游、生活类问题，提供实用的建议和信息。
-- 输出使用markdown格式。
-
-请始终以礼貌、专业的态度回应用户，提供最有帮助的信息。
-
-用户输入：
-{request.user_input}
-"""
+    # 当前时间和用户输入每轮都会变化，放在最后的user消息中，固定指令和调用方的系统提示保持在前缀
+    prompt = PromptBuilder(USER_GUIDE_INSTRUCTIONS)
+    if request.system_prompt:
+        prompt.context(None, request.system_prompt)
+    prompt.request("当前时间", cur_time)
+    prompt.request("用户输入", request.user_input)
     async def generate():
-        history.insert(0, {'role': "system", 'content': system_prompt})
-        history.append({'role': "user", 'content': prompt})
-        all_answer = ""
-        thinking = ""
-        async for think, resp, _ in await llm.chat(messages=history, stream=True):
-            thinking += think
-            all_answer += resp
-            if request.use_cot_model:
-                yield f"data: {json.dumps({'answer': all_answer, 'thinking': thinking})}\n\n"
-            else:
-                yield f"data: {json.dumps({'answer': all_answer})}\n\n"
+        history.insert(0, prompt.system_message())
+        history.append(prompt.user_message())
+        writer = SSEWriter(sse_protocol, thinking=request.use_cot_model)
+        assembler = StreamAssembler()
+        async for frame in writer.relay(await llm.chat(messages=llm.fit_messages(history), stream=True), assembler):
+            yield frame
+        all_answer = assembler.content
         history.pop(0)
         history.pop()
         history.append({'role': "user", 'content': request.user_input})
         history.append({'role': "assistant", 'content': all_answer})
-        yield f"data: {json.dumps({'answer': '<end>', 'history': history})}\n\n"
-    return StreamingResponse(generate(), media_type="text/event-stream") 
+        yield writer.end({'answer': '<end>', 'history': history}, assembler)
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream") 
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel
-import json
+from fastapi import APIRouter, Depends, Request
+from pydantic import BaseModel, Field
 from utils.log import logger
 from fastapi.responses import StreamingResponse
 from .utils import *
 from core.vector.base import VectorStoreBase
 from core.embeddings.base import EmbeddingAgent
 from core.llms.base import AsyncBaseChatCOTModel
+from core.llms.stream import StreamAssembler
+from .sse import SSEWriter, get_sse_protocol, PROTOCOL_FULL
+from core.llms.batch import BatchRunner, make_job_id, batch_jobs, JOB_LABEL_PATTERN
 from core.rags.law import LawRag
 from core.ranks import AsyncRankAgent
 from fastapi import UploadFile, File
@@ -16,31 +18,26 @@ from datetime import datetime
 
 law_router = APIRouter(prefix="/law")
 
-async def generate_analysis(msg: str, history: list, use_cot_model: bool, system_prompt: str, query_templat: str = "", llm: AsyncBaseChatCOTModel = None, cot_llm: AsyncBaseChatCOTModel = None):
-    """通用分析生成函数"""
+async def generate_analysis(msg: str, history: list, use_cot_model: bool, system_prompt: str, query_templat: str = "", llm: AsyncBaseChatCOTModel = None, cot_llm: AsyncBaseChatCOTModel = None, sse_protocol: int = PROTOCOL_FULL, end_data: dict | None = None):
+    """通用分析生成函数，输出SSE帧"""
     prompt = query_templat.format(msg=msg)
     
     history.insert(0, {'role': "system", 'content': system_prompt}) # 插入系统提示词
     history.append({'role': "user", 'content': prompt}) # 插入用户输入
 
-    all_thinking = ""
-    all_answer = ""
-    if use_cot_model:
-        async for thinking, resp, _ in await cot_llm.chat(messages=history, stream=True):
-            all_thinking += thinking
-            all_answer += resp
-            yield {"thinking": all_thinking, "answer": all_answer}
-    else:
-        async for _, resp, _ in await llm.chat(messages=history, stream=True):
-            all_answer += resp
-            yield {"answer": all_answer}
+    use_llm = cot_llm if use_cot_model else llm
+    writer = SSEWriter(sse_protocol, thinking=use_cot_model)
+    assembler = StreamAssembler()
+    async for frame in writer.relay(await use_llm.chat(messages=use_llm.fit_messages(history), stream=True), assembler):
+        yield frame
+    all_answer = assembler.content
 
     history.pop(0) # 移除系统提示词
     history.pop() # 移除用户输入
     history.append({'role': "user", 'content': msg})
     history.append({'role': "assistant", 'content': all_answer})
-    result = {"answer": "<end>", "history": history}
-    yield result
+    result = {"answer": "<end>", "history": history, **(end_data or {})}
+    yield writer.end(result, assembler)
 
 class lawqa(BaseModel):
     msg: str
@@ -49,7 +46,7 @@ class lawqa(BaseModel):
     use_cot_model: bool = False
 
 @law_router.post("/lawqa")
-async def post_lwa_qa_endpoint(input:lawqa, milvus: VectorStoreBase = Depends(get_milvus_store), text_embedder:EmbeddingAgent = Depends(get_embedding), llm:AsyncBaseChatCOTModel = Depends(get_llm),cot_llm:AsyncBaseChatCOTModel = Depends(get_llm_cot), reranker:AsyncRankAgent = Depends(get_reranker)):
+async def post_lwa_qa_endpoint(http_request: Request, input:lawqa, milvus: VectorStoreBase = Depends(get_milvus_store), text_embedder:EmbeddingAgent = Depends(get_embedding), llm:AsyncBaseChatCOTModel = Depends(get_llm),cot_llm:AsyncBaseChatCOTModel = Depends(get_llm_cot), reranker:AsyncRankAgent = Depends(get_reranker), sse_protocol: int = Depends(get_sse_protocol)):
     """法律相关问答"""
     async def generate():
         query = input.msg
@@ -71,83 +68,148 @@ async def post_lwa_qa_endpoint(input:lawqa, milvus: VectorStoreBase = Depends(ge
         query_templat = doc_str + "用户案件描述:\n{msg}"
         system_str = "你是基层的智能调解员，你会请根据用户的案件描结合相关的法律，站在调解员的角度给出建议。如果不涉及纠纷或者法律问题，请直接回答用户的问题。"
         
-        async for data in generate_analysis(
+        async for frame in generate_analysis(
             msg=query,
             history=history,
             use_cot_model=use_cot_model,
             system_prompt=system_str,
             query_templat=query_templat,
             llm=llm,
-            cot_llm=cot_llm
+            cot_llm=cot_llm,
+            sse_protocol=sse_protocol,
+            end_data={"doc_list": doc_list}
         ):
-            if data["answer"] == "<end>":
-                data["doc_list"] = doc_list
-                yield f"data: {json.dumps(data)}\n\n"
-            else:
-                yield f"data: {json.dumps(data)}\n\n"
+            yield frame
 
-    return StreamingResponse(generate(),media_type="text/event-stream")
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream")
+
+CONFLICT_WARNING_SYSTEM_PROMPT = "你是一个分析矛盾纠纷是否可能激化为极端案事件的专家。请分析提供的矛盾纠纷数据，预测它激化为极端案事件的概率（以百分比表示）。分析时要考虑矛盾的性质、涉事人员状态、历史纠纷情况等因素。输出格式应为：\n1. 结果：当前矛盾激化为极端案事件可能性为X%，简单总结分析结果。\n2. 推理过程：详细分析你是如何得出这个结论的。"
+CONFLICT_WARNING_QUERY = "分析以下矛盾纠纷数据，预测它激化为极端案事件的概率：\n{msg}"
+KEY_PERSON_WARNING_SYSTEM_PROMPT = "你是一个分析重点人风险的专家。请分析提供的重点人相关数据，预测其发生极端案事件的概率（以百分比表示）。分析时要考虑人员背景、历史行为、近期状态等因素。输出格式应为：\n1. 结果：当前重点人发生极端案事件风险概率为X%，简单总结分析结果。\n2. 推理过程：详细分析你是如何得出这个结论的。"
+KEY_PERSON_WARNING_QUERY = "分析以下重点人相关数据，预测其发生极端案事件的概率：\n{msg}"
+
+class BatchRecord(BaseModel):
+    id: str
+    msg: str
+
+class AnalysisBatch(BaseModel):
+    items: list[BatchRecord]
+    use_cot_model: bool = False
+    use_batch_api: bool = False  # 提供商支持时使用批处理文件接口
+    # 可选的任务标签，任务ID由接口、标签和内容生成，相同的批量任务重复提交会从断点续跑
+    job_id: str | None = Field(default=None, pattern=JOB_LABEL_PATTERN)
+
+async def run_analysis_batch(name: str, batch: AnalysisBatch, system_prompt: str, query_templat: str, llm: AsyncBaseChatCOTModel):
+    """批量执行单轮分析，每条记录使用与单条接口相同的提示词。任务在后台执行，立即返回job_id，通过对应的 GET .../batch/{job_id} 查询结果"""
+    job_id = make_job_id(name, [item.model_dump() for item in batch.items], label=batch.job_id)
+    requests = [
+        {
+            "custom_id": str(index),
+            "messages": [
+                {'role': "system", 'content': system_prompt},
+                {'role': "user", 'content': query_templat.format(msg=item.msg)},
+            ],
+        }
+        for index, item in enumerate(batch.items)
+    ]
+    runner = BatchRunner(llm, job_id)
+
+    async def run():
+        results = await runner.run(requests, use_batch_api=batch.use_batch_api)
+        return [
+            {"id": item.id, "answer": record["content"], "thinking": record["thinking"], "error": record["error"] or ""}
+            for item, record in zip(batch.items, results)
+        ]
+
+    job = batch_jobs.submit(job_id, runner, run())
+    return {"code": 200, "error": "", "data": job.to_dict()}
+
+def get_analysis_batch(name: str, job_id: str):
+    # 只能查询本接口提交的任务
+    job = batch_jobs.get(job_id) if job_id.startswith(f"{name}-") else None
+    if job is None:
+        return {"code": 404, "error": f"批量任务 {job_id} 不存在或已过期", "data": None}
+    return {"code": 200, "error": "", "data": job.to_dict(with_results=True)}
 
 @law_router.post("/conflict_warning")
-async def conflict_warning_endpoint(input: lawqa, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+async def conflict_warning_endpoint(http_request: Request, input: lawqa, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
     """矛盾激化为极端案事件预警模型"""
-    system_prompt = "你是一个分析矛盾纠纷是否可能激化为极端案事件的专家。请分析提供的矛盾纠纷数据，预测它激化为极端案事件的概率（以百分比表示）。分析时要考虑矛盾的性质、涉事人员状态、历史纠纷情况等因素。输出格式应为：\n1. 结果：当前矛盾激化为极端案事件可能性为X%，简单总结分析结果。\n2. 推理过程：详细分析你是如何得出这个结论的。"
-    query_templat = "分析以下矛盾纠纷数据，预测它激化为极端案事件的概率：\n{msg}"
-    
     async def generate():
-        async for data in generate_analysis(
+        async for frame in generate_analysis(
             msg=input.msg, 
             history=input.history, 
             use_cot_model=input.use_cot_model, 
-            system_prompt=system_prompt,
-            query_templat=query_templat,
+            system_prompt=CONFLICT_WARNING_SYSTEM_PROMPT,
+            query_templat=CONFLICT_WARNING_QUERY,
             llm=llm,
-            cot_llm=cot_llm
+            cot_llm=cot_llm,
+            sse_protocol=sse_protocol
         ):
-            yield f"data: {json.dumps(data)}\n\n"
+            yield frame
 
-    return StreamingResponse(generate(),media_type="text/event-stream")
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream")
 
 @law_router.post("/key_person_warning")
-async def key_person_warning_endpoint(input: lawqa, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+async def key_person_warning_endpoint(http_request: Request, input: lawqa, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
     """重点人风险预警模型"""
-    system_prompt = "你是一个分析重点人风险的专家。请分析提供的重点人相关数据，预测其发生极端案事件的概率（以百分比表示）。分析时要考虑人员背景、历史行为、近期状态等因素。输出格式应为：\n1. 结果：当前重点人发生极端案事件风险概率为X%，简单总结分析结果。\n2. 推理过程：详细分析你是如何得出这个结论的。"
-    query_templat = "分析以下重点人相关数据，预测其发生极端案事件的概率：\n{msg}"
-    
     async def generate():
-        async for data in generate_analysis(
+        async for frame in generate_analysis(
             msg=input.msg, 
             history=input.history, 
             use_cot_model=input.use_cot_model, 
-            system_prompt=system_prompt,
-            query_templat=query_templat,
+            system_prompt=KEY_PERSON_WARNING_SYSTEM_PROMPT,
+            query_templat=KEY_PERSON_WARNING_QUERY,
             llm=llm,
-            cot_llm=cot_llm
+            cot_llm=cot_llm,
+            sse_protocol=sse_protocol
         ):
-            yield f"data: {json.dumps(data)}\n\n"
+            yield frame
     
-    return StreamingResponse(generate(),media_type="text/event-stream")
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream")
+
+@law_router.post("/conflict_warning/batch")
+async def conflict_warning_batch_endpoint(batch: AnalysisBatch, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+    """矛盾激化预警的批量版本"""
+    use_llm = cot_llm if batch.use_cot_model else llm
+    return await run_analysis_batch("conflict_warning", batch, CONFLICT_WARNING_SYSTEM_PROMPT, CONFLICT_WARNING_QUERY, use_llm)
+
+@law_router.post("/key_person_warning/batch")
+async def key_person_warning_batch_endpoint(batch: AnalysisBatch, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+    """重点人风险预警的批量版本"""
+    use_llm = cot_llm if batch.use_cot_model else llm
+    return await run_analysis_batch("key_person_warning", batch, KEY_PERSON_WARNING_SYSTEM_PROMPT, KEY_PERSON_WARNING_QUERY, use_llm)
+
+@law_router.get("/conflict_warning/batch/{job_id}")
+async def conflict_warning_batch_result(job_id: str):
+    """查询矛盾激化预警批量任务的状态，任务完成后返回结果"""
+    return get_analysis_batch("conflict_warning", job_id)
+
+@law_router.get("/key_person_warning/batch/{job_id}")
+async def key_person_warning_batch_result(job_id: str):
+    """查询重点人风险预警批量任务的状态，任务完成后返回结果"""
+    return get_analysis_batch("key_person_warning", job_id)
 
 @law_router.post("/analysis_report")
-async def analysis_report_endpoint(input: lawqa, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot)):
+async def analysis_report_endpoint(http_request: Request, input: lawqa, llm: AsyncBaseChatCOTModel = Depends(get_llm), cot_llm: AsyncBaseChatCOTModel = Depends(get_llm_cot), sse_protocol: int = Depends(get_sse_protocol)):
     """分析报告生成模型"""
     now_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     system_prompt = "你是一个专业的矛盾数据分析师，负责生成区域数据分析报告。请根据用户提供的矛盾纠纷数据，生成全面的分析报告。分析应包括时间趋势、区域分布、类型等维度，对现状及治理结果进行解读总结，挖掘工作薄弱环节，并给出市级政法委工作建议。"
     query_template = f"现在的日期是{now_time}，请注意报告生成的日期。\n"+"{msg}"
 
     async def generate():
-        async for data in generate_analysis(
+        async for frame in generate_analysis(
             msg=input.msg, 
             history=input.history, 
             use_cot_model=input.use_cot_model, 
             system_prompt=system_prompt,
             query_templat=query_template,
             llm=llm,
-            cot_llm=cot_llm
+            cot_llm=cot_llm,
+            sse_protocol=sse_protocol
         ):
-            yield f"data: {json.dumps(data)}\n\n"
+            yield frame
     
-    return StreamingResponse(generate(),media_type="text/event-stream")
+    return StreamingResponse(scoped_stream(http_request, generate()), media_type="text/event-stream")
 
 @law_router.post("/asr")
 async def asr_endpoint(file: UploadFile = File(...)):
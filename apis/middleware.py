@@ -0,0 +1,56 @@
+import re
+import uuid
+from core.config import config
+from core.llms.metrics import llm_tags
+from core.llms.usage import caller_id
+from core.budget import Budget, use_budget
+
+# 客户端提供的X-Request-ID只接受有限长度的安全字符，否则重新生成
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class LLMTagMiddleware:
+    """为请求内的LLM调用打上endpoint、request_id和caller标签（纯ASGI中间件，流式响应期间标签同样有效）。
+    request_id优先使用客户端的X-Request-ID请求头（长度和字符不合规时重新生成），通过X-Request-ID响应头返回，可在 /monitor/usage/request/{request_id} 查看该请求的用量。
+    同时按配置 budget 为请求创建执行预算，客户端可以通过X-Request-Timeout请求头（秒）缩短时间预算；
+    批量任务的路由（路径中包含batch）不创建预算。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        caller = caller_id(headers.get(b"authorization", b"").decode("latin-1"))
+        budget = None if self._is_batch(scope.get("path") or "") \
+            else Budget.from_config(self._request_timeout(headers), name=request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        with llm_tags(endpoint=scope.get("path"), request_id=request_id, caller=caller), use_budget(budget):
+            await self.app(scope, receive, send_with_request_id)
+
+    @staticmethod
+    def _is_batch(path: str) -> bool:
+        return "batch" in path.strip("/").split("/")
+
+    @staticmethod
+    def _request_timeout(headers: dict) -> float | None:
+        """X-Request-Timeout请求头，不能超过配置的时间预算"""
+        try:
+            timeout = float(headers.get(b"x-request-timeout", b"").decode("latin-1"))
+        except ValueError:
+            return None
+        if timeout <= 0:
+            return None
+        limit = config.get("budget.wall_time")
+        return min(timeout, limit) if limit else timeout
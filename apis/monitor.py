@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Request
+from core.llms import http_client_pool, response_cache, single_flight, breaker_registry, limiter_registry, llm_metrics, usage_ledger
+from core.tools import tool_result_cache
+
+monitor_router = APIRouter(prefix="/monitor")
+
+@monitor_router.get("/http_pool")
+async def http_pool_stats():
+    """各上游HTTP连接池的占用情况"""
+    return {"code": 200, "error": "", "data": {"pools": http_client_pool.stats()}}
+
+@monitor_router.get("/llm_cache")
+async def llm_cache_stats():
+    """LLM响应缓存的命中情况"""
+    return {"code": 200, "error": "", "data": response_cache.stats()}
+
+@monitor_router.get("/tool_cache")
+async def tool_cache_stats():
+    """工具结果缓存的命中情况，按工具统计"""
+    return {"code": 200, "error": "", "data": tool_result_cache.stats()}
+
+@monitor_router.get("/coalescing")
+async def coalescing_stats():
+    """并发相同请求的合并情况"""
+    return {"code": 200, "error": "", "data": single_flight.stats()}
+
+@monitor_router.get("/router")
+async def router_stats(request: Request):
+    """多提供商路由的延迟、错误率和对冲统计"""
+    data = {}
+    if request.app.state.llm_router is not None:
+        data["llm"] = request.app.state.llm_router.to_dict()
+    if request.app.state.llm_cot_router is not None:
+        data["llm_cot"] = request.app.state.llm_cot_router.to_dict()
+    return {"code": 200, "error": "", "data": data}
+
+@monitor_router.get("/breakers")
+async def breaker_stats():
+    """各提供商熔断器的状态和熔断次数"""
+    return {"code": 200, "error": "", "data": {"breakers": breaker_registry.stats()}}
+
+@monitor_router.get("/rate_limits")
+async def rate_limit_stats():
+    """各提供商的限流额度、并发占用和排队时间"""
+    return {"code": 200, "error": "", "data": {"limiters": limiter_registry.stats()}}
+
+@monitor_router.get("/llm_metrics")
+async def llm_call_metrics():
+    """LLM调用的排队时间、首token时间、耗时和输出速度"""
+    return {"code": 200, "error": "", "data": llm_metrics.snapshot()}
+
+@monitor_router.get("/usage")
+async def usage_stats(dimension: str | None = None, top: int | None = None):
+    """按endpoint、提供商、模型和调用方汇总的token用量和费用，dimension只返回指定维度"""
+    return {"code": 200, "error": "", "data": usage_ledger.snapshot(dimension, top)}
+
+@monitor_router.get("/usage/request/{request_id}")
+async def request_usage(request_id: str):
+    """单个请求（响应头X-Request-ID）内所有LLM调用的用量"""
+    data = usage_ledger.request(request_id)
+    if data is None:
+        return {"code": 404, "error": f"请求 {request_id} 没有用量记录", "data": None}
+    return {"code": 200, "error": "", "data": data}
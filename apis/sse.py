@@ -0,0 +1,96 @@
+import hashlib
+import json
+from typing import Any, AsyncIterator
+from fastapi import Request
+from core.llms.stream import StreamAssembler
+from core.budget import BudgetExceeded
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，缺失时使用标准库json
+    orjson = None
+
+# 协议版本：1 每帧携带累计的完整文本（默认，兼容旧客户端）；2 每帧只携带新增片段
+PROTOCOL_FULL = 1
+PROTOCOL_DELTA = 2
+
+
+def dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data)
+
+
+def get_sse_protocol(request: Request) -> int:
+    """客户端通过查询参数 sse_protocol=2 或请求头 X-SSE-Protocol: 2 选择增量协议"""
+    value = request.query_params.get("sse_protocol") or request.headers.get("x-sse-protocol")
+    return PROTOCOL_DELTA if value == str(PROTOCOL_DELTA) else PROTOCOL_FULL
+
+
+def checksum(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def utf8_length(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+class SSEWriter:
+    """把LLM流转换为SSE帧。
+    协议1每帧为 {"answer": 累计回答, "thinking": 累计思考}；
+    协议2每帧为 {"seq": 序号, "answer": 新增回答, "thinking": 新增思考}，只包含有变化的字段，
+    结束帧附带回答和思考按UTF-8编码的字节数（answer_bytes/thinking_bytes）及sha256校验值，客户端据此确认拼接结果完整；
+    字节数与语言无关（JS中为 new TextEncoder().encode(text).length），不要用字符串长度比较，JS按UTF-16计数，与Python的字符数不同。
+    请求预算在输出过程中耗尽时停止转发，结束帧照常输出已生成的部分，并通过stopped字段给出原因。
+    """
+
+    def __init__(self, protocol: int = PROTOCOL_FULL, thinking: bool = False):
+        self.protocol = protocol
+        self.thinking = thinking
+        self.seq = 0
+        # 输出被提前终止的原因
+        self.stopped: str | None = None
+
+    def _frame(self, data: dict) -> str:
+        if self.protocol == PROTOCOL_DELTA:
+            data = {"seq": self.seq, **data}
+            self.seq += 1
+        return f"data: {dumps(data)}\n\n"
+
+    def delta(self, thinking: str | None, content: str | None, assembler: StreamAssembler) -> str:
+        if self.protocol == PROTOCOL_DELTA:
+            data = {}
+            if content:
+                data["answer"] = content
+            if self.thinking and thinking:
+                data["thinking"] = thinking
+            return self._frame(data)
+        if self.thinking:
+            return self._frame({"answer": assembler.content, "thinking": assembler.thinking})
+        return self._frame({"answer": assembler.content})
+
+    async def relay(self, stream: AsyncIterator, assembler: StreamAssembler) -> AsyncIterator[str]:
+        """转发chat流，同时把片段汇总到assembler，结束后可从assembler读取完整文本"""
+        try:
+            async for thinking, content, tool_calls in stream:
+                assembler.feed(thinking, content, tool_calls)
+                if not content and not (self.thinking and thinking) and self.protocol == PROTOCOL_DELTA:
+                    continue
+                yield self.delta(thinking, content, assembler)
+        except BudgetExceeded as e:
+            self.stopped = str(e)
+
+    def event(self, data: dict) -> str:
+        """输出自定义数据帧"""
+        return self._frame(data)
+
+    def end(self, data: dict, assembler: StreamAssembler | None = None) -> str:
+        """输出结束帧，协议2附带完整文本的UTF-8字节数和校验值"""
+        if self.stopped is not None:
+            data = {**data, "stopped": self.stopped}
+        if self.protocol == PROTOCOL_DELTA and assembler is not None:
+            data = {**data, "answer_bytes": utf8_length(assembler.content), "answer_sha256": checksum(assembler.content)}
+            if self.thinking:
+                data["thinking_bytes"] = utf8_length(assembler.thinking)
+                data["thinking_sha256"] = checksum(assembler.thinking)
+        return self._frame(data)
@@ -1,3 +1,5 @@
+import asyncio
+from typing import AsyncIterator
 from fastapi import Request
 import json5
 import json
@@ -5,17 +7,36 @@ import re
 import yaml
 from pydantic import BaseModel
 from core.config import config
+from core.scope import RequestScope, current_scope
+from core.budget import BudgetExceeded
+from .sse import dumps
+def _available(pool: dict, preferred: str):
+    """按故障转移链返回第一个熔断器未打开的提供商，全部熔断时仍返回首选。
+    选择时不占用半开探测名额：端点会同时解析多个模型依赖，名额只在实际发起调用时由before_call占用。
+    """
+    chain = [preferred] + [name for name in config.get("failover.chain", []) if name != preferred]
+    for name in chain:
+        llm = pool.get(name)
+        breaker = getattr(llm, "breaker", None)
+        if llm is not None and (breaker is None or breaker.allow()):
+            return llm
+    return pool[preferred]
+
 def get_llm(request: Request, llm_name: str | None = None):
     if llm_name is None:
-        return request.app.state.llm_list[config.current_provider]
+        if request.app.state.llm_router is not None:
+            return request.app.state.llm_router
+        return _available(request.app.state.llm_list, config.current_provider)
     else:
-        return request.app.state.llm_list[llm_name]
+        return _available(request.app.state.llm_list, llm_name)
 
 def get_llm_cot(request: Request, llm_name: str | None = None):
     if llm_name is None:
-        return request.app.state.llm_cot[config.current_provider]
+        if request.app.state.llm_cot_router is not None:
+            return request.app.state.llm_cot_router
+        return _available(request.app.state.llm_cot, config.current_provider)
     else:
-        return request.app.state.llm_cot[llm_name]
+        return _available(request.app.state.llm_cot, llm_name)
 
 def get_embedding(request: Request):
     return request.app.state.embedding
@@ -26,6 +47,61 @@ def get_milvus_store(request: Request):
 def get_reranker(request: Request):
     return request.app.state.reranker
 
+class _StreamFailed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_STREAM_DONE = object()
+
+async def scoped_stream(request: Request, body: AsyncIterator[str]) -> AsyncIterator[str]:
+    """在请求范围内生成流式响应。
+    生成过程放在范围跟踪的任务中执行，同时轮询客户端连接，断开时取消该任务、
+    关闭请求内打开的LLM流和后台任务，不再为无人接收的输出消耗提供商额度。
+    开始输出回答前请求预算已耗尽时，输出一个带stopped原因的结束帧，而不是直接断开连接。
+    """
+    scope = RequestScope(request.url.path)
+    # 有界队列：客户端读取较慢时生成过程等待，不在内存中缓冲整个响应
+    queue: asyncio.Queue = asyncio.Queue(maxsize=config.get("request_scope.stream_buffer", 8))
+
+    async def produce():
+        current_scope.set(scope)
+        try:
+            try:
+                async for item in body:
+                    await queue.put(item)
+            except BudgetExceeded as e:
+                await queue.put(f"data: {dumps({'answer': '<end>', 'stopped': str(e)})}\n\n")
+            except Exception as e:
+                await queue.put(_StreamFailed(e))
+            finally:
+                await body.aclose()
+            await queue.put(_STREAM_DONE)
+        except asyncio.CancelledError:
+            # 被取消时消费方可能已不再读取：丢弃未发送的帧，保证结束标记能写入，等待中的消费方随之退出
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_STREAM_DONE)
+            raise
+
+    async def watch_disconnect():
+        interval = config.get("request_scope.disconnect_poll_interval", 0.5)
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval)
+        scope.cancel("客户端断开连接")
+
+    scope.create_task(produce(), name=f"stream:{scope.name}")
+    scope.create_task(watch_disconnect(), name=f"disconnect:{scope.name}")
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, _StreamFailed):
+                raise item.error
+            yield item
+    finally:
+        await scope.aclose()
+
 def parse_markdown_json(text: str) -> any:
     """解析可能被markdown代码块包裹的JSON字符串"""
     # 尝试匹配```json和```之间的内容
@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
 from contextlib import asynccontextmanager
 from typing import List, Optional
-import asyncio
 from utils.log import logger
 from core.llms.base import AsyncBaseChatCOTModel
-from core.schema import AgentState, AgentDone, Message, AgentResult
+from core.schema import AgentState, Message, AgentResult
 from core.mem import AsyncMemory
+from core.scope import spawn
+from core.events import Event, EventType, EventStream, EventStreamClosed
+from core.budget import Budget, BudgetExceeded, budget_exhausted, use_budget
 
 
 class BaseAgent(ABC):
@@ -65,8 +67,12 @@ class BaseAgent(ABC):
         finally:
             self.state = previous_state  # 恢复到之前的状态
 
-    async def run(self, request: Optional[str] = None) -> list[AgentResult]:
-        """非流式异步执行代理的主循环。"""
+    async def run(self, request: Optional[str] = None, budget: Optional[Budget] = None) -> list[AgentResult]:
+        """非流式异步执行代理的主循环。budget为本次执行的预算，None时沿用当前请求的预算。"""
+        with use_budget(budget):
+            return await self._run(request)
+
+    async def _run(self, request: Optional[str]) -> list[AgentResult]:
         if self.state != AgentState.IDLE:
             raise RuntimeError(f"无法从状态运行代理: {self.state}")
 
@@ -79,9 +85,18 @@ class BaseAgent(ABC):
             while (
                 self.current_step < self.max_steps and self.state != AgentState.FINISHED
             ):
-                self.current_step += 1
-                logger.info(f"Executing step {self.current_step}/{self.max_steps}")
-                step_result = await self.step()
+                # 预算耗尽时停止，返回已完成步骤的结果
+                reason = budget_exhausted()
+                if reason is None:
+                    self.current_step += 1
+                    logger.info(f"Executing step {self.current_step}/{self.max_steps}")
+                    try:
+                        step_result = await self.step()
+                    except BudgetExceeded as e:
+                        reason = str(e)
+                if reason is not None:
+                    results.append(self._stop_for_budget(reason))
+                    return results
 
                 # Check for stuck state
                 if await self.is_stuck():
@@ -95,32 +110,59 @@ class BaseAgent(ABC):
                 results.append(AgentResult(thinking="", content="终止: 达到最大步骤"))
         return results
     
-    async def run_stream(self, request: Optional[str] = None) -> asyncio.Queue:
-        """流式异步执行代理的主循环，使用队列返回结果。"""
-        result_queue = asyncio.Queue()
-        
+    async def run_stream(self, request: Optional[str] = None, budget: Optional[Budget] = None) -> EventStream:
+        """流式异步执行代理的主循环，通过事件流返回结果。budget为本次执行的预算，None时沿用当前请求的预算。"""
+        if self.state != AgentState.IDLE:
+            raise RuntimeError(f"无法从状态运行代理: {self.state}")
+
+        events = EventStream()
+        # 在后台任务中执行，避免阻塞；任务登记在当前请求范围内，客户端断开时随请求取消
+        # 后台任务创建时复制当前上下文，预算随之传入
+        with use_budget(budget):
+            spawn(self._run_stream(events, request), name=f"agent:{self.name}")
+        return events
+
+    async def _run_stream(self, events: EventStream, request: Optional[str]):
+        reason = "执行完成"
+        try:
+            await self.run_into(events, request)
+        except EventStreamClosed:
+            reason = "消费方已关闭"
+            logger.info(f"{self.name} 的事件流已被消费方关闭，停止执行")
+        except Exception as e:
+            reason = "执行失败"
+            logger.exception(f"{self.name} 执行失败")
+            await events.emit(self._event(EventType.ERROR, f"执行失败: {e}"))
+        finally:
+            events.close(reason)
+
+    async def run_into(self, events: EventStream, request: Optional[str] = None):
+        """执行代理的主循环，把事件写入给定的事件流，执行结束后返回；不关闭事件流，由创建方负责关闭。"""
         if self.state != AgentState.IDLE:
-            result_queue.put(AgentDone(reason="代理状态错误"))
             raise RuntimeError(f"无法从状态运行代理: {self.state}")
 
         if request:
             self.request = request
             await self.memory.add(Message.user_message(request))
 
-        # 在后台任务中执行，避免阻塞
-        asyncio.create_task(self._run_and_fill_queue(result_queue))
-        
-        return result_queue
-
-    async def _run_and_fill_queue(self, queue: asyncio.Queue):
-        """内部方法，执行步骤并将结果放入队列。"""
         async with self.state_context(AgentState.RUNNING):
             while (
                 self.current_step < self.max_steps and self.state != AgentState.FINISHED
             ):
-                self.current_step += 1
-                logger.info(f"Executing step {self.current_step}/{self.max_steps}")
-                await self.step_stream(queue)
+                # 预算耗尽时停止，已输出的结果保留
+                reason = budget_exhausted()
+                if reason is None:
+                    self.current_step += 1
+                    logger.info(f"Executing step {self.current_step}/{self.max_steps}")
+                    await events.emit(self._event(EventType.STEP_START))
+                    try:
+                        await self.step_stream(events)
+                    except BudgetExceeded as e:
+                        reason = str(e)
+                if reason is not None:
+                    result = self._stop_for_budget(reason)
+                    await events.emit(self._event(EventType.CONTENT_DELTA, result.content))
+                    return
 
                 # Check for stuck state
                 if await self.is_stuck():
@@ -129,10 +171,18 @@ class BaseAgent(ABC):
             if self.current_step >= self.max_steps:
                 self.current_step = 0
                 self.state = AgentState.IDLE
-                await queue.put(f"终止: 达到最大步骤 ({self.max_steps})")
-                
-            # 标记队列已完成
-            await queue.put(AgentDone(reason="执行完成"))
+                await events.emit(self._event(EventType.CONTENT_DELTA, f"终止: 达到最大步骤 ({self.max_steps})"))
+
+    def _stop_for_budget(self, reason: str) -> AgentResult:
+        """预算耗尽时结束执行，代理回到IDLE以便之后复用"""
+        logger.warning(f"{self.name} 在第 {self.current_step} 步停止: {reason}")
+        self.current_step = 0
+        self.state = AgentState.IDLE
+        return AgentResult(thinking="", content=f"终止: 预算耗尽 ({reason})")
+
+    def _event(self, type: EventType, text: str = "", **kwargs) -> Event:
+        """创建由当前代理和步骤发出的事件"""
+        return Event(type, text, source=self.name, step=self.current_step, **kwargs)
 
     @abstractmethod
     async def step(self) -> AgentResult:
@@ -141,8 +191,8 @@ class BaseAgent(ABC):
         """
 
     @abstractmethod
-    async def step_stream(self, queue: asyncio.Queue):
-        """执行代理工作流中的单个步骤，使用流返回结果。
+    async def step_stream(self, events: EventStream):
+        """执行代理工作流中的单个步骤，把结果写入事件流。
         必须由子类实现以定义特定行为。
         """
 
@@ -153,19 +203,18 @@ class BaseAgent(ABC):
         logger.warning(f"代理检测到卡住状态。添加提示: {stuck_prompt}")
 
     async def is_stuck(self) -> bool:
-        """检查代理是否在循环中卡住，通过检测重复的内容"""
+        """检查代理是否在循环中卡住：最后一条消息与之前的assistant消息内容重复，
+        或最近几次连续以相同的工具名和参数调用工具。使用记忆维护的增量索引，不扫描全部历史。
+        """
         if len(self.memory) < 2:
             return False
 
+        if self.memory.index.last_call_repeats >= self.duplicate_threshold:
+            logger.warning(f"{self.name} 连续 {self.memory.index.last_call_repeats + 1} 次调用相同的工具和参数")
+            return True
+
         last_message = self.memory.Messages[-1]
         if not last_message.content:
             return False
 
-        # 计算相同内容的出现次数
-        duplicate_count = sum(
-            1
-            for msg in reversed(self.memory.Messages[:-1])
-            if msg.role == "assistant" and msg.content == last_message.content
-        )
-
-        return duplicate_count >= self.duplicate_threshold
\ No newline at end of file
+        return self.memory.index.content_repeats(last_message) >= self.duplicate_threshold
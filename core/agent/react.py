@@ -1,8 +1,7 @@
 from abc import ABC, abstractmethod
-from asyncio import Queue
 from core.agent.base import BaseAgent
-from core.schema import AgentResult, QueueEnd
-import asyncio
+from core.schema import AgentResult
+from core.events import EventStream
 
 class ReActAgent(BaseAgent, ABC):
     """ReAct模式的代理基类，实现"思考-行动"循环"""
@@ -17,11 +16,11 @@ class ReActAgent(BaseAgent, ABC):
     
     @abstractmethod
     async def think_stream(self):
-        """流式返回的think"""
+        """流式返回的think，产出事件"""
     
     @abstractmethod
     async def act_stream(self):
-        """流式返回的act"""
+        """流式返回的act，产出事件"""
 
     async def step(self) -> AgentResult:
         """Execute a single step: think and act."""
@@ -31,20 +30,10 @@ class ReActAgent(BaseAgent, ABC):
         result = await self.act()
         return AgentResult(thinking=thinking, content=result)
     
-    async def step_stream(self, queue: Queue):
+    async def step_stream(self, events: EventStream):
         """Execute a single step: think and act with stream"""
-        # 直接执行think_stream方法并将结果放入队列
-        think_queue = asyncio.Queue()
-        await queue.put(think_queue)
-        think_gen = self.think_stream()
-        async for result in think_gen:
-            await think_queue.put(result)
-        await think_queue.put(QueueEnd())
-            
-        # 直接执行act_stream方法并将结果放入队列
-        act_queue = asyncio.Queue()
-        await queue.put(act_queue)
-        act_gen = self.act_stream()
-        async for result in act_gen:
-            await act_queue.put(result)
-        await act_queue.put(QueueEnd())
+        # think_stream和act_stream产出的事件直接写入事件流
+        async for event in self.think_stream():
+            await events.emit(event)
+        async for event in self.act_stream():
+            await events.emit(event)
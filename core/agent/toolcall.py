@@ -1,11 +1,16 @@
+import asyncio
 import json
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 from core.agent.react import ReActAgent
-from utils.log import logger
-from core.schema import AgentState, Message, ToolCall, ToolChoice, AgentResultStream
+from utils.log import logger, payload
+from core.schema import AgentState, Message, ToolCall, ToolChoice
+from core.events import EventType
 from core.tools import ToolCollection
-from core.llms import AsyncBaseChatCOTModel
-from core.mem import AsyncMemory
+from core.tools.cache import make_tool_key
+from core.scope import spawn
+from core.llms import AsyncBaseChatCOTModel, TokenLimitExceeded, StreamAssembler, llm_tags
+from core.mem import AsyncMemory, ContextCompactor
+from core.config import config
 
 SYSTEM_PROMPT = """
 # {name}
@@ -44,6 +49,9 @@ class ToolCallAgent(ReActAgent):
         tool_choices: str = ToolChoice.AUTO,
         max_steps: int = 30,
         max_observe: Optional[Union[int, bool]] = None,
+        parallel_tools: bool = True,
+        compactor: Optional[ContextCompactor] = None,
+        speculative_tools: bool = True,
         **kwargs
     ):
         super().__init__(
@@ -65,8 +73,17 @@ class ToolCallAgent(ReActAgent):
         self.tool_choices = tool_choices
             
         self.tool_calls = []
-        self._current_base64_image = None
+        self._tool_images = {}
         self.max_observe = max_observe
+        self.parallel_tools = parallel_tools
+        # 流式生成时提前执行参数已完整的幂等工具调用，键为工具名+规范化参数
+        self.speculative_tools = speculative_tools
+        self._speculative: Dict[str, asyncio.Task] = {}
+        # 上下文压缩，未传入时按配置创建
+        if compactor is None and config.get("compaction.enable", True):
+            compactor = ContextCompactor()
+        self.compactor = compactor
+        self.remaining_budget = None
 
     async def think(self) -> tuple[str, str]:
         """处理当前状态并决定下一步操作使用工具"""
@@ -74,15 +91,17 @@ class ToolCallAgent(ReActAgent):
         if not await self.memory.has_system() and self.system_prompt:
             await self.memory.add_system(Message.system_message(self.system_prompt))
 
-        thinking, content, tool_calls = await self.llm.chat(
-            messages=self.memory.Messages,
-            tools=self.available_tools.to_params(),
-            tool_choice=self.tool_choices,
-            stream=False,
-        )
+        tools = await self._prepare_context()
+        with llm_tags(agent=self.name):
+            thinking, content, tool_calls = await self.llm.chat(
+                messages=self.memory.Messages,
+                tools=tools,
+                tool_choice=self.tool_choices,
+                stream=False,
+            )
         self.tool_calls = tool_calls
         # 记录响应信息
-        logger.info(f"✨ {self.name}'s thoughts: {content}")
+        logger.info("✨ %s's thoughts: %s", self.name, payload(content))
         logger.info(
             f"🛠️ {self.name} 选择了 {len(tool_calls) if tool_calls else 0} 个工具"
         )
@@ -90,7 +109,7 @@ class ToolCallAgent(ReActAgent):
             logger.info(
                 f"🧰 正在准备工具: {[call.function.name for call in tool_calls]}"
             )
-            logger.info(f"🔧 工具参数: {[call.function.arguments for call in tool_calls]}")
+            logger.info("🔧 工具参数: %s", payload([call.function.arguments for call in tool_calls]))
             
         if not tool_calls:
             self.state = AgentState.FINISHED
@@ -103,101 +122,254 @@ class ToolCallAgent(ReActAgent):
         await self.memory.add(assistant_msg)
         return thinking, content, bool(tool_calls)
 
-    async def act(self) -> str:
-        """执行工具调用并处理其结果"""
-        results = []
-        for command in self.tool_calls:
-            # 为每个工具调用重置base64_image
-            self._current_base64_image = None
-            result = await self.execute_tool(command)
+    async def _prepare_context(self) -> List[dict]:
+        """调用LLM前准备上下文：超过阈值时压缩记忆，再检查上下文预算，返回工具定义"""
+        tools = self.available_tools.to_params()
+        if self.compactor is not None:
+            await self.compactor.maybe_compact(self.llm, self.memory, tools, name=self.name)
+        return self._check_budget(tools)
+
+    def _check_budget(self, tools: List[dict]) -> List[dict]:
+        """计算本次调用剩余的上下文预算，超出时直接报错，避免一次注定失败的请求"""
+        self.remaining_budget = self.llm.remaining_budget(self.memory.Messages, tools)
+        logger.debug(f"{self.name} 剩余上下文预算: {self.remaining_budget} tokens")
+        if self.remaining_budget < 0:
+            raise TokenLimitExceeded(
+                f"{self.name} 的上下文超出模型限制 {-self.remaining_budget} tokens"
+            )
+        return tools
+
+    def _batches(self, tool_calls: List[ToolCall]) -> List[List[ToolCall]]:
+        """按原顺序把工具调用分批：连续的可并行工具调用为一批并发执行，其余调用各自单独成批"""
+        batches: List[List[ToolCall]] = []
+        previous_parallel = False
+        for command in tool_calls:
+            parallel = bool(self.parallel_tools and command.function and
+                            self.available_tools.is_parallel_safe(command.function.name))
+            if parallel and previous_parallel:
+                batches[-1].append(command)
+            else:
+                batches.append([command])
+            previous_parallel = parallel
+        return batches
+
+    async def _observe(self, command: ToolCall):
+        """执行单个工具调用，产出（输出，是否为部分输出），完整结果按max_observe截断"""
+        async for text, partial in self.execute_tool_stream(command):
+            if partial:
+                yield text, True
+                continue
             if self.max_observe:
-                result = result[: self.max_observe]
-            logger.info(f"🎯 工具 '{command.function.name}' 完成任务！结果: {result}")
-            # 将工具响应添加到记忆中
-            tool_msg = Message.tool_message(
-                content=result,
-                tool_call_id=command.id,
-                name=command.function.name,
-                base64_image=self._current_base64_image,
+                text = text[: self.max_observe]
+            logger.info(
+                "🎯 工具 '%s' 完成任务！结果: %s", command.function.name, payload(text),
+                extra={"sample": "tool_result"},
             )
-            await self.memory.add(tool_msg)
-            results.append(result)
+            yield text, False
+
+    def _speculate(self, tool_calls: List[ToolCall]):
+        """在模型生成结束前提前执行参数已完整的幂等工具调用。
+        只执行从第一个开始连续的幂等调用，避免越过有副作用的调用先读到旧数据；
+        最终的工具调用与提前执行的名称或参数不一致时，结果在本轮结束时丢弃。
+        """
+        for call in tool_calls:
+            tool = self.available_tools.get_tool(call.function.name)
+            if tool is None or not tool.idempotent:
+                return
+            try:
+                args = json.loads(call.function.arguments or "{}")
+            except ValueError:
+                return
+            key = make_tool_key(call.function.name, "", args)
+            if key not in self._speculative:
+                logger.info(f"⏩ 提前执行工具: '{call.function.name}'")
+                self._speculative[key] = spawn(
+                    self.available_tools.execute(name=call.function.name, tool_input=args),
+                    name=f"speculative:{call.function.name}",
+                )
+
+    def _discard_speculative(self):
+        """丢弃未被使用的提前执行结果"""
+        for task in self._speculative.values():
+            if task.done() and not task.cancelled():
+                # 取出异常，避免未使用的失败任务在回收时报警
+                task.exception()
+            task.cancel()
+        if self._speculative:
+            logger.info(f"丢弃 {len(self._speculative)} 个未使用的提前执行结果")
+        self._speculative.clear()
+
+    async def _run_tool_calls(self):
+        """执行本轮的工具调用，产出（序号，工具调用，输出，是否为部分输出）。
+        批与批之间按顺序执行；同一批内的调用并发执行，输出按完成顺序产出。
+        """
+        try:
+            async for item in self._run_batches():
+                yield item
+        finally:
+            self._discard_speculative()
+
+    async def _run_batches(self):
+        index = 0
+        for batch in self._batches(self.tool_calls):
+            if len(batch) == 1:
+                async for text, partial in self._observe(batch[0]):
+                    yield index, batch[0], text, partial
+                index += 1
+                continue
+
+            logger.info(f"⚡ 并发执行工具: {[command.function.name for command in batch]}")
+            outputs: asyncio.Queue = asyncio.Queue()
+
+            async def run(position: int, command: ToolCall):
+                try:
+                    async for text, partial in self._observe(command):
+                        outputs.put_nowait((position, command, text, partial))
+                except Exception as e:
+                    logger.exception(f"工具 '{command.function.name}' 执行失败")
+                    outputs.put_nowait((position, command, f"错误: {type(e).__name__}: {e}", False))
 
-        return "\n\n".join(results)
+            tasks = [asyncio.create_task(run(index + offset, command)) for offset, command in enumerate(batch)]
+            try:
+                remaining = len(batch)
+                while remaining:
+                    item = await outputs.get()
+                    if not item[3]:
+                        remaining -= 1
+                    yield item
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            index += len(batch)
+
+    def _tool_message(self, command: ToolCall, result: str) -> Message:
+        return Message.tool_message(
+            content=result,
+            tool_call_id=command.id,
+            name=command.function.name,
+            base64_image=self._tool_images.pop(command.id, None),
+        )
+
+    async def _commit_results(self, finished: dict, next_index: int) -> int:
+        """按工具调用的原顺序把已完成的结果写入记忆，返回下一个待写入的序号"""
+        while next_index in finished:
+            command, result = finished.pop(next_index)
+            await self.memory.add(self._tool_message(command, result))
+            next_index += 1
+        return next_index
+
+    async def act(self) -> str:
+        """执行工具调用并处理其结果，结果按工具调用的原顺序写入记忆"""
+        results = {}
+        finished, next_index = {}, 0
+        async for index, command, result, partial in self._run_tool_calls():
+            if partial:
+                continue
+            results[index] = result
+            # 将工具响应添加到记忆中
+            finished[index] = (command, result)
+            next_index = await self._commit_results(finished, next_index)
+
+        return "\n\n".join(results[index] for index in sorted(results))
 
     async def think_stream(self):
-        """流式返回的think"""
+        """流式返回的think：思考和回答按增量事件产出，结束后为每个工具调用产出一个事件"""
         self.tool_calls = []
         if not await self.memory.has_system() and self.system_prompt:
             await self.memory.add_system(Message.system_message(self.system_prompt))
 
-        gen = await self.llm.chat(
-            messages=self.memory.Messages,
-            tools=self.available_tools.to_params(),
-            tool_choice=self.tool_choices,
-            stream=True,
-        )
-        all_thinking = ""
-        all_content = ""
+        self._discard_speculative()
+        tools = await self._prepare_context()
+        with llm_tags(agent=self.name):
+            gen = await self.llm.chat(
+                messages=self.memory.Messages,
+                tools=tools,
+                tool_choice=self.tool_choices,
+                stream=True,
+            )
+        assembler = StreamAssembler()
         async for think, content, tool_calls in gen:
             if tool_calls:
+                # 工具调用列表可能多次出现（参数完整的调用先返回），以最后一次为准
                 self.tool_calls = tool_calls
-                logger.info(f"🧰 正在准备工具: {[call.function.name for call in tool_calls]}")
-                logger.info(f"🔧 工具参数: {[call.function.arguments for call in tool_calls]}")
-            all_thinking += think
-            all_content += content
-            yield AgentResultStream(thinking=all_thinking, content=all_content, tool_calls=tool_calls)
+                if self.speculative_tools:
+                    self._speculate(tool_calls)
+            assembler.feed(think, content, tool_calls)
+            if think:
+                yield self._event(EventType.THINKING_DELTA, think)
+            if content:
+                yield self._event(EventType.CONTENT_DELTA, content)
 
-        if not tool_calls:
+        tool_calls = assembler.tool_calls
+        if tool_calls:
+            logger.info(f"🧰 正在准备工具: {[call.function.name for call in tool_calls]}")
+            logger.info("🔧 工具参数: %s", payload([call.function.arguments for call in tool_calls]))
+        else:
             self.state = AgentState.FINISHED
+        for call in tool_calls or []:
+            yield self._event(EventType.TOOL_CALL, tool_call=call, tool_call_id=call.id)
 
         assistant_msg = (
-            Message.from_tool_calls(content=all_content, tool_calls=tool_calls)
+            Message.from_tool_calls(content=assembler.content, tool_calls=tool_calls)
             if tool_calls
-            else Message.assistant_message(all_content)
+            else Message.assistant_message(assembler.content)
         )
         await self.memory.add(assistant_msg)
 
     async def act_stream(self):
-        """流式返回的act"""
-        for command in self.tool_calls:
-            # 为每个工具调用重置base64_image
-            self._current_base64_image = None
-            result = await self.execute_tool(command)
-            if self.max_observe:
-                result = result[: self.max_observe]
-            logger.info(f"🎯 工具 '{command.function.name}' 完成任务！结果: {result}")
-            # 将工具响应添加到记忆中
-            tool_msg = Message.tool_message(
-                content=result,
-                tool_call_id=command.id,
-                name=command.function.name,
-                base64_image=self._current_base64_image,
-            )
-            await self.memory.add(tool_msg)
-            yield AgentResultStream(thinking="", content=result, tool_calls=[])
+        """流式返回的act：每个工具完成（或产生部分输出）时立即返回，并带上对应的tool_call_id。
+        写入记忆的顺序与工具调用的原顺序一致，不受完成先后影响。
+        """
+        finished, next_index = {}, 0
+        async for index, command, result, partial in self._run_tool_calls():
+            if not partial:
+                # 将工具响应添加到记忆中
+                finished[index] = (command, result)
+                next_index = await self._commit_results(finished, next_index)
+            yield self._event(EventType.TOOL_OUTPUT if partial else EventType.TOOL_RESULT, result, tool_call_id=command.id)
 
     async def execute_tool(self, command: ToolCall) -> str:
         """执行单个工具调用，具有健壮的错误处理"""
+        observation = ""
+        async for text, partial in self.execute_tool_stream(command):
+            if not partial:
+                observation = text
+        return observation
+
+    async def execute_tool_stream(self, command: ToolCall):
+        """流式执行单个工具调用，产出（输出，是否为部分输出），最后一项为完整的观察结果"""
         if not command or not command.function or not command.function.name:
-            return "错误: 无效的命令格式"
+            yield "错误: 无效的命令格式", False
+            return
 
         name = command.function.name
         if name not in self.available_tools.tool_map:
-            return f"错误: 未知工具 '{name}'"
+            yield f"错误: 未知工具 '{name}'", False
+            return
 
         try:
             # 解析参数
             args = json.loads(command.function.arguments or "{}")
 
-            # 执行工具
-            logger.info(f"🔧 激活工具: '{name}'...")
-            result = await self.available_tools.execute(name=name, tool_input=args)
+            speculative = self._speculative.pop(make_tool_key(name, "", args), None)
+            if speculative is not None:
+                # 模型生成时已提前执行且名称和参数一致，直接使用其结果
+                logger.info(f"🔧 使用提前执行的工具结果: '{name}'")
+                result = await speculative
+            else:
+                # 执行工具，工具产出的最后一项为完整结果，之前的各项为部分输出
+                logger.info(f"🔧 激活工具: '{name}'...")
+                result, has_result = None, False
+                async for item in self.available_tools.execute_stream(name=name, tool_input=args):
+                    if has_result:
+                        yield str(result), True
+                    result, has_result = item, True
 
             # 检查result是否是包含base64_image的ToolResult
             if hasattr(result, "base64_image") and result.base64_image:
-                # 存储base64_image以供稍后在tool_message中使用
-                self._current_base64_image = result.base64_image
+                # 按工具调用ID存储base64_image以供稍后在tool_message中使用，并发执行时互不覆盖
+                self._tool_images[command.id] = result.base64_image
 
             # 格式化结果以供显示
             observation = (
@@ -205,14 +377,14 @@ class ToolCallAgent(ReActAgent):
                 if result
                 else f"命令 `{name}` 完成但没有输出"
             )
-            return observation
         except json.JSONDecodeError:
             error_msg = f"错误: 解析参数 {name}: 无效的JSON格式"
             logger.error(
                 f"📝 Oops! 参数 '{name}' 不正确 - 无效的JSON, 参数:{command.function.arguments}"
             )
-            return f"错误: {error_msg}"
+            observation = f"错误: {error_msg}"
         except Exception as e:
             error_msg = f"⚠️ 工具 '{name}' 遇到问题: {str(e)}"
             logger.exception(error_msg)
-            return f"错误: {error_msg}"
\ No newline at end of file
+            observation = f"错误: {error_msg}"
+        yield observation, False
@@ -0,0 +1,118 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from core.config import config
+
+# 当前请求的执行预算，在API层或调用方创建，经由流程、代理、LLM调用和工具逐层传递
+current_budget: ContextVar["Budget | None"] = ContextVar("budget", default=None)
+
+
+class BudgetExceeded(Exception):
+    """执行预算（时间、LLM调用次数或token数）已耗尽"""
+
+
+class Budget:
+    """一次请求的执行预算：截止时间、LLM调用次数和token数上限，None表示不限制。
+    各层在发起LLM调用或执行工具前检查预算，并把自身的超时缩短到剩余时间；预算耗尽时停止后续步骤，返回已有结果。
+    """
+
+    def __init__(self,
+                 wall_time: float | None = None,
+                 max_llm_calls: int | None = None,
+                 max_tokens: int | None = None,
+                 name: str = ""):
+        self.name = name
+        self.wall_time = wall_time
+        self.deadline = time.monotonic() + wall_time if wall_time else None
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self.llm_calls = 0
+        self.tokens = 0
+
+    @classmethod
+    def from_config(cls, wall_time: float | None = None, name: str = "") -> "Budget | None":
+        """按配置 budget 创建请求的默认预算，未配置任何上限时返回None"""
+        wall_time = wall_time or config.get("budget.wall_time")
+        max_llm_calls = config.get("budget.max_llm_calls")
+        max_tokens = config.get("budget.max_tokens")
+        if not (wall_time or max_llm_calls or max_tokens):
+            return None
+        return cls(wall_time=wall_time, max_llm_calls=max_llm_calls, max_tokens=max_tokens, name=name)
+
+    def remaining_time(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, default: float | None) -> float | None:
+        """把超时缩短到剩余时间，两者都不限制时返回None"""
+        remaining = self.remaining_time()
+        if remaining is None:
+            return default
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+    @property
+    def exhausted_reason(self) -> str | None:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return f"超过时间预算 {self.wall_time}秒"
+        if self.max_llm_calls is not None and self.llm_calls >= self.max_llm_calls:
+            return f"LLM调用次数达到上限 {self.max_llm_calls}"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"token数达到上限 {self.max_tokens}"
+        return None
+
+    @property
+    def exhausted(self) -> bool:
+        return self.exhausted_reason is not None
+
+    def _error(self, reason: str) -> BudgetExceeded:
+        owner = f"请求 {self.name} 的" if self.name else ""
+        return BudgetExceeded(f"{owner}预算已耗尽: {reason}")
+
+    def check(self):
+        reason = self.exhausted_reason
+        if reason is not None:
+            raise self._error(reason)
+
+    def check_deadline(self):
+        """流式输出过程中只检查时间预算，调用次数和token数在发起调用时检查"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise self._error(f"超过时间预算 {self.wall_time}秒")
+
+    def start_llm_call(self):
+        """发起LLM调用前检查预算并计数"""
+        self.check()
+        self.llm_calls += 1
+
+    def add_tokens(self, tokens: int):
+        self.tokens += tokens
+
+    def to_dict(self) -> dict:
+        return {
+            "remaining_time": self.remaining_time(),
+            "llm_calls": self.llm_calls,
+            "max_llm_calls": self.max_llm_calls,
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+        }
+
+
+def budget_exhausted() -> str | None:
+    """当前预算已耗尽时返回原因，没有预算或未耗尽时返回None"""
+    budget = current_budget.get()
+    return budget.exhausted_reason if budget is not None else None
+
+
+@contextmanager
+def use_budget(budget: "Budget | None"):
+    """在上下文中使用给定的预算，budget为None时沿用外层的预算"""
+    if budget is None:
+        yield current_budget.get()
+        return
+    token = current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        current_budget.reset(token)
@@ -0,0 +1,118 @@
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Any, Deque, Optional
+from core.config import config
+
+
+class EventType(str, Enum):
+    """代理和流程输出的事件类型"""
+
+    STEP_START = "step_start"
+    THINKING_DELTA = "thinking_delta"
+    CONTENT_DELTA = "content_delta"
+    TOOL_CALL = "tool_call"
+    # 工具执行过程中的部分输出
+    TOOL_OUTPUT = "tool_output"
+    TOOL_RESULT = "tool_result"
+    ERROR = "error"
+    DONE = "done"
+
+
+class Event:
+    """事件流中的一个事件。增量事件只携带新增的文本，由消费方自行拼接"""
+
+    __slots__ = ("type", "text", "source", "step", "tool_call", "tool_call_id")
+
+    def __init__(self,
+                 type: EventType,
+                 text: str = "",
+                 source: str = "",
+                 step: Optional[int] = None,
+                 tool_call: Any = None,
+                 tool_call_id: Optional[str] = None):
+        self.type = type
+        self.text = text
+        self.source = source
+        self.step = step
+        self.tool_call = tool_call
+        self.tool_call_id = tool_call_id
+
+    def to_dict(self) -> dict:
+        data = {"type": self.type.value, "text": self.text, "source": self.source}
+        if self.step is not None:
+            data["step"] = self.step
+        if self.tool_call is not None:
+            data["tool_call"] = self.tool_call.model_dump() if hasattr(self.tool_call, "model_dump") else self.tool_call
+        if self.tool_call_id is not None:
+            data["tool_call_id"] = self.tool_call_id
+        return data
+
+    def __repr__(self) -> str:
+        return f"Event({self.type.value}, source={self.source!r}, step={self.step}, text={self.text[:50]!r})"
+
+
+class EventStreamClosed(Exception):
+    """消费方已关闭事件流，生产方应停止执行"""
+
+
+class EventStream:
+    """有界的单消费者事件流：缓冲区满时emit等待消费方读取（背压），消费方通过async for读取。
+    生产方结束时调用close，消费方读到DONE事件后迭代结束；消费方提前退出时调用aclose，之后的emit抛出EventStreamClosed。
+    """
+
+    def __init__(self, max_buffer: int | None = None):
+        self.max_buffer = max_buffer or config.get("agent.event_buffer", 256)
+        self._buffer: Deque[Event] = deque()
+        self._done: Event | None = None
+        self._done_sent = False
+        self._consumer_closed = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    @property
+    def closed(self) -> bool:
+        return self._done is not None or self._consumer_closed
+
+    async def emit(self, event: Event):
+        while len(self._buffer) >= self.max_buffer and not self.closed:
+            self._writable.clear()
+            await self._writable.wait()
+        if self._consumer_closed:
+            raise EventStreamClosed()
+        if self._done is not None:
+            raise RuntimeError("事件流已结束，不能再写入事件")
+        self._buffer.append(event)
+        self._readable.set()
+
+    def close(self, reason: str = "执行完成"):
+        """生产方结束，缓冲区中的事件读完后输出DONE事件；不会阻塞，可以在finally和取消时调用"""
+        if self._done is None:
+            self._done = Event(EventType.DONE, reason)
+            self._readable.set()
+            self._writable.set()
+
+    async def aclose(self):
+        """消费方提前退出，丢弃未读取的事件并让等待中的生产方停止"""
+        self._consumer_closed = True
+        self._buffer.clear()
+        self._readable.set()
+        self._writable.set()
+
+    def __aiter__(self) -> "EventStream":
+        return self
+
+    async def __anext__(self) -> Event:
+        while not self._buffer:
+            if self._consumer_closed or self._done_sent:
+                raise StopAsyncIteration
+            if self._done is not None:
+                self._done_sent = True
+                return self._done
+            self._readable.clear()
+            await self._readable.wait()
+        event = self._buffer.popleft()
+        if len(self._buffer) < self.max_buffer:
+            self._writable.set()
+        return event
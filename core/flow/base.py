@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional, Union
 from core.agent import BaseAgent
-import asyncio
+from core.events import EventStream
 class BaseFlow(ABC):
     """支持多个代理的执行流程基类"""
 
@@ -36,5 +36,5 @@ class BaseFlow(ABC):
         self.agents[key] = agent
 
     @abstractmethod
-    async def execute(self, input_text: str) -> asyncio.Queue:
-        """执行流程，以流式方式返回结果，返回的队列中，每个元素是一个asyncio.Queue，用于存储每个步骤的结果"""
\ No newline at end of file
+    async def execute(self, input_text: str) -> EventStream:
+        """执行流程，以流式方式返回结果：返回的事件流依次包含各步骤的开始、增量文本、工具调用和结果，最后为DONE事件"""
\ No newline at end of file
@@ -1,14 +1,16 @@
 import json
 import time
-import asyncio
 from enum import Enum
 from typing import Dict, List, Optional
 from core.agent.base import BaseAgent
 from core.flow.base import BaseFlow
-from core.llms import AsyncBaseChatCOTModel
-from utils.log import logger
-from core.schema import AgentState, Message, ToolChoice, AgentResultStream, AgentDone, QueueEnd
+from core.llms import AsyncBaseChatCOTModel, StreamAssembler, llm_tags
+from utils.log import logger, payload
+from core.schema import AgentState, Message, ToolChoice
 from core.tools import PlanningTool
+from core.scope import spawn
+from core.events import Event, EventType, EventStream, EventStreamClosed
+from core.budget import Budget, BudgetExceeded, budget_exhausted, use_budget
 
 
 class PlanStepStatus(str, Enum):
@@ -113,47 +115,50 @@ class PlanningFlow(BaseFlow):
         # 回退到主代理
         return self.primary_agent
 
-    async def execute(self, input_text: str) -> asyncio.Queue:
-        """执行计划流程，以流式方式返回结果"""
-        result_queue = asyncio.Queue()
-        
-        try:
-            if not self.primary_agent:
-                raise ValueError("没有可用的主代理")
+    async def execute(self, input_text: str, budget: Optional[Budget] = None) -> EventStream:
+        """执行计划流程，通过事件流以流式方式返回结果。budget为整个流程的预算，None时沿用当前请求的预算"""
+        if not self.primary_agent:
+            raise ValueError("没有可用的主代理")
 
-            # 启动一个独立的任务来执行流程并填充队列
-            asyncio.create_task(self._execute_flow(input_text, result_queue))
-            
-            return result_queue
+        events = EventStream()
+        # 启动一个独立的任务来执行流程并写入事件流，任务登记在当前请求范围内；任务复制当前上下文，预算随之传入
+        with use_budget(budget):
+            spawn(self._run_flow(input_text, events), name=f"flow:{self.active_plan_id}")
+        return events
+
+    def _event(self, type: EventType, text: str = "", **kwargs) -> Event:
+        return Event(type, text, source="planning", step=self.current_step_index, **kwargs)
+
+    async def _run_flow(self, input_text: str, events: EventStream):
+        reason = "执行完成"
+        try:
+            await self._execute_flow(input_text, events)
+        except EventStreamClosed:
+            reason = "消费方已关闭"
+            logger.info(f"计划 {self.active_plan_id} 的事件流已被消费方关闭，停止执行")
+        except BudgetExceeded as e:
+            reason = "预算耗尽"
+            logger.warning(f"计划 {self.active_plan_id} 停止: {e}")
+            await events.emit(self._event(EventType.ERROR, str(e)))
         except Exception as e:
-            logger.error(f"PlanningFlow 错误: {str(e)}")
-            error_queue = asyncio.Queue()
-            error_stream = AgentResultStream(thinking="", content=f"执行失败: {str(e)}", tool_calls=[])
-            await error_queue.put(error_stream)
-            await error_queue.put(QueueEnd())
-            await result_queue.put(error_queue)
-            return result_queue
-
-    async def _execute_flow(self, input_text: str, result_queue: asyncio.Queue):
+            reason = "执行失败"
+            logger.exception(f"PlanningFlow 错误: {e}")
+            await events.emit(self._event(EventType.ERROR, f"执行失败: {e}"))
+        finally:
+            events.close(reason)
+
+    async def _execute_flow(self, input_text: str, events: EventStream):
         """具体执行流程的内部方法"""
-            # 如果提供了输入，则创建初始计划
+        # 如果提供了输入，则创建初始计划
         if input_text:
-            create_plan_queue = asyncio.Queue()
-            await result_queue.put(create_plan_queue)
-            await self._create_initial_plan(input_text, create_plan_queue)
-                
+            await self._create_initial_plan(input_text, events)
+
             # 确认计划是否成功创建
             if self.active_plan_id not in self.planning_tool.plans:
                 logger.error(
                     f"计划创建失败. 计划 ID {self.active_plan_id} 未在计划工具中找到."
                 )
-                await create_plan_queue.put(AgentResultStream(
-                    thinking="", 
-                    content=f"计划创建失败: {input_text}", 
-                    tool_calls=[]
-                ))
-                await create_plan_queue.put(QueueEnd())
-                await result_queue.put(AgentDone())
+                await events.emit(self._event(EventType.ERROR, f"计划创建失败: {input_text}"))
                 return
 
         while True:
@@ -162,21 +167,25 @@ class PlanningFlow(BaseFlow):
 
             # 如果没有任何步骤或计划完成，则退出
             if self.current_step_index is None:
-                await self._finalize_plan(result_queue)
+                await self._finalize_plan(events)
+                break
+
+            # 预算耗尽时跳过剩余步骤，返回当前的计划状态
+            reason = budget_exhausted()
+            if reason is not None:
+                await self._stop_for_budget(reason, events)
                 break
 
             # 使用适当的代理执行当前步骤
             agent_name = step_info.get("agent_name") if step_info else None
             executor = self.get_executor(agent_name)
-            await self._execute_step(executor, step_info, result_queue)
+            await self._execute_step(executor, step_info, events)
 
             # 检查代理是否想要终止
             if hasattr(executor, "state") and executor.state == AgentState.FINISHED:
                 break
 
-        await result_queue.put(AgentDone())
-
-    async def _create_initial_plan(self, request: str, result_queue: asyncio.Queue):
+    async def _create_initial_plan(self, request: str, events: EventStream):
         """使用流程的LLM和PlanningTool基于请求创建初始计划。"""
         logger.info(f"正在创建初始计划: {self.active_plan_id}")
 
@@ -193,34 +202,30 @@ class PlanningFlow(BaseFlow):
         )
 
         # 使用PlanningTool调用LLM (流式)
-        gen = await self.llm.chat(
-            messages=[system_message, user_message],
-            tools=[self.planning_tool.to_param()],
-            tool_choice=ToolChoice.AUTO,
-            stream=True,
-        )
+        with llm_tags(agent="planning"):
+            gen = await self.llm.chat(
+                messages=[system_message, user_message],
+                tools=[self.planning_tool.to_param()],
+                tool_choice=ToolChoice.AUTO,
+                stream=True,
+            )
 
-        all_thinking = ""
-        all_content = ""
-        tool_calls = []
-        
-        # 处理流式响应
+        assembler = StreamAssembler()
+        await events.emit(self._event(EventType.STEP_START, "创建计划"))
+
+        # 处理流式响应，增量写入事件流
         async for thinking, content, calls in gen:
-            all_thinking += thinking
-            all_content += content
-            if calls:
-                tool_calls = calls
-            
-            # 将中间结果发送到队列
-            await result_queue.put(AgentResultStream(
-                thinking=all_thinking,
-                content=all_content,
-                tool_calls=tool_calls
-            ))
+            assembler.feed(thinking, content, calls)
+            if thinking:
+                await events.emit(self._event(EventType.THINKING_DELTA, thinking))
+            if content:
+                await events.emit(self._event(EventType.CONTENT_DELTA, content))
+        tool_calls = assembler.tool_calls
 
         # 如果存在工具调用，则处理它们
         if tool_calls:
             for tool_call in tool_calls:
+                await events.emit(self._event(EventType.TOOL_CALL, tool_call=tool_call, tool_call_id=tool_call.id))
                 if tool_call.function.name == "planning":
                     # 解析参数
                     args = tool_call.function.arguments
@@ -234,15 +239,10 @@ class PlanningFlow(BaseFlow):
                     # 执行工具并获取结果
                     result = await self.planning_tool.execute(**args)
                     
-                    # 将工具执行结果发送到队列
-                    await result_queue.put(AgentResultStream(
-                        thinking="",
-                        content=str(result),
-                        tool_calls=[]
-                    ))
-                    
-                    logger.info(f"计划创建结果: {str(result)}")
-                    await result_queue.put(QueueEnd())
+                    # 将工具执行结果写入事件流
+                    await events.emit(self._event(EventType.TOOL_RESULT, str(result), tool_call_id=tool_call.id))
+
+                    logger.info("计划创建结果: %s", payload(str(result)))
                     return
 
         # 如果执行到达这里，则创建一个默认计划
@@ -258,15 +258,8 @@ class PlanningFlow(BaseFlow):
             }
         )
         
-        # 将默认计划结果发送到队列
-        await result_queue.put(AgentResultStream(
-            thinking="",
-            content=str(default_result),
-            tool_calls=[]
-        ))
-        
-        await result_queue.put(QueueEnd())
-        return
+        # 将默认计划结果写入事件流
+        await events.emit(self._event(EventType.TOOL_RESULT, str(default_result)))
 
     async def _get_current_step_info(self) -> tuple[Optional[int], Optional[dict]]:
         """
@@ -299,8 +292,8 @@ class PlanningFlow(BaseFlow):
             logger.warning(f"查找当前步骤索引时出错: {e}")
             return None, None
 
-    async def _execute_step(self, executor: BaseAgent, step_info: dict, queue: asyncio.Queue):
-        """使用指定的代理执行当前步骤，使用agent.run_stream()。"""
+    async def _execute_step(self, executor: BaseAgent, step_info: dict, events: EventStream):
+        """使用指定的代理执行当前步骤，代理的事件直接写入流程的事件流。"""
         # 准备当前计划状态的上下文
         plan_status = await self._get_plan_text()
         step_text = step_info.get("step", f"步骤 {self.current_step_index}")
@@ -315,39 +308,20 @@ class PlanningFlow(BaseFlow):
 
         请使用适当的工具执行此步骤。请注意你只需要完成当前步骤即可，不需要完成整个计划。完成后，提供你完成的总结。
         """
-        step_queue = asyncio.Queue()
-        await queue.put(step_queue)
+        await events.emit(self._event(EventType.STEP_START, step_text))
 
-        # 使用agent.run_stream()执行步骤
         try:
-            step_result_queue = await executor.run_stream(step_prompt)
-            await self._step_result_to_one_step_queue(step_queue, step_result_queue)
-            return
+            await executor.run_into(events, step_prompt)
+        except EventStreamClosed:
+            raise
         except Exception as e:
             logger.error(f"执行步骤 {self.current_step_index} 时出错: {e}")
-            error_queue = asyncio.Queue()
-            await error_queue.put(AgentResultStream(
-                thinking="",
-                content=f"执行步骤 {self.current_step_index} 时出错: {str(e)}",
-                tool_calls=[]
-            ))
-            await error_queue.put(QueueEnd())
-            return error_queue
-
-    async def _step_result_to_one_step_queue(self, step_queue: asyncio.Queue, step_result_queue: asyncio.Queue):
-        """等待步骤执行完成后标记为已完成"""
-        # 等待队列中的所有项目
-        while True:
-            item = await step_result_queue.get()
-            if isinstance(item, AgentDone):
-                break
-            if isinstance(item, asyncio.Queue):
-                while True:
-                    result = await item.get()
-                    if isinstance(result, QueueEnd):
-                        break
-                    await step_queue.put(result)
-        await step_queue.put(QueueEnd())
+            await events.emit(self._event(EventType.ERROR, f"执行步骤 {self.current_step_index} 时出错: {str(e)}"))
+            return
+
+        # 代理因预算耗尽而停止时，步骤保持进行中
+        if budget_exhausted() is not None:
+            return
 
         # 标记步骤为已完成
         await self._mark_step_completed()
@@ -428,11 +402,20 @@ class PlanningFlow(BaseFlow):
             logger.error(f"从存储生成计划文本时出错: {e}")
             return f"Error: 无法检索 ID {self.active_plan_id} 的计划"
 
-    async def _finalize_plan(self, total_queue: asyncio.Queue):
+    async def _stop_for_budget(self, reason: str, events: EventStream, plan_text: Optional[str] = None):
+        """预算耗尽时不再调用LLM，直接返回当前的计划状态"""
+        logger.warning(f"计划 {self.active_plan_id} 在步骤 {self.current_step_index} 停止: {reason}")
+        plan_text = plan_text or await self._get_plan_text()
+        await events.emit(self._event(EventType.CONTENT_DELTA, f"终止: 预算耗尽 ({reason})\n\n{plan_text}"))
+
+    async def _finalize_plan(self, events: EventStream):
         """完成计划并使用流程的LLM直接提供摘要，以流式方式返回。"""
         plan_text = await self._get_plan_text()
-        result_queue = asyncio.Queue()
-        await total_queue.put(result_queue)
+        reason = budget_exhausted()
+        if reason is not None:
+            await self._stop_for_budget(reason, events, plan_text)
+            return
+        await events.emit(self._event(EventType.STEP_START, "总结计划"))
 
         try:
             system_message = Message.system_message("你是一个计划助手。你的任务是总结完成的计划。")
@@ -441,33 +424,24 @@ class PlanningFlow(BaseFlow):
             )
 
             # 使用流式方式获取LLM响应
-            gen = await self.llm.chat(
-                messages=[system_message, user_message],
-                stream=True,
-            )
+            with llm_tags(agent="planning"):
+                gen = await self.llm.chat(
+                    messages=[system_message, user_message],
+                    stream=True,
+                )
 
-            all_thinking = ""
-            all_content = ""
-            
+            started = False
             async for thinking, content, _ in gen:
-                all_thinking += thinking
-                all_content += content
-                
-                await result_queue.put(AgentResultStream(
-                    thinking=all_thinking,
-                    content="计划已完成:\n\n" + all_content if all_content else "",
-                    tool_calls=[]
-                ))
-
-            await result_queue.put(QueueEnd())
-            return
-            
+                if thinking:
+                    await events.emit(self._event(EventType.THINKING_DELTA, thinking))
+                if content:
+                    if not started:
+                        started = True
+                        content = "计划已完成:\n\n" + content
+                    await events.emit(self._event(EventType.CONTENT_DELTA, content))
+
+        except EventStreamClosed:
+            raise
         except Exception as e:
             logger.error(f"使用代理总结计划时出错: {e}")
-            await result_queue.put(AgentResultStream(
-                thinking="",
-                content=f"计划已完成。生成总结时出错。\n{e}",
-                tool_calls=[]
-            ))
-            await result_queue.put(QueueEnd())
-            return
\ No newline at end of file
+            await events.emit(self._event(EventType.ERROR, f"计划已完成。生成总结时出错。\n{e}"))
@@ -1,6 +1,16 @@
-from .base import AsyncBaseChatCOTModel
+from .base import AsyncBaseChatCOTModel, single_flight
 from .openai_llm import OpenAICoT
 from .qwen_llm import QwenCoT
-from .errors import TokenLimitExceeded
+from .mock_llm import MockCoT
+from .router import LLMRouter
+from .errors import TokenLimitExceeded, CircuitOpenError
+from .breaker import breaker_registry
+from .limiter import limiter_registry
+from .transport import http_client_pool
+from .cache import response_cache
+from .stream import StreamAssembler, FlushPolicy
+from .metrics import llm_metrics, llm_tags, tag_request, MetricsSink
+from .usage import usage_ledger, caller_id
+from .batch import BatchRunner, make_job_id, batch_jobs
 
-__all__ = ["AsyncBaseChatCOTModel", "OpenAICoT", "QwenCoT", "TokenLimitExceeded"]
+__all__ = ["AsyncBaseChatCOTModel", "OpenAICoT", "QwenCoT", "MockCoT", "LLMRouter", "TokenLimitExceeded", "CircuitOpenError", "breaker_registry", "limiter_registry", "http_client_pool", "response_cache", "single_flight", "StreamAssembler", "FlushPolicy", "llm_metrics", "llm_tags", "tag_request", "MetricsSink", "usage_ledger", "caller_id", "BatchRunner", "make_job_id", "batch_jobs"]
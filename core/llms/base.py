@@ -1,8 +1,16 @@
+import asyncio
 from abc import ABC, abstractmethod
-from utils.retry import retry
-from typing import List, Union, Tuple, Literal, AsyncIterator
+from utils.retry import RetryPolicy
+from typing import Any, Awaitable, Callable, Dict, List, Union, Tuple, Literal, AsyncIterator
 from utils.log import logger
 from core.schema import Message, ROLE_VALUES, ToolChoice
+from core.config import config
+from core.llms.tokenizer import get_token_counter
+from core.llms.cache import response_cache, make_request_key
+from core.llms.limiter import INTERACTIVE, BACKGROUND
+from core.llms.metrics import llm_metrics, current_call, CallRecord
+from core.scope import track_stream
+from core.budget import Budget, current_budget
 
 class FnCallNotImplError(NotImplementedError):
     pass
@@ -10,6 +18,126 @@ class FnCallNotImplError(NotImplementedError):
 class TextCompleteNotImplError(NotImplementedError):
     pass
 
+
+class _StreamBroadcast:
+    """把一个上游流分发给多个订阅者，后加入的订阅者会先收到已产生的片段"""
+
+    def __init__(self, factory: Callable[[], Awaitable[AsyncIterator]]):
+        self.items: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self._changed = asyncio.Condition()
+        self._task = asyncio.ensure_future(self._pump(factory))
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _pump(self, factory):
+        source = None
+        try:
+            source = await factory()
+            async for item in source:
+                self.items.append(item)
+                await self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            # 被取消时关闭上游流，让提供商停止生成
+            if source is not None and hasattr(source, "aclose"):
+                await source.aclose()
+            self.done = True
+            await self._notify()
+
+    def subscribe(self) -> AsyncIterator:
+        self.subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self):
+        index = 0
+        try:
+            while True:
+                if index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                async with self._changed:
+                    await self._changed.wait_for(lambda: index < len(self.items) or self.done)
+        finally:
+            self.subscribers -= 1
+            # 所有订阅者都离开后停止上游流
+            if self.subscribers == 0 and not self._task.done():
+                self._task.cancel()
+
+
+class SingleFlight:
+    """合并并发的相同请求：相同键的非流式调用共享一次上游请求，流式调用共享一个上游流"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        # 每个进行中调用的等待者数量，按调用对象计数，避免键被新调用复用后计数错乱
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._streams: Dict[str, _StreamBroadcast] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """执行或加入一个进行中的调用"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(self._calls, key, t))
+        else:
+            self.shared += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 最后一个等待者被取消时取消上游请求
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if self._waiters[task] == 0:
+                del self._waiters[task]
+
+    def stream(self, key: str, factory: Callable[[], Awaitable[AsyncIterator]]) -> AsyncIterator:
+        """订阅或创建一个共享的上游流"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.leaders += 1
+            broadcast = _StreamBroadcast(factory)
+            self._streams[key] = broadcast
+            broadcast._task.add_done_callback(lambda t: self._forget(self._streams, key, broadcast))
+        else:
+            self.shared += 1
+        return broadcast.subscribe()
+
+    def _forget(self, registry: dict, key: str, value: Any):
+        if registry.get(key) is value:
+            registry.pop(key)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
+
+
+single_flight = SingleFlight()
+
 class AsyncBaseLLMModel(ABC):
     """LLM基础模型，包含通用功能"""
     
@@ -17,17 +145,64 @@ class AsyncBaseLLMModel(ABC):
                  model: str,
                  support_fn_call: bool | None = None,
                  max_length: int = 8192,
+                 retry_policy: RetryPolicy | None = None,
+                 tokenizer_path: str | None = None,
                  **kwargs):
         self._support_fn_call = support_fn_call
         self.model = model
+        # 模型上下文窗口大小（token数）
         self.max_length = max_length
+        self.retry_policy = retry_policy or RetryPolicy(**config.get("retry", {}))
+        self.token_counter = get_token_counter(model, tokenizer_path)
+
+    def count_tokens(self, messages: List[Union[Message, dict]], tools: List[dict] | None = None) -> int:
+        """计算消息和工具定义占用的token数"""
+        return self.token_counter.count_messages(messages) + self.token_counter.count_tools(tools)
 
-    def check_max_length(self, messages: List[Message]) -> bool:
-        total_length = sum(len(msg.content) for msg in messages)
-        return total_length <= self.max_length
+    def remaining_budget(self, messages: List[Union[Message, dict]], tools: List[dict] | None = None,
+                         max_tokens: int | None = None) -> int:
+        """上下文窗口扣除输入和预留输出后剩余的token数，小于0表示会超出上下文"""
+        if max_tokens is None:
+            max_tokens = config.model.max_tokens
+        return self.max_length - self.count_tokens(messages, tools) - max_tokens
+
+    def check_max_length(self, messages: List[Union[Message, dict]], tools: List[dict] | None = None) -> bool:
+        return self.remaining_budget(messages, tools) >= 0
 
     def get_max_length(self) -> int:
         return self.max_length
+
+    @property
+    def cache_namespace(self) -> str:
+        """区分不同模型实例的缓存命名空间"""
+        return f"{type(self).__name__}:{getattr(self, 'api_base', '')}:{self.model}"
+
+    def fit_messages(self, messages: List[Union[Message, dict]], tools: List[dict] | None = None,
+                     max_tokens: int | None = None) -> List[Union[Message, dict]]:
+        """从最早的非系统消息开始丢弃，直到满足上下文预算，返回新的列表。
+        系统消息和最后一组消息（最后一条消息；以工具结果结尾时为发起调用的assistant消息及其工具结果）始终保留，
+        工具结果不会脱离对应的工具调用单独保留。
+        """
+        over = -self.remaining_budget(messages, tools, max_tokens)
+        if over <= 0:
+            return list(messages)
+        def _role(msg):
+            role = msg.role if isinstance(msg, Message) else msg.get("role")
+            return role.value if hasattr(role, "value") else role
+        fitted = list(messages)
+        index = 1 if fitted and _role(fitted[0]) == "system" else 0
+        # 保留的最后一组消息的起始位置
+        tail = len(fitted) - 1
+        while tail > index and _role(fitted[tail]) == "tool":
+            tail -= 1
+        while over > 0 and index < tail:
+            over -= self.token_counter.count_message(fitted.pop(index))
+            tail -= 1
+            # 删除工具调用后，紧随其后的工具结果也必须删除
+            while index < tail and _role(fitted[index]) == "tool":
+                over -= self.token_counter.count_message(fitted.pop(index))
+                tail -= 1
+        return fitted
     
     @abstractmethod
     async def chat(
@@ -114,7 +289,18 @@ class AsyncBaseChatCOTModel(AsyncBaseLLMModel):
         """非流式返回（完整思考，完整响应）的元组"""
         raise NotImplementedError
 
-    @retry(max_retries=3, delay_seconds=0.5)
+    async def call_no_stream(self, messages: List[dict], stop: List[str] | None = None, **kwargs) -> Tuple[str, str, list]:
+        """按本模型的重试策略发起非流式调用（熔断、限流由提供商实现负责）。
+        messages须已格式化；不经过缓存、合并和预算，供chat和路由等组合模型使用。
+        """
+        return await self.retry_policy.call(self._chat_no_stream, messages, stop=stop, **kwargs)
+
+    async def call_stream(self, messages: List[dict], stop: List[str] | None = None, **kwargs) -> AsyncIterator[Tuple[str, str, list]]:
+        """按本模型的重试策略建立流式调用，首个片段到达前的失败会重试，其余同call_no_stream"""
+        async def _open_stream():
+            return await self._chat_stream(messages, stop=stop, **kwargs)
+        return await self.retry_policy.call_stream(_open_stream)
+
     async def chat(
         self,
         prompt: str | None = None,
@@ -131,8 +317,97 @@ class AsyncBaseChatCOTModel(AsyncBaseLLMModel):
         assert messages and len(messages) > 0, "Messages cannot be empty"
         
         messages = self.format_messages(messages)
+        # 仅对显式开启缓存的非流式调用使用响应缓存
+        use_cache = kwargs.pop("use_cache", False) and response_cache.enable and not stream
+        # 是否合并并发的相同请求，默认值由配置决定
+        coalesce = kwargs.pop("coalesce", None)
+        if coalesce is None:
+            coalesce = config.get("llm_coalesce.stream" if stream else "llm_coalesce.enable", not stream)
+        # 限流排队的优先级：默认流式（SSE）为交互类，非流式为后台类
+        priority = kwargs.pop("priority", None) or (INTERACTIVE if stream else BACKGROUND)
+        key = make_request_key(self.cache_namespace, messages, stop=stop, stream=stream, **kwargs) \
+            if use_cache or coalesce else None
+        kwargs["priority"] = priority
+        # 请求有执行预算时检查剩余预算，并把超时缩短到剩余时间（在计算请求键之后，不影响合并和缓存）
+        budget = current_budget.get()
+        if budget is not None:
+            budget.start_llm_call()
+            kwargs["timeout"] = budget.timeout(kwargs.get("timeout", config.model.timeout))
 
-        if stream:
-            return await self._chat_stream(messages, stop=stop, **kwargs)
-        else:
-            return await self._chat_no_stream(messages, stop=stop, **kwargs)
\ No newline at end of file
+        # 记录本次调用的耗时和用量，提供商实现通过current_call补充排队时间和usage
+        record = llm_metrics.start(self.model, stream)
+        token = current_call.set(record)
+        try:
+            # 流式调用在首个片段到达前失败可以重试，非流式整体按策略重试
+            if stream:
+                if coalesce:
+                    result = single_flight.stream(key, lambda: self.call_stream(messages, stop=stop, **kwargs))
+                else:
+                    result = await self.call_stream(messages, stop=stop, **kwargs)
+                # 登记到当前请求范围，客户端断开时关闭流并中止上游请求
+                return track_stream(self._instrument_stream(result, record, budget))
+
+            if use_cache:
+                cached = await response_cache.get(key)
+                if cached is not None:
+                    logger.debug(f'LLM response cache hit | Model: {self.model} | Key: {key}')
+                    record.cache_hit = True
+                    self._finish_record(record, content=cached[1], budget=budget)
+                    return cached
+
+            async def _call():
+                result = await self.call_no_stream(messages, stop=stop, **kwargs)
+                if use_cache:
+                    await response_cache.set(key, result)
+                return result
+
+            if not coalesce:
+                thinking, content, tool_calls = await _call()
+            else:
+                thinking, content, tool_calls = await single_flight.do(key, _call)
+                # 共享结果时复制工具调用列表，避免调用方之间互相影响
+                tool_calls = list(tool_calls) if tool_calls else tool_calls
+        except BaseException as e:
+            self._finish_record(record, error=e, budget=budget)
+            raise
+        finally:
+            current_call.reset(token)
+        self._finish_record(record, thinking=thinking, content=content, budget=budget)
+        return thinking, content, tool_calls
+
+    def _finish_record(self, record: CallRecord, error: BaseException | None = None,
+                       thinking: str | None = None, content: str | None = None, budget: Budget | None = None):
+        """结束调用记录并输出，提供商未返回usage时按输出文本估算token数"""
+        record.finish(error)
+        record.cancelled = isinstance(error, (asyncio.CancelledError, GeneratorExit))
+        if record.completion_tokens is None:
+            record.estimated_tokens = self.token_counter.count_text(thinking) + self.token_counter.count_text(content)
+        if budget is not None and not record.cache_hit:
+            budget.add_tokens((record.prompt_tokens or 0) + record.output_tokens)
+        if record.cancelled:
+            logger.info(
+                f'LLM call cancelled | Model: {self.model} | Endpoint: {record.endpoint} | '
+                f'Duration: {record.duration:.3f} | Output tokens: {record.output_tokens}'
+            )
+        llm_metrics.emit(record)
+
+    async def _instrument_stream(self, stream: AsyncIterator, record: CallRecord,
+                                 budget: Budget | None = None) -> AsyncIterator[Tuple[str, str, list]]:
+        """转发流式结果，同时记录首token时间、片段间隔和输出速度；超过时间预算时抛出BudgetExceeded结束输出"""
+        thinking_parts, content_parts = [], []
+        try:
+            async for thinking, content, tool_calls in stream:
+                if budget is not None:
+                    budget.check_deadline()
+                record.observe_chunk(thinking, content)
+                if thinking:
+                    thinking_parts.append(thinking)
+                if content:
+                    content_parts.append(content)
+                yield thinking, content, tool_calls
+        except BaseException as e:
+            self._finish_record(record, error=e, thinking="".join(thinking_parts), content="".join(content_parts), budget=budget)
+            raise
+        finally:
+            await stream.aclose()
+        self._finish_record(record, thinking="".join(thinking_parts), content="".join(content_parts), budget=budget)
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Awaitable, Dict, List
+from core.config import config
+from core.llms.base import AsyncBaseChatCOTModel
+from core.llms.limiter import BACKGROUND
+from core.budget import current_budget
+from core.scope import spawn
+from utils.cache import TTLCache
+from utils.log import logger
+
+_TERMINAL_BATCH_STATUS = ("completed", "failed", "expired", "cancelled")
+
+# 调用方提供的任务标签的格式
+JOB_LABEL_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+# 任务ID用作断点文件名，只允许字母数字、下划线和连字符
+_JOB_ID = re.compile(r"^[A-Za-z0-9_-]{1,160}$")
+
+
+def make_job_id(namespace: str, items: List[Dict[str, Any]], label: str | None = None) -> str:
+    """根据接口命名空间和批量任务内容生成任务ID，相同的任务重复提交时可以从断点续跑。
+    label为调用方提供的标签，只作为ID的一部分便于识别；不同接口或不同数据的任务不会共用断点文件。
+    """
+    if label is not None and not re.match(JOB_LABEL_PATTERN, label):
+        raise ValueError(f"无效的任务标签: {label!r}")
+    raw = json.dumps({"namespace": namespace, "items": items}, ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return f"{namespace}-{label}-{digest[:16]}" if label else f"{namespace}-{digest[:32]}"
+
+
+class BatchRunner:
+    """离线批量推理：有界并发执行一批请求，进度逐条写入JSONL断点文件，崩溃后重新运行会跳过已完成的请求。
+    模型开启batch_api时可以改为提交到OpenAI兼容的批处理文件接口。
+    每个请求为 {"custom_id": str, "messages": list}，结果为 {"custom_id", "thinking", "content", "error"}。
+    """
+
+    def __init__(self, llm: AsyncBaseChatCOTModel, job_id: str, concurrency: int | None = None,
+                 checkpoint_dir: str | None = None):
+        if not _JOB_ID.match(job_id):
+            raise ValueError(f"无效的批量任务ID: {job_id!r}")
+        self.llm = llm
+        self.job_id = job_id
+        self.concurrency = concurrency or config.get("batch.concurrency", 8)
+        self.checkpoint_dir = checkpoint_dir = checkpoint_dir or config.get("batch.checkpoint_dir", "data/batch")
+        self.checkpoint_path = os.path.join(checkpoint_dir, f"{job_id}.jsonl")
+        self.state_path = os.path.join(checkpoint_dir, f"{job_id}.batch.json")
+        self._write_lock = asyncio.Lock()
+        # 进度：请求总数和已结束（成功或失败）的请求数
+        self.total = 0
+        self.completed = 0
+
+    def _load_checkpoint(self) -> Dict[str, dict]:
+        """读取已成功的结果，失败的请求会重新执行"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        done = {}
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时可能留下写了一半的最后一行
+                        continue
+                    if record.get("error") is None:
+                        done[record["custom_id"]] = record
+        except FileNotFoundError:
+            pass
+        return done
+
+    def _append(self, records: List[dict]):
+        with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _read_state(self) -> str | None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("batch_id")
+        except FileNotFoundError:
+            return None
+
+    def _write_state(self, batch_id: str):
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"batch_id": batch_id}, f)
+
+    @staticmethod
+    def _remove(*paths: str):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _save(self, *records: dict):
+        async with self._write_lock:
+            await asyncio.to_thread(self._append, list(records))
+        self.completed += len(records)
+
+    async def run(self, requests: List[Dict[str, Any]], use_batch_api: bool = False, **chat_kwargs) -> List[dict]:
+        """执行批量请求，按输入顺序返回结果。文件读写在线程中进行，不阻塞事件循环。
+        批量任务不受提交它的请求的执行预算约束
+        """
+        token = current_budget.set(None)
+        try:
+            return await self._run(requests, use_batch_api, **chat_kwargs)
+        finally:
+            current_budget.reset(token)
+
+    async def _run(self, requests: List[Dict[str, Any]], use_batch_api: bool, **chat_kwargs) -> List[dict]:
+        results = await asyncio.to_thread(self._load_checkpoint)
+        pending = [request for request in requests if request["custom_id"] not in results]
+        self.total, self.completed = len(requests), len(requests) - len(pending)
+        logger.info(f"批量任务 {self.job_id} | 总数: {len(requests)} | 已完成: {len(requests) - len(pending)}")
+        if pending:
+            if use_batch_api and getattr(self.llm, "batch_api", False):
+                finished = await self._run_batch_api(pending, **chat_kwargs)
+            else:
+                if use_batch_api:
+                    logger.warning(f"模型 {self.llm.model} 未开启批处理文件接口，改为并发执行")
+                finished = await self._run_concurrent(pending, **chat_kwargs)
+            results.update(finished)
+        ordered = [
+            results.get(request["custom_id"])
+            or {"custom_id": request["custom_id"], "thinking": "", "content": "", "error": "未返回结果"}
+            for request in requests
+        ]
+        if all(record["error"] is None for record in ordered):
+            await asyncio.to_thread(self._remove, self.checkpoint_path, self.state_path)
+        return ordered
+
+    async def _run_concurrent(self, requests: List[Dict[str, Any]], **chat_kwargs) -> Dict[str, dict]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for request in requests:
+            queue.put_nowait(request)
+        finished: Dict[str, dict] = {}
+
+        async def worker():
+            while True:
+                try:
+                    request = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                record = {"custom_id": request["custom_id"], "thinking": "", "content": "", "error": None}
+                try:
+                    thinking, content, _ = await self.llm.chat(
+                        messages=request["messages"], stream=False, priority=BACKGROUND, **chat_kwargs
+                    )
+                    record["thinking"], record["content"] = thinking or "", content or ""
+                except Exception as e:
+                    logger.warning(f"批量任务 {self.job_id} | 请求 {request['custom_id']} 失败: {type(e).__name__}: {e}")
+                    record["error"] = f"{type(e).__name__}: {e}"
+                finished[request["custom_id"]] = record
+                await self._save(record)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(requests)))))
+        return finished
+
+    async def _run_batch_api(self, requests: List[Dict[str, Any]], **chat_kwargs) -> Dict[str, dict]:
+        """通过批处理文件接口执行：上传JSONL、创建batch、轮询直到结束后下载结果。
+        batch ID保存在状态文件中，重启后继续轮询同一个batch而不是重新提交。
+        """
+        client = self.llm.client
+        batch_id = await asyncio.to_thread(self._read_state)
+        if batch_id is None:
+            # 请求体由模型构造，与普通调用携带相同的提供商参数
+            lines = [
+                json.dumps({
+                    "custom_id": request["custom_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self.llm.batch_request_body(self.llm.format_messages(request["messages"]), **chat_kwargs),
+                }, ensure_ascii=False)
+                for request in requests
+            ]
+            input_file = await client.files.create(
+                file=(f"{self.job_id}.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+            )
+            batch = await client.batches.create(
+                input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+            )
+            batch_id = batch.id
+            await asyncio.to_thread(self._write_state, batch_id)
+            logger.info(f"批量任务 {self.job_id} | 已提交批处理: {batch_id} | 请求数: {len(requests)}")
+
+        poll_interval = config.get("batch.poll_interval", 30)
+        while True:
+            batch = await client.batches.retrieve(batch_id)
+            if batch.status in _TERMINAL_BATCH_STATUS:
+                break
+            await asyncio.sleep(poll_interval)
+        logger.info(f"批量任务 {self.job_id} | 批处理 {batch_id} 结束: {batch.status}")
+
+        finished: Dict[str, dict] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await client.files.content(file_id)
+            for line in content.text.splitlines():
+                if line.strip():
+                    record = self._parse_batch_line(json.loads(line))
+                    finished[record["custom_id"]] = record
+        await self._save(*finished.values())
+        await asyncio.to_thread(self._remove, self.state_path)
+        return finished
+
+    @staticmethod
+    def _parse_batch_line(line: dict) -> dict:
+        record = {"custom_id": line["custom_id"], "thinking": "", "content": "", "error": None}
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code", 200) != 200:
+            record["error"] = json.dumps(line.get("error") or response.get("body"), ensure_ascii=False)
+            return record
+        message = response["body"]["choices"][0]["message"]
+        record["thinking"] = message.get("reasoning_content") or ""
+        record["content"] = message.get("content") or ""
+        return record
+
+
+class BatchJob:
+    """在后台执行的批量任务，接口提交后立即返回job_id，之后按job_id查询状态和结果"""
+
+    def __init__(self, job_id: str, runner: BatchRunner):
+        self.job_id = job_id
+        self.runner = runner
+        self.status = "running"
+        self.results: Any = None
+        self.error: str | None = None
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    def to_dict(self, with_results: bool = False) -> dict:
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.runner.total,
+            "completed": self.runner.completed,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error or "",
+        }
+        if with_results:
+            data["results"] = self.results
+        return data
+
+
+class BatchJobRegistry:
+    """批量任务登记表：任务脱离请求范围在后台执行，请求结束或客户端断开不影响任务；
+    结束的任务保留一段时间供查询结果，过期后重新提交同一批数据会从断点文件续跑。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400):
+        self.jobs = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def submit(self, job_id: str, runner: BatchRunner, work: Awaitable[Any]) -> BatchJob:
+        """在后台执行work（通常调用runner.run并整理结果），同一job_id的任务仍在执行时返回已有任务"""
+        job = self.jobs.get(job_id)
+        if job is not None and job.running:
+            work.close()
+            return job
+        job = BatchJob(job_id, runner)
+        # 执行中的任务不过期
+        self.jobs.set(job_id, job, ttl=0)
+        job.task = spawn(self._run(job, work), name=f"batch:{job_id}", detached=True)
+        return job
+
+    async def _run(self, job: BatchJob, work: Awaitable[Any]):
+        try:
+            job.results = await work
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status, job.error = "cancelled", "任务被取消"
+            raise
+        except Exception as e:
+            logger.exception(f"批量任务 {job.job_id} 失败: {e}")
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            job.finished_at = time.time()
+            self.jobs.set(job.job_id, job)
+
+    def get(self, job_id: str) -> BatchJob | None:
+        return self.jobs.get(job_id)
+
+
+batch_jobs = BatchJobRegistry(
+    max_entries=config.get("batch.max_jobs", 256),
+    ttl=config.get("batch.result_ttl", 86400),
+)
@@ -0,0 +1,117 @@
+import time
+from enum import Enum
+from typing import Dict, List
+from core.llms.errors import CircuitOpenError
+from utils.log import logger
+
+
+class BreakerState(str, Enum):
+    """熔断器状态"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个提供商的熔断器。
+    连续失败达到阈值后打开，打开期间的调用立即失败；冷却时间结束后进入半开状态，
+    放行少量探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.half_open_calls = 0
+        self.opened_at = 0.0
+        self.trip_count = 0
+        self.rejected_calls = 0
+        self.last_error: str | None = None
+
+    @property
+    def state(self) -> BreakerState:
+        if self._state == BreakerState.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self._state = BreakerState.HALF_OPEN
+            self.half_open_calls = 0
+            logger.info(f"熔断器进入半开状态 | Provider: {self.name}")
+        return self._state
+
+    def allow(self) -> bool:
+        """当前是否允许调用（不占用半开探测名额）"""
+        state = self.state
+        if state == BreakerState.OPEN:
+            return False
+        if state == BreakerState.HALF_OPEN:
+            return self.half_open_calls < self.half_open_max_calls
+        return True
+
+    def before_call(self):
+        """调用前检查，熔断打开时抛出CircuitOpenError"""
+        if not self.allow():
+            self.rejected_calls += 1
+            raise CircuitOpenError(f"提供商 {self.name} 已熔断，{self._retry_in():.0f}秒后重试")
+        if self._state == BreakerState.HALF_OPEN:
+            self.half_open_calls += 1
+
+    def _retry_in(self) -> float:
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self._state == BreakerState.HALF_OPEN:
+            logger.info(f"熔断器恢复 | Provider: {self.name}")
+        self._state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.half_open_calls = 0
+
+    def record_failure(self, error: BaseException | None = None):
+        self.consecutive_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}" if error else None
+        if self._state == BreakerState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._trip()
+
+    def record_ignored(self):
+        """与提供商健康无关的失败（如请求参数错误），只归还半开探测名额"""
+        if self._state == BreakerState.HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def _trip(self):
+        self._state = BreakerState.OPEN
+        self.opened_at = time.monotonic()
+        self.half_open_calls = 0
+        self.trip_count += 1
+        logger.warning(f"熔断器打开 | Provider: {self.name} | 连续失败: {self.consecutive_failures} | 错误: {self.last_error}")
+
+    def to_dict(self) -> dict:
+        state = self.state
+        return {
+            "name": self.name,
+            "state": state.value,
+            "consecutive_failures": self.consecutive_failures,
+            "trip_count": self.trip_count,
+            "rejected_calls": self.rejected_calls,
+            "retry_in": self._retry_in() if state == BreakerState.OPEN else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+class BreakerRegistry:
+    """所有提供商熔断器的注册表，用于状态展示"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def create(self, name: str, **options) -> CircuitBreaker:
+        breaker = CircuitBreaker(name, **options)
+        self._breakers[name] = breaker
+        return breaker
+
+    def stats(self) -> List[dict]:
+        return [breaker.to_dict() for breaker in self._breakers.values()]
+
+
+breaker_registry = BreakerRegistry()
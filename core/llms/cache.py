@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, List, Tuple
+from core.config import config
+from core.schema import ToolCall, Function
+from utils.cache import TTLCache
+from utils.log import logger
+
+
+def _to_jsonable(obj: Any) -> Any:
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "value"):
+        return obj.value
+    return str(obj)
+
+
+def _normalize_message(message: dict) -> dict:
+    normalized = {"role": message.get("role")}
+    content = message.get("content")
+    normalized["content"] = content.strip() if isinstance(content, str) else content
+    for field in ("tool_calls", "name", "tool_call_id"):
+        if message.get(field) is not None:
+            normalized[field] = message[field]
+    return normalized
+
+
+def make_request_key(namespace: str, messages: List[dict], **params) -> str:
+    """根据规范化后的消息、模型和采样参数生成请求的唯一键"""
+    payload = {
+        "namespace": namespace,
+        "messages": [_normalize_message(message) for message in messages],
+        "params": {k: v for k, v in params.items() if v is not None},
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=_to_jsonable)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _dump_result(result: Tuple[str, str, list]) -> list:
+    thinking, content, tool_calls = result
+    calls = [
+        {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+        for call in tool_calls or []
+    ]
+    return [thinking, content, calls]
+
+
+def _load_result(data: list) -> Tuple[str, str, list]:
+    thinking, content, calls = data
+    tool_calls = [
+        ToolCall(id=call["id"], function=Function(name=call["name"], arguments=call["arguments"]))
+        for call in calls
+    ]
+    return thinking, content, tool_calls
+
+
+class ResponseCache:
+    """LLM非流式响应的精确匹配缓存：内存LRU + 可选的磁盘层"""
+
+    def __init__(self, enable: bool = False, max_entries: int = 1024, ttl: float = 3600, disk_dir: str | None = None):
+        self.enable = enable
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.disk_dir = disk_dir or None
+        self.disk_hits = 0
+        self.writes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> list | None:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if record.get("expires_at", 0) < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record["value"]
+
+    def _write_disk(self, key: str, value: list) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + self.ttl, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def get(self, key: str) -> Tuple[str, str, list] | None:
+        value = self.memory.get(key)
+        if value is None and self.disk_dir:
+            value = await asyncio.to_thread(self._read_disk, key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        return _load_result(value) if value is not None else None
+
+    async def set(self, key: str, result: Tuple[str, str, list]) -> None:
+        value = _dump_result(result)
+        self.memory.set(key, value)
+        self.writes += 1
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, key, value)
+            except OSError as e:
+                logger.warning(f"写入LLM磁盘缓存失败: {e}")
+
+    def stats(self) -> dict:
+        memory_stats = self.memory.stats()
+        hits = memory_stats["hits"]
+        misses = memory_stats["misses"] - self.disk_hits
+        total = hits + self.disk_hits + misses
+        return {
+            "enable": self.enable,
+            "memory_hits": hits,
+            "disk_hits": self.disk_hits,
+            "misses": misses,
+            "writes": self.writes,
+            "hit_rate": (hits + self.disk_hits) / total if total else 0.0,
+            "size": memory_stats["size"],
+            "evictions": memory_stats["evictions"],
+        }
+
+
+response_cache = ResponseCache(
+    enable=config.get("llm_cache.enable", False),
+    max_entries=config.get("llm_cache.max_entries", 1024),
+    ttl=config.get("llm_cache.ttl", 3600),
+    disk_dir=config.get("llm_cache.disk_dir"),
+)
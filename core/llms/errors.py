@@ -1,2 +1,5 @@
 class TokenLimitExceeded(Exception):
     """最大令牌限制错误"""
+
+class CircuitOpenError(Exception):
+    """提供商熔断中，调用被快速拒绝"""
@@ -0,0 +1,213 @@
+import asyncio
+import time
+from collections import deque
+from typing import Dict, List
+from core.config import config
+from utils.log import logger
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class TokenBucket:
+    """按分钟额度连续补充的令牌桶，容量即一分钟的额度"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """距离桶内有amount个令牌还需等待的秒数"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "priority", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, tokens: int, priority: str):
+        self.future = future
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class Lease:
+    """一次获准的调用，结束时必须release归还并发名额"""
+
+    __slots__ = ("_limiter", "_released")
+
+    def __init__(self, limiter: "RateLimiter"):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._release()
+
+
+class RateLimiter:
+    """单个提供商的客户端限流：RPM/TPM令牌桶 + 并发上限 + 按优先级加权公平排队。
+    各优先级按权重分享额度（加权公平队列），同一优先级内先到先得。
+    """
+
+    def __init__(self, name: str, rpm: float | None = None, tpm: float | None = None,
+                 max_concurrency: int | None = None, weights: Dict[str, float] | None = None):
+        self.name = name
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.weights = weights or {INTERACTIVE: 4.0, BACKGROUND: 1.0}
+        self._queues: Dict[str, deque] = {}
+        self._virtual_time: Dict[str, float] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self.in_flight = 0
+        self.granted = 0
+        self.queue_times: Dict[str, deque] = {}
+        self.max_queue_time: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rpm or self.tpm or self.max_concurrency)
+
+    async def acquire(self, tokens: int = 0, priority: str = INTERACTIVE) -> Lease:
+        """排队等待额度，返回的Lease需要在调用结束后release"""
+        if not self.enabled:
+            self.in_flight += 1
+            return Lease(self)
+        if priority not in self.weights:
+            priority = BACKGROUND
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tokens, priority)
+        self._queues.setdefault(priority, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已获准但调用方被取消，归还名额
+                self._release()
+            else:
+                self._remove(waiter)
+            raise
+        return Lease(self)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.priority)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+        self._dispatch()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _next_priority(self) -> str | None:
+        """选择虚拟完成时间最小的优先级（加权公平队列）"""
+        best, best_finish = None, None
+        floor = min((self._virtual_time.get(p, 0.0) for p, q in self._queues.items() if q), default=0.0)
+        for priority, queue in self._queues.items():
+            if not queue:
+                continue
+            start = max(self._virtual_time.get(priority, 0.0), floor)
+            finish = start + (queue[0].tokens + 1) / self.weights[priority]
+            if best_finish is None or finish < best_finish:
+                best, best_finish = priority, finish
+        return best
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.max_concurrency is None or self.in_flight < self.max_concurrency:
+            priority = self._next_priority()
+            if priority is None:
+                return
+            queue = self._queues[priority]
+            waiter = queue[0]
+            if waiter.future.done():
+                queue.popleft()
+                continue
+            wait = max(
+                self.rpm.time_until(1) if self.rpm else 0.0,
+                self.tpm.time_until(waiter.tokens) if self.tpm else 0.0,
+            )
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            queue.popleft()
+            if self.rpm:
+                self.rpm.consume(1)
+            if self.tpm:
+                self.tpm.consume(waiter.tokens)
+            floor = min((self._virtual_time.get(p, 0.0) for p, q in self._queues.items() if q), default=0.0)
+            self._virtual_time[priority] = max(self._virtual_time.get(priority, 0.0), floor) \
+                + (waiter.tokens + 1) / self.weights[priority]
+            self._grant(waiter)
+
+    def _grant(self, waiter: _Waiter):
+        self.in_flight += 1
+        self.granted += 1
+        waited = time.monotonic() - waiter.enqueued_at
+        self.queue_times.setdefault(waiter.priority, deque(maxlen=500)).append(waited)
+        self.max_queue_time[waiter.priority] = max(self.max_queue_time.get(waiter.priority, 0.0), waited)
+        if waited > 5:
+            logger.warning(f"LLM请求排队过久 | Provider: {self.name} | Priority: {waiter.priority} | 等待: {waited:.1f}s")
+        waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        queue_stats = {}
+        for priority in self.weights:
+            samples = sorted(self.queue_times.get(priority, ()))
+            queue_stats[priority] = {
+                "waiting": len(self._queues.get(priority, ())),
+                "samples": len(samples),
+                "avg": sum(samples) / len(samples) if samples else 0.0,
+                "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))] if samples else 0.0,
+                "max": self.max_queue_time.get(priority, 0.0),
+            }
+        return {
+            "name": self.name,
+            "rpm": self.rpm.capacity if self.rpm else None,
+            "tpm": self.tpm.capacity if self.tpm else None,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "granted": self.granted,
+            "rpm_available": self.rpm.tokens if self.rpm else None,
+            "tpm_available": self.tpm.tokens if self.tpm else None,
+            "queue_time": queue_stats,
+        }
+
+
+class LimiterRegistry:
+    """按提供商共享的限流器，同一账号下同一模型的实例共用额度"""
+
+    def __init__(self):
+        self._limiters: Dict[str, RateLimiter] = {}
+
+    def get(self, name: str, rpm: float | None = None, tpm: float | None = None,
+            max_concurrency: int | None = None) -> RateLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, rpm=rpm, tpm=tpm, max_concurrency=max_concurrency,
+                                  weights=config.get("rate_limit.weights"))
+            self._limiters[name] = limiter
+        return limiter
+
+    def stats(self) -> List[dict]:
+        return [limiter.stats() for limiter in self._limiters.values() if limiter.enabled]
+
+
+limiter_registry = LimiterRegistry()
@@ -0,0 +1,325 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+from core.config import config
+from utils.log import logger
+
+_NO_TAGS: Dict[str, str] = {}
+# 当前请求的标签（endpoint、request_id、caller、agent等），创建调用记录时快照
+_call_tags: ContextVar[Dict[str, str]] = ContextVar("llm_call_tags", default=_NO_TAGS)
+# 当前正在进行的调用记录，供提供商实现补充排队时间和用量
+current_call: ContextVar["CallRecord | None"] = ContextVar("llm_current_call", default=None)
+
+
+@contextmanager
+def llm_tags(**tags):
+    """在上下文中为LLM调用附加标签"""
+    token = _call_tags.set({**_call_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _call_tags.reset(token)
+
+
+def current_tags() -> Dict[str, str]:
+    return _call_tags.get()
+
+
+def tag_request(**tags):
+    """为当前请求补充标签（如解析请求体后得到的caller）。
+    在中间件创建的请求标签上原地更新，之后在流式响应、后台任务中发起的调用同样带上这些标签。
+    """
+    current = _call_tags.get()
+    if current is _NO_TAGS:
+        _call_tags.set(dict(tags))
+    else:
+        current.update(tags)
+
+
+class CallRecord:
+    """一次LLM调用的耗时和用量"""
+
+    __slots__ = (
+        "model", "provider", "stream", "endpoint", "request_id", "caller", "agent", "start", "queue_time",
+        "ttft_reasoning", "ttft_content", "max_gap", "chunks", "duration",
+        "prompt_tokens", "cached_tokens", "completion_tokens", "reasoning_tokens", "estimated_tokens",
+        "cache_hit", "error", "cancelled", "_last_chunk_at", "_first_chunk_at",
+    )
+
+    def __init__(self, model: str, stream: bool, provider: str | None = None, **tags):
+        self.model = model
+        self.provider = provider
+        self.stream = stream
+        self.endpoint = tags.get("endpoint")
+        self.request_id = tags.get("request_id")
+        self.caller = tags.get("caller")
+        self.agent = tags.get("agent")
+        self.start = time.monotonic()
+        self.queue_time = 0.0
+        self.ttft_reasoning: float | None = None
+        self.ttft_content: float | None = None
+        self.max_gap = 0.0
+        self.chunks = 0
+        self.duration: float | None = None
+        self.prompt_tokens: int | None = None
+        self.cached_tokens: int | None = None
+        self.completion_tokens: int | None = None
+        self.reasoning_tokens: int | None = None
+        self.estimated_tokens = 0
+        self.cache_hit = False
+        self.error: str | None = None
+        self.cancelled = False
+        self._last_chunk_at: float | None = None
+        self._first_chunk_at: float | None = None
+
+    def observe_chunk(self, thinking: str | None, content: str | None):
+        now = time.monotonic()
+        if self._last_chunk_at is not None:
+            self.max_gap = max(self.max_gap, now - self._last_chunk_at)
+        else:
+            self._first_chunk_at = now
+        self._last_chunk_at = now
+        self.chunks += 1
+        if thinking and self.ttft_reasoning is None:
+            self.ttft_reasoning = now - self.start
+        if content and self.ttft_content is None:
+            self.ttft_content = now - self.start
+
+    def set_usage(self, usage):
+        """记录提供商返回的用量（OpenAI兼容的usage对象）"""
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        # 命中提供商前缀缓存的提示词token：OpenAI兼容接口在prompt_tokens_details中，DeepSeek为prompt_cache_hit_tokens
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(prompt_details, "cached_tokens", None) if prompt_details else None
+        if cached is None:
+            cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        self.cached_tokens = cached
+        self.completion_tokens = getattr(usage, "completion_tokens", None)
+        details = getattr(usage, "completion_tokens_details", None)
+        self.reasoning_tokens = getattr(details, "reasoning_tokens", None) if details else None
+
+    def finish(self, error: BaseException | None = None):
+        self.duration = time.monotonic() - self.start
+        if error is not None:
+            self.error = type(error).__name__
+
+    @property
+    def mean_gap(self) -> float | None:
+        if self.chunks < 2:
+            return None
+        return (self._last_chunk_at - self._first_chunk_at) / (self.chunks - 1)
+
+    @property
+    def output_tokens(self) -> int:
+        return self.completion_tokens if self.completion_tokens is not None else self.estimated_tokens
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        """生成速度：流式按首个片段到结束计算，非流式按扣除排队后的总耗时计算"""
+        if self.duration is None or not self.output_tokens:
+            return None
+        if self.stream and self._first_chunk_at is not None:
+            elapsed = self.start + self.duration - self._first_chunk_at
+        else:
+            elapsed = self.duration - self.queue_time
+        return self.output_tokens / elapsed if elapsed > 0 else None
+
+    def to_dict(self) -> dict:
+        return {
+            "model": self.model,
+            "provider": self.provider,
+            "stream": self.stream,
+            "endpoint": self.endpoint,
+            "request_id": self.request_id,
+            "caller": self.caller,
+            "agent": self.agent,
+            "queue_time": self.queue_time,
+            "ttft_reasoning": self.ttft_reasoning,
+            "ttft_content": self.ttft_content,
+            "mean_gap": self.mean_gap,
+            "max_gap": self.max_gap,
+            "duration": self.duration,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "output_tokens": self.output_tokens,
+            "tokens_per_second": self.tokens_per_second,
+            "cache_hit": self.cache_hit,
+            "error": self.error,
+            "cancelled": self.cancelled,
+        }
+
+
+class MetricsSink:
+    """调用记录的输出目标，子类实现emit"""
+
+    name = "sink"
+
+    def emit(self, record: CallRecord):
+        raise NotImplementedError
+
+    def snapshot(self) -> dict | None:
+        return None
+
+
+class LogSink(MetricsSink):
+    """把每次调用记录写入日志"""
+
+    name = "log"
+
+    def emit(self, record: CallRecord):
+        def fmt(value):
+            return f"{value:.3f}" if isinstance(value, float) else value
+        logger.info(
+            f"LLM call | Provider: {record.provider} | Model: {record.model} | Endpoint: {record.endpoint} | "
+            f"Agent: {record.agent} | Queue: {fmt(record.queue_time)} | TTFT reasoning: {fmt(record.ttft_reasoning)} | "
+            f"TTFT content: {fmt(record.ttft_content)} | Duration: {fmt(record.duration)} | "
+            f"Tokens: {record.prompt_tokens}/{record.output_tokens} | Cached: {record.cached_tokens} | Tokens/s: {fmt(record.tokens_per_second)} | "
+            f"Error: {record.error}"
+        )
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    __slots__ = ("buckets", "counts", "count", "total")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float | None:
+        """按分桶上界估算分位数"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(zip([*map(str, self.buckets), "+inf"], self.counts)),
+        }
+
+
+_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 300, 600)
+_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 40, 60, 80, 100, 150, 200, 400)
+_HISTOGRAM_FIELDS = {
+    "queue_time": _SECONDS_BUCKETS,
+    "ttft_reasoning": _SECONDS_BUCKETS,
+    "ttft_content": _SECONDS_BUCKETS,
+    "max_gap": _SECONDS_BUCKETS,
+    "duration": _SECONDS_BUCKETS,
+    "tokens_per_second": _RATE_BUCKETS,
+}
+
+
+class MemorySink(MetricsSink):
+    """按（提供商，模型，endpoint）聚合的内存直方图，并保留最近的调用记录"""
+
+    name = "memory"
+
+    def __init__(self, recent: int = 100):
+        self._groups: Dict[Tuple, Dict[str, Histogram]] = {}
+        self._counters: Dict[Tuple, Dict[str, int]] = {}
+        self.recent: deque = deque(maxlen=recent)
+
+    def emit(self, record: CallRecord):
+        group = (record.provider, record.model, record.endpoint)
+        histograms = self._groups.get(group)
+        if histograms is None:
+            histograms = self._groups[group] = {name: Histogram(buckets) for name, buckets in _HISTOGRAM_FIELDS.items()}
+            self._counters[group] = {"calls": 0, "errors": 0, "cancelled": 0, "cache_hits": 0,
+                                     "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0,
+                                     "cancelled_output_tokens": 0}
+        if not record.cache_hit:
+            for name, histogram in histograms.items():
+                value = getattr(record, name)
+                if value is not None:
+                    histogram.observe(value)
+        counters = self._counters[group]
+        counters["calls"] += 1
+        counters["errors"] += record.error is not None
+        counters["cancelled"] += record.cancelled
+        counters["cache_hits"] += record.cache_hit
+        counters["prompt_tokens"] += record.prompt_tokens or 0
+        counters["cached_tokens"] += record.cached_tokens or 0
+        counters["output_tokens"] += record.output_tokens
+        # 客户端断开等原因取消的调用，已生成的token同样计费
+        if record.cancelled:
+            counters["cancelled_output_tokens"] += record.output_tokens
+        self.recent.append(record.to_dict())
+
+    def snapshot(self) -> dict:
+        groups = []
+        for group, histograms in self._groups.items():
+            provider, model, endpoint = group
+            counters = self._counters[group]
+            groups.append({
+                "provider": provider,
+                "model": model,
+                "endpoint": endpoint,
+                **counters,
+                "prompt_cache_hit_rate": counters["cached_tokens"] / counters["prompt_tokens"]
+                if counters["prompt_tokens"] else 0.0,
+                "histograms": {name: histogram.to_dict() for name, histogram in histograms.items()},
+            })
+        return {"groups": groups, "recent": list(self.recent)}
+
+
+class LLMMetrics:
+    """调用记录的分发器，按配置启用内置的输出目标，也可以通过add_sink接入其他实现"""
+
+    builtin_sinks = {"memory": MemorySink, "log": LogSink}
+
+    def __init__(self, sinks: List[str] | None = None):
+        self.sinks: List[MetricsSink] = []
+        for name in sinks or []:
+            if name not in self.builtin_sinks:
+                logger.warning(f"未知的LLM指标输出: {name}")
+                continue
+            self.add_sink(self.builtin_sinks[name]())
+
+    def add_sink(self, sink: MetricsSink):
+        self.sinks.append(sink)
+
+    def get_sink(self, name: str) -> MetricsSink | None:
+        return next((sink for sink in self.sinks if sink.name == name), None)
+
+    def start(self, model: str, stream: bool, provider: str | None = None) -> CallRecord:
+        return CallRecord(model, stream, provider=provider, **current_tags())
+
+    def emit(self, record: CallRecord):
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception as e:
+                logger.warning(f"LLM指标输出失败 | Sink: {sink.name} | {type(e).__name__}: {e}")
+
+    def snapshot(self) -> dict:
+        snapshots = {sink.name: sink.snapshot() for sink in self.sinks}
+        return {name: snapshot for name, snapshot in snapshots.items() if snapshot is not None}
+
+
+llm_metrics = LLMMetrics(config.get("llm_metrics.sinks", ["memory"]))
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+from types import SimpleNamespace
+from typing import AsyncIterator, List, Tuple
+from core.llms.base import AsyncBaseChatCOTModel
+from core.llms.metrics import current_call
+from core.schema import ToolCall, Function, ToolChoice
+from utils.log import logger
+
+_VOCABULARY = (
+    "我们", "需要", "分析", "当前", "问题", "首先", "然后", "因此", "可以", "考虑", "这个", "步骤",
+    "结果", "数据", "用户", "系统", "命令", "输出", "检查", "配置", "，", "。", "the ", "check ",
+    "result ", "step ", "data ", "\n",
+)
+
+
+class MockProviderError(Exception):
+    """模拟的提供商错误，带status_code以便重试策略按HTTP状态码处理"""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockCoT(AsyncBaseChatCOTModel):
+    """不访问网络的模拟模型，用于压测和延迟测试。
+    按种子和请求内容生成确定的思考、回答和工具调用，可配置首token时间、输出速度、错误率和片段大小，
+    也可以回放录制的对话记录（JSONL，每行包含thinking、content、tool_calls，可选user用于匹配最后一条用户消息）。
+    """
+
+    def __init__(self,
+                 api_base: str | None = None,
+                 api_key: str | None = None,
+                 model: str = "mock",
+                 support_fn_call: bool | None = True,
+                 max_length: int = 32768,
+                 enable_thinking: bool = False,
+                 seed: int = 0,
+                 ttft: float = 0.3,
+                 tokens_per_second: float = 50.0,
+                 chunk_size: int = 4,
+                 reasoning_tokens: int = 64,
+                 content_tokens: int = 128,
+                 error_rate: float = 0.0,
+                 tool_call_rate: float = 0.0,
+                 transcript_path: str | None = None,
+                 **kwargs):
+        super().__init__(model, support_fn_call, max_length=max_length, **kwargs)
+        logger.info(f'Initializing mock LLM | Model: {model} | TTFT: {ttft}s | Tokens/s: {tokens_per_second}')
+        self.api_base = api_base or "mock"
+        self.enable_thinking = enable_thinking
+        self.seed = seed
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.chunk_size = max(1, chunk_size)
+        self.reasoning_tokens = reasoning_tokens
+        self.content_tokens = content_tokens
+        self.error_rate = error_rate
+        self.tool_call_rate = tool_call_rate
+        self._transcript: List[dict] = []
+        self._transcript_by_user = {}
+        if transcript_path:
+            self._load_transcript(transcript_path)
+        self._replay = itertools.cycle(range(len(self._transcript))) if self._transcript else None
+        self.calls = 0
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"{super().cache_namespace}:thinking={self.enable_thinking}"
+
+    def _load_transcript(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._transcript.append(entry)
+                    if entry.get("user") is not None:
+                        self._transcript_by_user[entry["user"]] = entry
+
+    def _rng(self, messages: List[dict]) -> random.Random:
+        """同一种子、同一请求内容总是得到相同的随机序列"""
+        raw = json.dumps(messages, ensure_ascii=False, sort_keys=True, default=str)
+        digest = hashlib.sha256(f"{self.seed}:{raw}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    @staticmethod
+    def _words(rng: random.Random, count: int) -> List[str]:
+        return [rng.choice(_VOCABULARY) for _ in range(count)]
+
+    @staticmethod
+    def _fake_arguments(rng: random.Random, tool: dict) -> str:
+        """按工具参数定义生成必填参数"""
+        parameters = tool.get("function", {}).get("parameters", {})
+        properties = parameters.get("properties", {})
+        arguments = {}
+        for name in parameters.get("required", []):
+            schema = properties.get(name, {})
+            if schema.get("enum"):
+                arguments[name] = rng.choice(schema["enum"])
+            elif schema.get("type") in ("integer", "number"):
+                arguments[name] = rng.randint(0, 10)
+            elif schema.get("type") == "boolean":
+                arguments[name] = rng.random() < 0.5
+            elif schema.get("type") == "array":
+                arguments[name] = []
+            elif schema.get("type") == "object":
+                arguments[name] = {}
+            else:
+                arguments[name] = "".join(MockCoT._words(rng, 3))
+        return json.dumps(arguments, ensure_ascii=False)
+
+    def _script(self, messages: List[dict], tools: List[dict] | None) -> Tuple[List[str], List[str], List[ToolCall]]:
+        """生成本次请求的（思考片段，回答片段，工具调用）"""
+        rng = self._rng(messages)
+        if self._transcript:
+            last_user = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), None)
+            entry = self._transcript_by_user.get(last_user) or self._transcript[next(self._replay)]
+            tool_calls = [
+                ToolCall(id=f"call_{index}", function=Function(name=call["name"], arguments=call.get("arguments", "{}")))
+                for index, call in enumerate(entry.get("tool_calls") or [])
+            ]
+            return self._split(entry.get("thinking", "")), self._split(entry.get("content", "")), tool_calls
+
+        thinking = self._words(rng, self.reasoning_tokens) if self.enable_thinking else []
+        if tools and rng.random() < self.tool_call_rate:
+            tool = rng.choice(tools)
+            call_id = f"call_{rng.getrandbits(48):012x}"
+            tool_calls = [ToolCall(id=call_id, function=Function(name=tool["function"]["name"], arguments=self._fake_arguments(rng, tool)))]
+            return thinking, [], tool_calls
+        return thinking, self._words(rng, self.content_tokens), []
+
+    @staticmethod
+    def _split(text: str) -> List[str]:
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    def _check_error(self):
+        self.calls += 1
+        # 错误按调用次数和种子决定，同一请求重试时可能成功
+        if self.error_rate and random.Random(f"{self.seed}:{self.calls}").random() < self.error_rate:
+            raise MockProviderError(f"模拟的提供商错误（第{self.calls}次调用）")
+
+    def _record_usage(self, record, messages: List[dict], thinking: List[str], content: List[str]):
+        if record is None:
+            return
+        record.provider = f"mock:{self.model}"
+        record.set_usage(SimpleNamespace(
+            prompt_tokens=self.token_counter.count_messages(messages),
+            completion_tokens=len(thinking) + len(content),
+            completion_tokens_details=SimpleNamespace(reasoning_tokens=len(thinking)),
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+        ))
+
+    async def _chat_stream(self,
+                           messages: List[dict],
+                           stop: List[str] | None = None,
+                           tools: List[dict] | None = None,
+                           tool_choice: ToolChoice = ToolChoice.AUTO,
+                           **kwargs) -> AsyncIterator[Tuple[str, str, list]]:
+        self._check_error()
+        thinking, content, tool_calls = self._script(messages, tools)
+        return self._stream(current_call.get(), messages, thinking, content, tool_calls)
+
+    async def _stream(self, record, messages: List[dict], thinking: List[str], content: List[str], tool_calls: List[ToolCall]):
+        await asyncio.sleep(self.ttft)
+        interval = self.chunk_size / self.tokens_per_second if self.tokens_per_second else 0
+        for index in range(0, len(thinking), self.chunk_size):
+            yield ("".join(thinking[index:index + self.chunk_size]), "", None)
+            await asyncio.sleep(interval)
+        for index in range(0, len(content), self.chunk_size):
+            yield ("", "".join(content[index:index + self.chunk_size]), None)
+            await asyncio.sleep(interval)
+        self._record_usage(record, messages, thinking, content)
+        if tool_calls:
+            yield ("", "", tool_calls)
+
+    async def _chat_no_stream(self,
+                              messages: List[dict],
+                              stop: List[str] | None = None,
+                              tools: List[dict] | None = None,
+                              tool_choice: ToolChoice = ToolChoice.AUTO,
+                              **kwargs) -> Tuple[str, str, list]:
+        self._check_error()
+        thinking, content, tool_calls = self._script(messages, tools)
+        tokens = len(thinking) + len(content)
+        await asyncio.sleep(self.ttft + (tokens / self.tokens_per_second if self.tokens_per_second else 0))
+        self._record_usage(current_call.get(), messages, thinking, content)
+        return "".join(thinking), "".join(content), tool_calls
@@ -1,73 +1,235 @@
+import asyncio
+import time
 from typing import List, Union, Tuple, AsyncIterator, Callable
 from core.llms.base import AsyncBaseChatCOTModel
-from utils.log import logger
-from openai import AsyncOpenAI
-from core.schema import Message, ToolChoice, ToolCall, Function
+from utils.log import logger, payload
+from openai import AsyncOpenAI, APIConnectionError
+from core.schema import Message, ToolChoice, ToolCall
 from core.config import config
+from core.llms.transport import http_client_pool
+from core.llms.breaker import breaker_registry
+from core.llms.limiter import limiter_registry, INTERACTIVE
+from core.llms.stream import FlushPolicy, TextBuffer, ToolCallAssembler
+from core.llms.metrics import current_call
+from core.scope import track_stream
+from utils.retry import RetryPolicy
+
+
+class _WatchedStream:
+    """包装SDK的流：读取中途出错计入熔断，完整读完才记为成功。
+    首个片段到达时把提供商记入调用记录，末尾的usage片段记入用量。
+    aclose无论流是否开始读取都会归还限流名额并关闭HTTP响应，调用方在读取前取消或断开也不会泄漏名额。
+    """
+
+    def __init__(self, llm: "OpenAICoT", response, lease, record=None):
+        self._llm = llm
+        self._response = response
+        self._iterator = response.__aiter__()
+        self._lease = lease
+        self._record = record
+        self._first = True
+        self._finished = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._finished = True
+            self._llm.breaker.record_success()
+            await self.aclose()
+            raise
+        except Exception as e:
+            self._finished = True
+            self._llm._record_failure(e)
+            await self.aclose()
+            raise
+        if self._record is not None:
+            if self._first:
+                self._record.provider = self._llm.provider_name
+                self._first = False
+            if chunk.usage is not None:
+                self._record.set_usage(chunk.usage)
+        return chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        if not self._finished:
+            # 提前结束（客户端断开、调用方取消）与提供商健康无关，只归还半开探测名额
+            self._llm.breaker.record_ignored()
+        self._lease.release()
+        # 关闭HTTP响应，中止提供商的生成
+        await self._response.close()
 
 class OpenAICoT(AsyncBaseChatCOTModel):
     """支持链式思考的OpenAI模型实现，集成了原OpenAi类的功能"""
     
-    def __init__(self, api_base: str,api_key: str,model: str, support_fn_call: bool | None = None,max_length: int = 8192, **kwargs):
-        super().__init__(model, support_fn_call, max_length=max_length)
+    def __init__(self, api_base: str,api_key: str,model: str, support_fn_call: bool | None = None,max_length: int = 8192,
+                 rate_limit: dict | None = None, batch_api: bool = False, **kwargs):
+        retry_policy = kwargs.pop("retry_policy", None) or RetryPolicy(
+            retryable_exceptions=(APIConnectionError,), **config.get("retry", {})
+        )
+        super().__init__(model, support_fn_call, max_length=max_length, retry_policy=retry_policy, **kwargs)
         logger.info(f'Initializing OpenAI CoT client | Model: {self.model} | URL: {api_base} ')
-        self.client = AsyncOpenAI(api_key=api_key, base_url=api_base)
+        self.api_base = api_base
+        # 提供商是否支持OpenAI兼容的批处理文件接口（/v1/batches）
+        self.batch_api = batch_api
+        # 同一api_base的实例共享连接池，避免重复握手和过多连接
+        # 重试统一由retry_policy处理，关闭SDK自带的重试避免叠加
+        self.client = AsyncOpenAI(api_key=api_key, base_url=api_base, http_client=http_client_pool.get_client(api_base), max_retries=0)
+        self.breaker = breaker_registry.create(
+            self.provider_name,
+            failure_threshold=config.get("circuit_breaker.failure_threshold", 5),
+            recovery_timeout=config.get("circuit_breaker.recovery_timeout", 30),
+            half_open_max_calls=config.get("circuit_breaker.half_open_max_calls", 1),
+        )
+        rate_limit = rate_limit or {}
+        # 流式片段的刷新策略（按字符数/时间），决定输出偏向低延迟还是高吞吐
+        self.flush_policy = FlushPolicy.from_config()
+        self.limiter = limiter_registry.get(
+            self.provider_name,
+            rpm=rate_limit.get("rpm"),
+            tpm=rate_limit.get("tpm"),
+            max_concurrency=rate_limit.get("max_concurrency"),
+        )
+
+    @property
+    def provider_name(self) -> str:
+        return f"{self.model}@{self.api_base}"
+
+    def _record_failure(self, error: BaseException):
+        """只有可重试类的错误（超时、连接错误、429/5xx）计入熔断"""
+        if self.retry_policy.is_retryable(error):
+            self.breaker.record_failure(error)
+        else:
+            self.breaker.record_ignored()
+
+    async def _create(self, priority: str = INTERACTIVE, **params):
+        """经过熔断器和限流器调用chat.completions.create，流式调用返回包装后的流"""
+        self.breaker.before_call()
+        # 预估占用的token：提示词 + 最大输出
+        tokens = self.token_counter.count_messages(params["messages"]) \
+            + self.token_counter.count_tools(params.get("tools")) + (params.get("max_tokens") or 0)
+        record = current_call.get()
+        lease = None
+        try:
+            queued_at = time.monotonic()
+            lease = await self.limiter.acquire(tokens, priority)
+            if record is not None:
+                record.queue_time += time.monotonic() - queued_at
+            response = await self.client.chat.completions.create(**params)
+        except BaseException as e:
+            if lease is not None:
+                lease.release()
+            if isinstance(e, Exception) and lease is not None:
+                self._record_failure(e)
+            else:
+                self.breaker.record_ignored()
+            raise
+        if params.get("stream"):
+            # 登记到请求范围：流在开始读取前被放弃时，范围关闭时仍会归还名额
+            return track_stream(_WatchedStream(self, response, lease, record))
+        lease.release()
+        self.breaker.record_success()
+        if record is not None:
+            record.provider = self.provider_name
+            record.set_usage(response.usage)
+        return response
+
+    def batch_request_body(self, messages: List[dict], **kwargs) -> dict:
+        """批处理文件中单个请求的body，使用与非流式调用相同的默认参数，extra_body合并到body中"""
+        body = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": kwargs.get("temperature", config.model.temperature),
+            "max_tokens": kwargs.get("max_tokens", config.model.max_tokens),
+        }
+        body.update(kwargs.get("extra_body") or {})
+        return body
 
     async def _process_stream_response(self, response) -> AsyncIterator[Tuple[str, str, List[ToolCall]]]:
-        """处理流式响应，生成（思考片段，回答片段）元组"""
-        buffer_reasoning = ""
-        buffer_content = ""
-        buffer_limit = 10  # 缓冲字符数
-        tool_info = []
-        
-        async for chunk in response:
-            delta = chunk.choices[0].delta if chunk.choices else None
-            # 处理思考内容
-            reasoning = getattr(delta, 'reasoning_content', "")
-            if reasoning:
-                buffer_reasoning += reasoning
-                if len(buffer_reasoning) >= buffer_limit:
-                    yield (buffer_reasoning, "", None)
-                    buffer_reasoning = ""
-            
-            # 处理正式回答
-            content = getattr(delta, 'content', "")
-            if content:
-                # 确保在处理content前先输出所有reasoning
-                if buffer_reasoning:
-                    yield (buffer_reasoning, "", None)
-                    buffer_reasoning = ""
-                buffer_content += content
-                if len(buffer_content) >= buffer_limit:
-                    yield ("", buffer_content, None)
-                    buffer_content = ""
-
-            if delta.tool_calls:
-                for tool_call in delta.tool_calls:
-                    index = tool_call.index
-                    while len(tool_info) <= index:
-                        tool_info.append({})
-                    if tool_call.id:
-                        tool_info[index]["id"] = tool_info[index].get("id", "") + tool_call.id
-                    if tool_call.function and tool_call.function.name:
-                        tool_info[index]["name"] = tool_info[index].get("name", "") + tool_call.function.name
-                    if tool_call.function and tool_call.function.arguments:
-                        tool_info[index]["arguments"] = tool_info[index].get("arguments", "") + tool_call.function.arguments
+        """处理流式响应，生成（思考片段，回答片段，工具调用）元组，按flush_policy合并小片段。
+        缓冲中有文本时等待下一个片段不超过max_interval，上游停顿时先输出已缓冲的文本。
+        工具调用列表可能出现多次：参数完整的工具调用会提前返回，最后一次为全部工具调用。
+        """
+        reasoning_buffer = TextBuffer(self.flush_policy)
+        content_buffer = TextBuffer(self.flush_policy)
+        tool_calls = ToolCallAssembler()
+        iterator = response.__aiter__()
+        # 等待超时后仍在读取的下一个片段，不能取消，否则会中断上游流
+        pending = None
+
+        try:
+            while True:
+                waits = [wait for wait in (reasoning_buffer.time_left(), content_buffer.time_left()) if wait is not None]
+                try:
+                    if not waits and pending is None:
+                        chunk = await iterator.__anext__()
+                    else:
+                        if pending is None:
+                            pending = asyncio.ensure_future(iterator.__anext__())
+                        done, _ = await asyncio.wait({pending}, timeout=min(waits) if waits else None)
+                        if not done:
+                            # 上游停顿：按时间刷新已缓冲的文本，继续等待同一个片段
+                            if reasoning_buffer:
+                                yield (reasoning_buffer.flush(), "", None)
+                            if content_buffer:
+                                yield ("", content_buffer.flush(), None)
+                            continue
+                        chunk, pending = pending.result(), None
+                except StopAsyncIteration:
+                    break
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta is None:
+                    continue
+                # 处理思考内容
+                reasoning = getattr(delta, 'reasoning_content', None)
+                if reasoning:
+                    text = reasoning_buffer.push(reasoning)
+                    if text:
+                        yield (text, "", None)
+
+                # 处理正式回答
+                content = getattr(delta, 'content', None)
+                if content:
+                    # 确保在处理content前先输出所有reasoning
+                    if reasoning_buffer:
+                        yield (reasoning_buffer.flush(), "", None)
+                    text = content_buffer.push(content)
+                    if text:
+                        yield ("", text, None)
+
+                if delta.tool_calls:
+                    for tool_call in delta.tool_calls:
+                        function = tool_call.function
+                        tool_calls.add(
+                            tool_call.index,
+                            id=tool_call.id,
+                            name=function.name if function else None,
+                            arguments=function.arguments if function else None,
+                        )
+                    # 参数已完整的工具调用提前返回，调用方可以在生成结束前开始执行
+                    completed = tool_calls.poll_completed()
+                    if completed:
+                        yield ("", "", completed)
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+            # 提前结束时关闭上游流，不等到垃圾回收
+            await response.aclose()
 
         # 处理剩余缓冲
-        if buffer_content:
-            yield ("", buffer_content, None)
-        if tool_info:
-            tools = []
-            for tool in tool_info:
-                tools.append(ToolCall(
-                    id=tool["id"],
-                    function=Function(
-                        name=tool["name"],
-                        arguments=tool["arguments"]
-                    )
-                ))
-            yield ("", "", tools)
+        if reasoning_buffer:
+            yield (reasoning_buffer.flush(), "", None)
+        if content_buffer:
+            yield ("", content_buffer.flush(), None)
+        if tool_calls:
+            yield ("", "", tool_calls.build())
 
     async def _chat_stream(self, 
                     messages: List[ dict], 
@@ -75,12 +237,16 @@ class OpenAICoT(AsyncBaseChatCOTModel):
                     tools: List[dict] | None = None, 
                     tool_choice: ToolChoice = ToolChoice.AUTO,
                     **kwargs) -> AsyncIterator[Tuple[str, str, list]]:
-        logger.info(f'Calling OpenAI CoT API | Model: {self.model} | Stream: True | Messages: {messages}')
+        logger.info('Calling OpenAI CoT API | Model: %s | Stream: True | Messages: %d', self.model, len(messages))
+        logger.debug('Request messages: %s', payload(messages), extra={"sample": "llm_messages"})
         
         temperature = kwargs.pop('temperature', config.model.temperature)
         max_tokens = kwargs.pop('max_tokens', config.model.max_tokens)
         timeout = kwargs.pop('timeout', config.model.timeout)
-        response = await self.client.chat.completions.create(
+        # 让提供商在流的末尾返回usage，用于统计输出速度
+        if config.get("llm_metrics.include_usage", True):
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        response = await self._create(
             model=self.model,
             messages=messages,
             stop=stop,
@@ -101,12 +267,13 @@ class OpenAICoT(AsyncBaseChatCOTModel):
                         tools: List[dict] | None = None, 
                         tool_choice: ToolChoice = ToolChoice.AUTO,
                         **kwargs) -> Tuple[str, str, list]:
-        logger.info(f'Calling OpenAI CoT API | Model: {self.model} | Stream: False | Messages: {messages}')
+        logger.info('Calling OpenAI CoT API | Model: %s | Stream: False | Messages: %d', self.model, len(messages))
+        logger.debug('Request messages: %s', payload(messages), extra={"sample": "llm_messages"})
         
         temperature = kwargs.pop('temperature', config.model.temperature)
         max_tokens = kwargs.pop('max_tokens', config.model.max_tokens)
         timeout = kwargs.pop('timeout', config.model.timeout)
-        response = await self.client.chat.completions.create(
+        response = await self._create(
             model=self.model,
             messages=messages,
             stop=stop,
@@ -0,0 +1,53 @@
+import json
+from typing import Any, List, Tuple
+from pydantic import BaseModel
+
+
+def render_value(value: Any) -> str:
+    """把提示词中的数据渲染为确定的文本，相同数据总是得到字节一致的结果"""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, BaseModel):
+        value = value.model_dump(mode="json")
+    elif isinstance(value, (list, tuple)):
+        value = [item.model_dump(mode="json") if isinstance(item, BaseModel) else item for item in value]
+    return json.dumps(value, ensure_ascii=False, indent=2, default=str)
+
+
+class PromptBuilder:
+    """按稳定程度组装提示词，以便命中提供商的前缀缓存。
+    system消息依次为固定指令（instructions）和会话内不变的上下文（context），
+    之后是对话历史，每轮变化的内容（request）放在最后一条user消息中。
+    """
+
+    def __init__(self, instructions: str):
+        self.instructions = instructions.strip()
+        self._context: List[Tuple[str | None, str]] = []
+        self._request: List[Tuple[str | None, str]] = []
+
+    @staticmethod
+    def _section(title: str | None, text: str) -> str:
+        return f"# {title}\n{text}" if title else text
+
+    def context(self, title: str | None, value: Any) -> "PromptBuilder":
+        """添加会话内保持不变的内容（如题目描述、WP）"""
+        self._context.append((title, render_value(value)))
+        return self
+
+    def request(self, title: str | None, value: Any) -> "PromptBuilder":
+        """添加每轮都会变化的内容（如当前配置状态、用户输入）"""
+        self._request.append((title, render_value(value)))
+        return self
+
+    def system_content(self) -> str:
+        return "\n\n".join([self.instructions, *(self._section(title, text) for title, text in self._context)])
+
+    def user_content(self) -> str:
+        return "\n\n".join(self._section(title, text) for title, text in self._request)
+
+    def system_message(self) -> dict:
+        return {"role": "system", "content": self.system_content()}
+
+    def user_message(self) -> dict:
+        return {"role": "user", "content": self.user_content()}
+
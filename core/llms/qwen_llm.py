@@ -1,5 +1,6 @@
 from typing import AsyncIterator, List, Tuple
 from .openai_llm import OpenAICoT
+from .stream import StreamAssembler
 from core.schema import Message, ToolChoice
 from utils.log import logger
 
@@ -8,14 +9,21 @@ class QwenCoT(OpenAICoT):
         super().__init__(api_base, api_key, model, support_fn_call, max_length, **kwargs)
         self.enable_thinking = enable_thinking
 
+    @property
+    def cache_namespace(self) -> str:
+        return f"{super().cache_namespace}:thinking={self.enable_thinking}"
+
+    def batch_request_body(self, messages: List[dict], **kwargs) -> dict:
+        # 批处理请求为非流式调用，Qwen3要求显式关闭思考模式，否则拒绝请求
+        kwargs["extra_body"] = {"enable_thinking": False, **(kwargs.get("extra_body") or {})}
+        return super().batch_request_body(messages, **kwargs)
+
     async def _chat_no_stream(self, messages: List[dict], stop: List[str] | None = None, tools: List[dict] | None = None, tool_choice: ToolChoice = ToolChoice.AUTO, **kwargs) -> Tuple[str, str, list]:
-        all_thinking = ""
-        all_result = ""
+        assembler = StreamAssembler()
         generater = await self._chat_stream(messages, stop, tools, tool_choice, extra_body={"enable_thinking": self.enable_thinking}, **kwargs)
         async for thinking, result, tool_calls in generater:
-            all_thinking += thinking
-            all_result += result
-        return all_thinking, all_result, tool_calls
+            assembler.feed(thinking, result, tool_calls)
+        return assembler.thinking, assembler.content, assembler.tool_calls
 
     async def _chat_stream(self, messages: List[dict], stop: List[str] | None = None, tools: List[dict] | None = None, tool_choice: ToolChoice = ToolChoice.AUTO, **kwargs) -> AsyncIterator[Tuple[str, str, list]]:
         extra_body = kwargs.pop("extra_body", {"enable_thinking": self.enable_thinking})
@@ -0,0 +1,260 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Tuple
+from core.llms.base import AsyncBaseChatCOTModel
+from utils.retry import RetryPolicy
+from utils.log import logger
+
+
+class ProviderStats:
+    """单个提供商的延迟、首token时间和错误率统计（EWMA）"""
+
+    def __init__(self, alpha: float = 0.2, window: int = 200):
+        self.alpha = alpha
+        self.latency: float | None = None
+        self.ttft: float | None = None
+        self.error_rate = 0.0
+        self.latency_samples: deque = deque(maxlen=window)
+        self.ttft_samples: deque = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def _ewma(self, current: float | None, value: float) -> float:
+        return value if current is None else self.alpha * value + (1 - self.alpha) * current
+
+    def record_success(self, latency: float | None = None, ttft: float | None = None):
+        self.calls += 1
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        if latency is not None:
+            self.latency = self._ewma(self.latency, latency)
+            self.latency_samples.append(latency)
+        if ttft is not None:
+            self.ttft = self._ewma(self.ttft, ttft)
+            self.ttft_samples.append(ttft)
+
+    def record_censored(self, elapsed: float, stream: bool):
+        """记录被对冲取消的调用：真实耗时至少为elapsed"""
+        if stream:
+            self.ttft = self._ewma(self.ttft, elapsed)
+            self.ttft_samples.append(elapsed)
+        else:
+            self.latency = self._ewma(self.latency, elapsed)
+            self.latency_samples.append(elapsed)
+
+    def record_error(self):
+        self.calls += 1
+        self.errors += 1
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+
+    @staticmethod
+    def _quantile(samples: deque, q: float) -> float | None:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def quantile(self, q: float, stream: bool) -> float | None:
+        return self._quantile(self.ttft_samples if stream else self.latency_samples, q)
+
+    def score(self, stream: bool, error_penalty: float = 5.0) -> float:
+        """预期耗时，越小越好；从未调用过的提供商得0分，优先获得探测流量"""
+        if self.calls == 0 and not self.latency_samples and not self.ttft_samples:
+            return 0.0
+        expected = self.ttft if stream else self.latency
+        if expected is None:
+            expected = self.latency or self.ttft or 1.0
+        return expected * (1 + error_penalty * self.error_rate) * (1 + 0.1 * self.in_flight)
+
+    def to_dict(self) -> dict:
+        return {
+            "latency_ewma": self.latency,
+            "ttft_ewma": self.ttft,
+            "latency_p95": self._quantile(self.latency_samples, 0.95),
+            "ttft_p95": self._quantile(self.ttft_samples, 0.95),
+            "error_rate": self.error_rate,
+            "calls": self.calls,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+        }
+
+
+class LLMRouter(AsyncBaseChatCOTModel):
+    """在多个提供商之间按延迟和错误率路由的模型，可选对冲请求：
+    首选提供商在p95延迟内没有响应时，向次优提供商再发一次请求，先返回的获胜，另一个被取消。
+    提供商调用失败时（已按该提供商的重试策略重试）依次改用下一个候选。
+    """
+
+    def __init__(self,
+                 providers: Dict[str, AsyncBaseChatCOTModel],
+                 hedge: bool = False,
+                 hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 1.0,
+                 hedge_max_delay: float = 30.0,
+                 hedge_min_samples: int = 10,
+                 **kwargs):
+        if not providers:
+            raise ValueError("路由至少需要一个提供商")
+        # 重试由各提供商按自己的策略执行，路由层只做故障转移，避免重试次数叠加
+        kwargs.setdefault("retry_policy", RetryPolicy(max_retries=0))
+        super().__init__(
+            model="router:" + ",".join(providers),
+            support_fn_call=True,
+            max_length=min(provider.max_length for provider in providers.values()),
+            **kwargs
+        )
+        self.providers = providers
+        self.stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in providers}
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        logger.info(f'Initializing LLM router | Providers: {list(providers)} | Hedge: {hedge}')
+
+    def candidates(self, stream: bool) -> List[str]:
+        """按得分从优到劣排列的提供商，熔断中的提供商排除在外（全部熔断时保留全部）"""
+        names = [name for name in self.providers if self._allowed(name)] or list(self.providers)
+        return sorted(names, key=lambda name: self.stats[name].score(stream))
+
+    def _allowed(self, name: str) -> bool:
+        breaker = getattr(self.providers[name], "breaker", None)
+        return breaker is None or breaker.allow()
+
+    def _hedge_delay(self, name: str, stream: bool) -> float:
+        stats = self.stats[name]
+        samples = stats.ttft_samples if stream else stats.latency_samples
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_max_delay
+        delay = stats.quantile(self.hedge_quantile, stream)
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, delay))
+
+    async def _race(self, names: List[str], stream: bool, start_call, discard=None):
+        """按顺序调用候选提供商，返回先成功的结果：
+        首选提供商超过对冲延迟仍未返回时追加次优提供商（对冲，只追加一次）；
+        任一调用失败时立即启动下一个候选（故障转移）。同时成功的其余结果交给discard清理，
+        全部候选都失败时抛出最后一个错误。
+        """
+        remaining = list(names)
+        started: Dict[asyncio.Future, str] = {}
+        pending = set()
+
+        def start_next() -> asyncio.Future:
+            name = remaining.pop(0)
+            task = asyncio.ensure_future(start_call(name))
+            started[task] = name
+            pending.add(task)
+            return task
+
+        primary = start_next()
+        hedged = not self.hedge
+        error = None
+        try:
+            while pending:
+                timeout = None
+                if not hedged and remaining and len(pending) == 1:
+                    current = started[next(iter(pending))]
+                    timeout = self._hedge_delay(current, stream)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                if not done:
+                    hedged = True
+                    self.hedged_requests += 1
+                    task = start_next()
+                    logger.info(f'对冲请求 | 首选: {current} 超时未响应，追加: {started[task]}')
+                    continue
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    if winners[0] is not primary:
+                        self.hedge_wins += 1
+                    for task in winners[1:]:
+                        if discard is not None:
+                            await discard(task.result())
+                    return winners[0].result()
+                for task in done:
+                    error = task.exception()
+                    if remaining:
+                        failover = start_next()
+                        logger.info(
+                            f'故障转移 | 提供商: {started[task]} 调用失败（{type(error).__name__}），改用: {started[failover]}'
+                        )
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _chat_no_stream(self, messages: List[dict], stop: List[str] | None = None, **kwargs) -> Tuple[str, str, list]:
+        async def call(name: str):
+            stats = self.stats[name]
+            stats.in_flight += 1
+            start = time.monotonic()
+            try:
+                result = await self.providers[name].call_no_stream(messages, stop=stop, **kwargs)
+            except asyncio.CancelledError:
+                stats.record_censored(time.monotonic() - start, stream=False)
+                raise
+            except Exception:
+                stats.record_error()
+                raise
+            finally:
+                stats.in_flight -= 1
+            latency = time.monotonic() - start
+            stats.record_success(latency=latency, ttft=None)
+            return result
+
+        return await self._race(self.candidates(stream=False), False, call)
+
+    async def _chat_stream(self, messages: List[dict], stop: List[str] | None = None, **kwargs) -> AsyncIterator[Tuple[str, str, list]]:
+        async def open_stream(name: str):
+            stats = self.stats[name]
+            start = time.monotonic()
+            stream = None
+            try:
+                stream = await self.providers[name].call_stream(messages, stop=stop, **kwargs)
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except asyncio.CancelledError:
+                stats.record_censored(time.monotonic() - start, stream=True)
+                if stream is not None:
+                    await stream.aclose()
+                raise
+            except Exception:
+                stats.record_error()
+                raise
+            return name, stream, first, start, time.monotonic() - start
+
+        async def discard(result):
+            await result[1].aclose()
+
+        name, stream, first, start, ttft = await self._race(self.candidates(stream=True), True, open_stream, discard)
+        return self._relay(name, stream, first, start, ttft)
+
+    async def _relay(self, name: str, stream: AsyncIterator, first, start: float, ttft: float):
+        """转发获胜的流，并在结束时记录统计"""
+        stats = self.stats[name]
+        stats.in_flight += 1
+        try:
+            if first is not None:
+                yield first
+                async for item in stream:
+                    yield item
+        except Exception:
+            stats.record_error()
+            raise
+        else:
+            stats.record_success(latency=time.monotonic() - start, ttft=ttft)
+        finally:
+            stats.in_flight -= 1
+            await stream.aclose()
+
+    def to_dict(self) -> dict:
+        return {
+            "providers": {name: stats.to_dict() for name, stats in self.stats.items()},
+            "hedge": self.hedge,
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -0,0 +1,155 @@
+import json
+import time
+from typing import Dict, List, Tuple
+from core.config import config
+from core.schema import ToolCall, Function
+
+
+class FlushPolicy:
+    """流式片段的刷新策略：累计字符数达到max_chars，或距上次刷新超过max_interval秒时输出。
+    max_chars较小偏向低延迟，max_chars较大并配合max_interval偏向高吞吐（更少的小包写入）。
+    """
+
+    __slots__ = ("max_chars", "max_interval")
+
+    def __init__(self, max_chars: int = 10, max_interval: float | None = None):
+        self.max_chars = max(1, max_chars)
+        self.max_interval = max_interval or None
+
+    @classmethod
+    def from_config(cls) -> "FlushPolicy":
+        return cls(
+            max_chars=config.get("stream.flush_chars", 10),
+            max_interval=config.get("stream.flush_interval"),
+        )
+
+
+class TextBuffer:
+    """按刷新策略累积文本片段，片段存放在列表中，刷新时只拼接一次"""
+
+    __slots__ = ("policy", "_parts", "_size", "_last_flush")
+
+    def __init__(self, policy: FlushPolicy):
+        self.policy = policy
+        self._parts: List[str] = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def push(self, text: str) -> str | None:
+        """追加片段，满足刷新条件时返回待输出的文本"""
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.policy.max_chars:
+            return self.flush()
+        if self.policy.max_interval and time.monotonic() - self._last_flush >= self.policy.max_interval:
+            return self.flush()
+        return None
+
+    def time_left(self) -> float | None:
+        """距离按时间刷新还剩的秒数，缓冲为空或未设置max_interval时返回None"""
+        if not self._size or not self.policy.max_interval:
+            return None
+        return max(0.0, self._last_flush + self.policy.max_interval - time.monotonic())
+
+    def flush(self) -> str:
+        text = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        self._last_flush = time.monotonic()
+        return text
+
+
+class ToolCallAssembler:
+    """按index汇总流式工具调用的id、名称和参数片段。
+    工具调用在参数已经是完整的JSON，或者下一个工具调用开始时视为完成，可以在流结束前通过poll_completed取出。
+    """
+
+    def __init__(self):
+        self._calls: Dict[int, Tuple[List[str], List[str], List[str]]] = {}
+        # 参数已确认完整的工具调用index
+        self._complete = set()
+        # 已经通过poll_completed返回的工具调用数
+        self._announced = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._calls)
+
+    def add(self, index: int, id: str | None = None, name: str | None = None, arguments: str | None = None):
+        if index not in self._calls:
+            # 新的工具调用开始，之前的工具调用都已完成
+            self._complete.update(self._calls)
+        ids, names, args = self._calls.setdefault(index, ([], [], []))
+        if id:
+            ids.append(id)
+        if name:
+            names.append(name)
+        if arguments:
+            args.append(arguments)
+            # 只在片段以}结尾时尝试解析，避免每个片段都拼接整个参数
+            if index not in self._complete and arguments.rstrip().endswith("}"):
+                try:
+                    json.loads("".join(args))
+                    self._complete.add(index)
+                except ValueError:
+                    pass
+
+    def poll_completed(self) -> List[ToolCall] | None:
+        """有新完成的工具调用时，返回从第一个开始连续完成的所有工具调用，否则返回None"""
+        indexes = sorted(self._calls)
+        count = 0
+        while count < len(indexes) and indexes[count] in self._complete:
+            count += 1
+        if count <= self._announced:
+            return None
+        self._announced = count
+        return [self._build(index) for index in indexes[:count]]
+
+    def _build(self, index: int) -> ToolCall:
+        ids, names, args = self._calls[index]
+        return ToolCall(id="".join(ids), function=Function(name="".join(names), arguments="".join(args)))
+
+    def build(self) -> List[ToolCall]:
+        return [self._build(index) for index in sorted(self._calls)]
+
+
+class StreamAssembler:
+    """汇总chat流返回的（思考片段，回答片段，工具调用）元组。
+    片段存放在列表中，读取完整文本时才拼接，并缓存到有新片段为止，避免逐片段字符串拼接带来的二次复制。
+    """
+
+    __slots__ = ("_thinking", "_content", "_thinking_text", "_content_text", "tool_calls")
+
+    def __init__(self):
+        self._thinking: List[str] = []
+        self._content: List[str] = []
+        self._thinking_text: str | None = ""
+        self._content_text: str | None = ""
+        self.tool_calls: List[ToolCall] = []
+
+    def feed(self, thinking: str | None, content: str | None, tool_calls: List[ToolCall] | None = None):
+        # 流中可能多次出现工具调用列表（先返回已完成的部分），每次都是截至当前的完整列表，以最后一次为准
+        if thinking:
+            self._thinking.append(thinking)
+            self._thinking_text = None
+        if content:
+            self._content.append(content)
+            self._content_text = None
+        if tool_calls:
+            self.tool_calls = tool_calls
+
+    @property
+    def thinking(self) -> str:
+        if self._thinking_text is None:
+            self._thinking_text = "".join(self._thinking)
+            self._thinking = [self._thinking_text]
+        return self._thinking_text
+
+    @property
+    def content(self) -> str:
+        if self._content_text is None:
+            self._content_text = "".join(self._content)
+            self._content = [self._content_text]
+        return self._content_text
@@ -0,0 +1,140 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, List, Union
+from core.schema import Message
+from utils.log import logger
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，缺失时退化为按字符类别估算
+    tiktoken = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # 可选依赖，用于加载模型自带的tokenizer.json
+    Tokenizer = None
+
+# 每条消息的格式开销（role、分隔符等）以及回复引导的开销
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+# 图片内容按固定开销估算
+IMAGE_TOKENS = 85
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# 各模型家族的估算系数：每个中日韩字符、每个其他字符对应的token数
+_FAMILY_RATIOS = {
+    "deepseek": (0.6, 0.3),
+    "qwen": (0.7, 0.3),
+    "openai": (1.0, 0.25),
+    "default": (1.0, 0.3),
+}
+
+
+def model_family(model: str) -> str:
+    """根据模型名称判断模型家族"""
+    name = model.lower()
+    if "deepseek" in name:
+        return "deepseek"
+    if "qwen" in name or "qwq" in name:
+        return "qwen"
+    if name.startswith(("gpt", "o1", "o3", "o4", "chatgpt")):
+        return "openai"
+    return "default"
+
+
+class TokenCounter:
+    """按模型家族计算token数，优先使用真实tokenizer，否则按字符类别估算"""
+
+    def __init__(self, model: str, tokenizer_path: str | None = None):
+        self.family = model_family(model)
+        self.name = f"{self.family}:{tokenizer_path or ''}"
+        self._encode = None
+        if tokenizer_path and Tokenizer is not None:
+            tokenizer = Tokenizer.from_file(tokenizer_path)
+            self._encode = lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        elif tokenizer_path:
+            logger.warning(f"未安装tokenizers，无法加载 {tokenizer_path}，使用估算方式计算token")
+        elif self.family == "openai" and tiktoken is not None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+            self._encode = lambda text: len(encoding.encode(text, disallowed_special=()))
+        self._cjk_ratio, self._other_ratio = _FAMILY_RATIOS[self.family]
+
+    def count_text(self, text: str | None) -> int:
+        """计算一段文本的token数"""
+        if not text:
+            return 0
+        if self._encode is not None:
+            return self._encode(text)
+        cjk = len(_CJK_PATTERN.findall(text))
+        return int(cjk * self._cjk_ratio + (len(text) - cjk) * self._other_ratio) + 1
+
+    def _count_content(self, content: Any) -> int:
+        if isinstance(content, str):
+            return self.count_text(content)
+        if isinstance(content, list):
+            total = 0
+            for item in content:
+                if isinstance(item, str):
+                    total += self.count_text(item)
+                elif isinstance(item, dict) and item.get("type") == "image_url":
+                    total += IMAGE_TOKENS
+                elif isinstance(item, dict):
+                    total += self.count_text(item.get("text"))
+            return total
+        return 0
+
+    def _count_tool_calls(self, tool_calls: Any) -> int:
+        if not tool_calls:
+            return 0
+        total = 0
+        for call in tool_calls:
+            if isinstance(call, dict):
+                function = call.get("function") or {}
+                name, arguments = function.get("name"), function.get("arguments")
+            else:
+                name, arguments = call.function.name, call.function.arguments
+            total += MESSAGE_OVERHEAD + self.count_text(name) + self.count_text(arguments)
+        return total
+
+    def count_message(self, message: Union[Message, dict]) -> int:
+        """计算单条消息的token数，Message对象会缓存结果，内容不变时只计算一次"""
+        if isinstance(message, Message):
+            cached = message._token_cache
+            if (cached is not None and cached[0] == self.name
+                    and cached[1] is message.content and cached[2] is message.tool_calls):
+                return cached[3]
+            count = (MESSAGE_OVERHEAD + self._count_content(message.content)
+                     + self._count_tool_calls(message.tool_calls) + self.count_text(message.name))
+            if message.base64_image:
+                count += IMAGE_TOKENS
+            message._token_cache = (self.name, message.content, message.tool_calls, count)
+            return count
+        return (MESSAGE_OVERHEAD + self._count_content(message.get("content"))
+                + self._count_tool_calls(message.get("tool_calls")) + self.count_text(message.get("name")))
+
+    def count_messages(self, messages: List[Union[Message, dict]]) -> int:
+        """计算消息列表的token数"""
+        if not messages:
+            return 0
+        return sum(self.count_message(message) for message in messages) + REPLY_OVERHEAD
+
+    def count_tools(self, tools: List[dict] | None) -> int:
+        """计算工具定义的token数"""
+        if not tools:
+            return 0
+        return self._count_tools_json(json.dumps(tools, ensure_ascii=False, sort_keys=True))
+
+    @lru_cache(maxsize=64)
+    def _count_tools_json(self, tools_json: str) -> int:
+        return self.count_text(tools_json)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str, tokenizer_path: str | None = None) -> TokenCounter:
+    """获取模型对应的token计数器（按模型名缓存）"""
+    return TokenCounter(model, tokenizer_path)
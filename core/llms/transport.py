@@ -0,0 +1,121 @@
+import time
+from typing import Callable, Dict, List
+import httpx
+from core.config import config
+from utils.log import logger
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应体读取完毕或关闭时归还连接计数"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """带连接占用统计的传输层，用于观察连接池饱和情况"""
+
+    def __init__(self, api_base: str, limits: httpx.Limits, http2: bool = False, **kwargs):
+        super().__init__(limits=limits, http2=http2, **kwargs)
+        self.api_base = api_base
+        self.max_connections = limits.max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+        self.saturated_requests = 0
+        self._last_saturated_log = 0.0
+
+    def _acquire(self):
+        self.total_requests += 1
+        if self.max_connections and self.in_flight >= self.max_connections:
+            # 连接已占满，本次请求需要在连接池中排队
+            self.saturated_requests += 1
+            now = time.monotonic()
+            if now - self._last_saturated_log > 10:
+                self._last_saturated_log = now
+                logger.warning(f'HTTP连接池已饱和 | URL: {self.api_base} | 在用: {self.in_flight}/{self.max_connections}')
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _release(self):
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._acquire()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        response.stream = _ReleasingStream(response.stream, self._release)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "api_base": self.api_base,
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_requests": self.total_requests,
+            "saturated_requests": self.saturated_requests,
+            "utilization": self.in_flight / self.max_connections if self.max_connections else 0.0,
+        }
+
+
+class HttpClientPool:
+    """按api_base共享的httpx客户端，同一上游的所有模型实例复用一个连接池"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, PooledTransport] = {}
+
+    @staticmethod
+    def _normalize(api_base: str) -> str:
+        return api_base.rstrip("/")
+
+    def get_client(self, api_base: str) -> httpx.AsyncClient:
+        key = self._normalize(api_base)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(
+                max_connections=config.get("http_pool.max_connections", 100),
+                max_keepalive_connections=config.get("http_pool.max_keepalive_connections", 20),
+                keepalive_expiry=config.get("http_pool.keepalive_expiry", 30),
+            )
+            http2 = config.get("http_pool.http2", False)
+            transport = PooledTransport(api_base=key, limits=limits, http2=http2)
+            client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(config.model.timeout, connect=config.get("http_pool.connect_timeout", 10)),
+                follow_redirects=True,
+            )
+            self._clients[key] = client
+            self._transports[key] = transport
+            logger.info(f'Creating shared HTTP client | URL: {key} | Limits: {limits} | HTTP2: {http2}')
+        return client
+
+    def stats(self) -> List[dict]:
+        return [transport.stats() for transport in self._transports.values()]
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._transports.clear()
+
+
+http_client_pool = HttpClientPool()
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Tuple
+from core.config import config
+from core.llms.metrics import CallRecord, MetricsSink, llm_metrics
+from utils.log import logger
+
+# 汇总的维度，与CallRecord上的属性同名
+DIMENSIONS = ("endpoint", "provider", "model", "caller")
+
+
+def caller_id(token: str | None) -> str | None:
+    """由调用方凭证得到用于统计的标识，只保留哈希，不记录凭证本身"""
+    if not token:
+        return None
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+class Usage:
+    """一组调用的token用量和费用"""
+
+    __slots__ = ("calls", "errors", "cancelled", "prompt_tokens", "cached_tokens", "completion_tokens",
+                 "reasoning_tokens", "estimated_tokens", "cost")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.reasoning_tokens = 0
+        # 提供商未返回usage时按输出文本估算的token数
+        self.estimated_tokens = 0
+        self.cost = 0.0
+
+    def add(self, record: CallRecord, cost: float):
+        self.calls += 1
+        self.errors += record.error is not None
+        self.cancelled += record.cancelled
+        self.prompt_tokens += record.prompt_tokens or 0
+        self.cached_tokens += record.cached_tokens or 0
+        self.completion_tokens += record.completion_tokens or 0
+        self.reasoning_tokens += record.reasoning_tokens or 0
+        if record.completion_tokens is None:
+            self.estimated_tokens += record.estimated_tokens
+        self.cost += cost
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["cost"] = round(self.cost, 6)
+        return data
+
+
+class UsageLedger(MetricsSink):
+    """按请求、endpoint、提供商、模型和调用方汇总LLM调用的token用量和费用。
+    累计值通过 /monitor/usage 查看；滚动窗口内的增量按周期追加写入汇总文件（每行一个JSON）。
+    费用按 usage.prices 中每百万token的单价计算，未配置单价的模型费用记为0。
+    """
+
+    name = "usage"
+
+    def __init__(self, prices: Dict[str, dict] | None = None, recent_requests: int = 1000,
+                 rollup_dir: str | None = None, rollup_interval: float = 300):
+        self.prices = prices or {}
+        self.recent_requests = recent_requests
+        self.rollup_dir = rollup_dir
+        self.rollup_interval = rollup_interval
+        self.total = Usage()
+        self._totals: Dict[str, Dict[str, Usage]] = {dimension: {} for dimension in DIMENSIONS}
+        self._window: Dict[Tuple[str, ...], Usage] = {}
+        self._window_start = self._started = time.time()
+        self._requests: "OrderedDict[str, Tuple[dict, Usage]]" = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+    def cost(self, record: CallRecord) -> float:
+        price = self.prices.get(record.model)
+        if not price:
+            return 0.0
+        prompt = record.prompt_tokens or 0
+        cached = record.cached_tokens or 0
+        completion = record.completion_tokens if record.completion_tokens is not None else record.estimated_tokens
+        return (
+            (prompt - cached) * price.get("prompt", 0)
+            + cached * price.get("cached_prompt", price.get("prompt", 0))
+            + completion * price.get("completion", 0)
+        ) / 1_000_000
+
+    def emit(self, record: CallRecord):
+        # 命中本地响应缓存的调用没有消耗提供商token
+        if record.cache_hit:
+            return
+        cost = self.cost(record)
+        self.total.add(record, cost)
+        for dimension in DIMENSIONS:
+            key = getattr(record, dimension) or "unknown"
+            self._totals[dimension].setdefault(key, Usage()).add(record, cost)
+        window_key = tuple(getattr(record, dimension) or "unknown" for dimension in DIMENSIONS)
+        self._window.setdefault(window_key, Usage()).add(record, cost)
+        if record.request_id:
+            entry = self._requests.get(record.request_id)
+            if entry is None:
+                entry = self._requests[record.request_id] = (
+                    {"endpoint": record.endpoint, "caller": record.caller}, Usage()
+                )
+                while len(self._requests) > self.recent_requests:
+                    self._requests.popitem(last=False)
+            entry[1].add(record, cost)
+
+    def request(self, request_id: str) -> dict | None:
+        """单个请求内所有LLM调用的用量"""
+        entry = self._requests.get(request_id)
+        if entry is None:
+            return None
+        tags, usage = entry
+        return {"request_id": request_id, **tags, **usage.to_dict()}
+
+    def snapshot(self, dimension: str | None = None, top: int | None = None) -> dict:
+        dimensions = [dimension] if dimension in DIMENSIONS else DIMENSIONS
+        data = {"total": self.total.to_dict(), "since": datetime.fromtimestamp(self._started).isoformat()}
+        for name in dimensions:
+            # 先按费用再按总token数排序；只有部分模型配置了价格时，未配置价格的条目排在后面，不把token数当作费用比较
+            rows = sorted(
+                self._totals[name].items(),
+                key=lambda item: (item[1].cost, item[1].prompt_tokens + item[1].completion_tokens),
+                reverse=True,
+            )
+            data[name] = [{name: key, **usage.to_dict()} for key, usage in rows[:top]]
+        # 最近请求按总token数排序，便于定位消耗最多的请求
+        requests = sorted(
+            self._requests.items(),
+            key=lambda item: item[1][1].prompt_tokens + item[1][1].completion_tokens,
+            reverse=True,
+        )
+        data["top_requests"] = [{"request_id": rid, **tags, **usage.to_dict()} for rid, (tags, usage) in requests[:top or 20]]
+        return data
+
+    def rollup(self) -> dict | None:
+        """取出当前窗口的增量并开始新窗口，窗口内没有调用时返回None"""
+        window, start = self._window, self._window_start
+        self._window, self._window_start = {}, time.time()
+        if not window:
+            return None
+        return {
+            "start": datetime.fromtimestamp(start).isoformat(),
+            "end": datetime.fromtimestamp(self._window_start).isoformat(),
+            "groups": [
+                {**dict(zip(DIMENSIONS, key)), **usage.to_dict()}
+                for key, usage in window.items()
+            ],
+        }
+
+    def _write_rollup(self, rollup: dict):
+        os.makedirs(self.rollup_dir, exist_ok=True)
+        path = os.path.join(self.rollup_dir, f"usage-{datetime.now():%Y%m%d}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rollup, ensure_ascii=False) + "\n")
+
+    async def flush(self):
+        """把当前窗口写入汇总文件"""
+        rollup = self.rollup()
+        if rollup is None or not self.rollup_dir:
+            return
+        try:
+            await asyncio.to_thread(self._write_rollup, rollup)
+        except OSError as e:
+            logger.warning(f"写入用量汇总失败: {type(e).__name__}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.rollup_interval)
+            await self.flush()
+
+    def start(self):
+        """在事件循环中启动周期性汇总"""
+        if self.rollup_dir and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止周期性汇总，并写入最后一个窗口"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+usage_ledger = UsageLedger(
+    prices=config.get("usage.prices", {}),
+    recent_requests=config.get("usage.recent_requests", 1000),
+    rollup_dir=config.get("usage.rollup_dir", "data/usage"),
+    rollup_interval=config.get("usage.rollup_interval", 300),
+)
+if config.get("usage.enable", True):
+    llm_metrics.add_sink(usage_ledger)
@@ -1,4 +1,5 @@
 from .base import AsyncMemory
 from .listmem import ListMemory
+from .compactor import ContextCompactor
 
-__all__ = ["AsyncMemory", "ListMemory"]
+__all__ = ["AsyncMemory", "ListMemory", "ContextCompactor"]
@@ -1,13 +1,18 @@
 from abc import ABC, abstractmethod
 from core.schema import Message
-from typing import List
+from typing import List, Optional
+from .index import RepetitionIndex
 
 class AsyncMemory(ABC):
     
-    def __init__(self, messages: List[Message] = [], max_turn: int = 100, max_length: int = 100000):
-        self.Messages = messages
+    def __init__(self, messages: Optional[List[Message]] = None, max_turn: int = 100, max_length: int = 100000):
+        # 不使用可变默认值，否则所有未传messages的实例会共用同一个列表
+        self.Messages = messages if messages is not None else []
         self.max_turn = max_turn
         self.max_length = max_length
+        # 重复检测索引，子类在写入和淘汰消息时维护
+        self.index = RepetitionIndex()
+        self.index.rebuild(self.Messages)
 
     @abstractmethod
     async def add(self, message: Message):
@@ -29,6 +34,11 @@ class AsyncMemory(ABC):
     async def clear(self):
         pass
     
+    def replace(self, messages: List[Message]):
+        """用压缩后的消息替换当前消息，并按新的消息重建重复检测索引"""
+        self.Messages = messages
+        self.index.rebuild(messages)
+
     async def get_last_n_messages(self, n: int) -> List[Message]:
         return self.Messages[-n:]
 
@@ -47,4 +57,5 @@ class AsyncMemory(ABC):
     def load_from_history(cls, history: List[dict]):
         memory = cls()
         memory.Messages = [Message.from_history(message) for message in history]
+        memory.index.rebuild(memory.Messages)
         return memory
@@ -0,0 +1,175 @@
+from typing import Callable, List, Optional, Tuple
+from core.config import config
+from core.llms.metrics import llm_tags
+from core.schema import Message
+from utils.log import logger
+
+# 摘要消息的前缀，再次压缩时据此识别已有摘要并与新内容合并
+SUMMARY_PREFIX = "【之前对话的摘要】\n"
+
+_SUMMARY_PROMPT = """你是对话压缩助手。请把给出的对话记录压缩为简洁的摘要，供代理继续执行任务时参考。
+要求：
+- 保留用户的目标和约束、已经确认的事实和数据、已调用过的工具及关键结果、已做出的决定和尚未完成的事项
+- 工具返回的大段内容只保留与任务相关的结论，不要复述原文
+- 如果给出了已有摘要，把新内容合并进去，输出一份完整的新摘要
+- 直接输出摘要正文，不要添加额外说明"""
+
+
+def _role(message: Message) -> str:
+    return message.role.value if hasattr(message.role, "value") else message.role
+
+
+def _is_summary(message: Message) -> bool:
+    return _role(message) == "user" and (message.content or "").startswith(SUMMARY_PREFIX)
+
+
+class ContextCompactor:
+    """代理记忆的上下文压缩：消息占用的token超过阈值时，把较早的对话和工具结果总结为一条滚动摘要。
+    系统消息、标记为pinned的消息、最后一条用户消息和最近的若干条消息原样保留，摘要放在保留的较早消息之后、
+    最近的消息之前，使模型先看到任务再看到已完成的工作；切分位置不会把工具调用和对应的工具结果分开。
+    压缩以低于触发比例的目标比例为准，保留部分本身已超过触发阈值时不压缩，避免每一步都重新总结。
+    可以传入较便宜的模型专门用于生成摘要。
+    """
+
+    def __init__(self,
+                 llm=None,
+                 trigger_ratio: float | None = None,
+                 target_ratio: float | None = None,
+                 keep_recent: int | None = None,
+                 chunk_tokens: int | None = None,
+                 max_message_chars: int | None = None):
+        # 生成摘要使用的模型，None时使用代理自身的模型
+        self.llm = llm
+        # 消息token数超过上下文窗口的该比例时触发压缩
+        self.trigger_ratio = trigger_ratio or config.get("compaction.trigger_ratio", 0.6)
+        # 压缩后的目标比例：末尾保留的消息超过该比例时继续压缩较早的部分
+        self.target_ratio = target_ratio or config.get("compaction.target_ratio", 0.4)
+        # 末尾原样保留的消息数
+        self.keep_recent = keep_recent or config.get("compaction.keep_recent", 6)
+        # 每次总结的对话记录token上限，超过时分段滚动总结
+        self.chunk_tokens = chunk_tokens or config.get("compaction.chunk_tokens", 6000)
+        # 对话记录中单条消息的字符上限
+        self.max_message_chars = max_message_chars or config.get("compaction.max_message_chars", 4000)
+        self.compactions = 0
+
+    def should_compact(self, llm, messages: List[Message], tools: List[dict] | None = None) -> bool:
+        return llm.count_tokens(messages, tools) > llm.max_length * self.trigger_ratio
+
+    def _split(self, messages: List[Message],
+               count: Callable[[List[Message]], int] | None = None,
+               target: float | None = None
+               ) -> Tuple[List[Message], Optional[str], List[Message], List[Message], List[Message]]:
+        """切分为（保留的开头，已有摘要，需要总结的消息，摘要之前保留的消息，摘要之后保留的最近消息）。
+        给出count和target时，最近消息的token数超过target则继续把较早的部分划入总结，但至少保留最后一组消息。
+        """
+        head = messages[:1] if messages and _role(messages[0]) == "system" else []
+        start = len(head)
+
+        boundary = max(start, len(messages) - self.keep_recent)
+        # 保留部分不能以工具结果开头，否则工具结果会脱离发起它的工具调用
+        while boundary > start and _role(messages[boundary]) == "tool":
+            boundary -= 1
+        if count is not None and target is not None:
+            last_group = len(messages) - 1
+            while last_group > boundary and _role(messages[last_group]) == "tool":
+                last_group -= 1
+            while boundary < last_group and count(messages[boundary:]) > target:
+                boundary += 1
+                while boundary < last_group and _role(messages[boundary]) == "tool":
+                    boundary += 1
+
+        last_user = next(
+            (i for i in range(len(messages) - 1, start - 1, -1) if _role(messages[i]) == "user" and not _is_summary(messages[i])),
+            None,
+        )
+        previous_summary = None
+        compacted, kept = [], []
+        for index in range(start, boundary):
+            message = messages[index]
+            if _is_summary(message):
+                previous_summary = message.content[len(SUMMARY_PREFIX):]
+                continue
+            # 工具调用和工具结果总是一起总结，只有普通消息可以保留
+            pinned = getattr(message, "pinned", False) or index == last_user
+            if pinned and _role(message) != "tool" and not message.tool_calls:
+                kept.append(message)
+            else:
+                compacted.append(message)
+        return head, previous_summary, compacted, kept, messages[boundary:]
+
+    def _render(self, message: Message) -> str:
+        content = message.content or ""
+        if len(content) > self.max_message_chars:
+            content = f"{content[:self.max_message_chars]}...(已截断，共{len(content)}字符)"
+        role = _role(message)
+        if role == "tool":
+            return f"[工具结果 {message.name}]\n{content}"
+        lines = [f"[{role}]\n{content}"] if content else []
+        for call in message.tool_calls or []:
+            function = call["function"] if isinstance(call, dict) else call.function.model_dump()
+            lines.append(f"[{role} 调用工具 {function.get('name')}] 参数: {function.get('arguments')}")
+        return "\n".join(lines)
+
+    async def _summarize(self, summarizer, previous_summary: Optional[str], transcript: str, name: str) -> str:
+        parts = []
+        if previous_summary:
+            parts.append(f"已有摘要:\n{previous_summary}")
+        parts.append(f"需要压缩的对话记录:\n{transcript}")
+        with llm_tags(agent=f"{name}:compaction"):
+            _, content, _ = await summarizer.chat(
+                messages=[Message.system_message(_SUMMARY_PROMPT), Message.user_message("\n\n".join(parts))],
+                stream=False,
+            )
+        return content.strip()
+
+    async def compact(self, llm, messages: List[Message], name: str = "", tools: List[dict] | None = None) -> List[Message] | None:
+        """压缩消息列表，返回新的列表；没有可以压缩的消息，或压缩后仍超过触发阈值时返回None"""
+        head = messages[:1] if messages and _role(messages[0]) == "system" else []
+        target = llm.max_length * self.target_ratio - llm.count_tokens(head, tools)
+        head, summary, compacted, kept, recent = self._split(messages, llm.count_tokens, target)
+        if not compacted:
+            return None
+        if llm.count_tokens(head + kept + recent, tools) > llm.max_length * self.trigger_ratio:
+            logger.debug(f"{name} 保留的消息已超过压缩阈值，跳过压缩")
+            return None
+
+        summarizer = self.llm or llm
+        # 按token数分段，每段与之前的摘要合并，得到滚动摘要
+        chunk, chunk_tokens = [], 0
+        for message in compacted:
+            text = self._render(message)
+            if not text:
+                continue
+            tokens = summarizer.token_counter.count_text(text)
+            if chunk and chunk_tokens + tokens > self.chunk_tokens:
+                summary = await self._summarize(summarizer, summary, "\n\n".join(chunk), name)
+                chunk, chunk_tokens = [], 0
+            chunk.append(text)
+            chunk_tokens += tokens
+        if chunk:
+            summary = await self._summarize(summarizer, summary, "\n\n".join(chunk), name)
+
+        self.compactions += 1
+        summary_message = Message.user_message(SUMMARY_PREFIX + (summary or ""))
+        summary_message.pinned = True
+        return head + kept + [summary_message] + recent
+
+    async def maybe_compact(self, llm, memory, tools: List[dict] | None = None, name: str = "") -> bool:
+        """消息超过阈值时压缩记忆，返回是否进行了压缩；生成摘要失败时保持记忆不变"""
+        if not self.should_compact(llm, memory.Messages, tools):
+            return False
+        before = llm.count_tokens(memory.Messages, tools)
+        try:
+            messages = await self.compact(llm, memory.Messages, name, tools)
+        except Exception as e:
+            logger.warning(f"{name} 压缩上下文失败，保留原始记忆: {type(e).__name__}: {e}")
+            return False
+        if messages is None:
+            return False
+        removed = len(memory.Messages) - len(messages)
+        memory.replace(messages)
+        logger.info(
+            f"{name} 压缩上下文 | 消息: {removed + len(messages)} -> {len(messages)} | "
+            f"tokens: {before} -> {llm.count_tokens(messages, tools)}"
+        )
+        return True
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from collections import Counter
+from typing import Dict, List
+from core.schema import Message, Role
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _call_signature(call) -> str:
+    """工具调用的签名：工具名 + 规范化后的参数，参数的键顺序和空白不影响结果"""
+    function = call["function"] if isinstance(call, dict) else call.function
+    if not isinstance(function, dict):
+        function = function.model_dump()
+    arguments = function.get("arguments") or "{}"
+    try:
+        arguments = json.dumps(json.loads(arguments), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        pass
+    return _digest(f"{function.get('name')}\n{arguments}")
+
+
+def _decrement(counter: Counter, key: str):
+    if counter[key] <= 1:
+        counter.pop(key, None)
+    else:
+        counter[key] -= 1
+
+
+class RepetitionIndex:
+    """记忆中assistant消息的增量索引，用于检测代理是否陷入循环。
+    记录assistant消息内容的哈希的出现次数，以及工具调用签名连续重复的次数，消息写入或淘汰时更新，检测时无需扫描全部历史。
+    工具调用只统计连续的重复：相隔较远的相同查询（如多次查询天气）是正常的，不算作循环。
+    """
+
+    def __init__(self):
+        self.contents: Counter = Counter()
+        # 最近一条assistant消息中各工具调用签名紧接在之前连续出现的次数
+        self.streaks: Dict[str, int] = {}
+        # 最近一条assistant消息中连续重复次数最多的工具调用之前连续出现的次数
+        self.last_call_repeats = 0
+
+    def add(self, message: Message):
+        if message.role != Role.ASSISTANT:
+            return
+        if message.content:
+            self.contents[_digest(message.content)] += 1
+        # 签名与上一条assistant消息中的工具调用相同时延续计数，否则重新开始
+        streaks: Dict[str, int] = {}
+        for call in message.tool_calls or []:
+            signature = _call_signature(call)
+            if signature in streaks:
+                streaks[signature] += 1
+            else:
+                streaks[signature] = self.streaks[signature] + 1 if signature in self.streaks else 0
+        self.streaks = streaks
+        self.last_call_repeats = max(streaks.values(), default=0)
+
+    def remove(self, message: Message):
+        """消息被淘汰出记忆时调用"""
+        if message.role != Role.ASSISTANT:
+            return
+        if message.content:
+            _decrement(self.contents, _digest(message.content))
+
+    def rebuild(self, messages: List[Message]):
+        self.clear()
+        for message in messages:
+            self.add(message)
+
+    def clear(self):
+        self.contents.clear()
+        self.streaks = {}
+        self.last_call_repeats = 0
+
+    def content_repeats(self, message: Message) -> int:
+        """除该消息自身外，内容与之相同的assistant消息数"""
+        if not message.content:
+            return 0
+        count = self.contents[_digest(message.content)]
+        return count - 1 if message.role == Role.ASSISTANT else count
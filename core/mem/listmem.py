@@ -4,29 +4,31 @@ from .base import AsyncMemory
 
 class ListMemory(AsyncMemory):
     async def add(self, message: Message):
-        if len(self.Messages) < self.max_turn:
-            self.Messages.append(message)
-        else:
-            if self.Messages[0].role != Role.SYSTEM:
-                self.Messages.pop(0)
-            else:
-                self.Messages.pop(1)
-            self.Messages.append(message)
+        if len(self.Messages) >= self.max_turn:
+            # 淘汰最早的消息，系统消息和pinned消息（如上下文压缩生成的摘要）不淘汰
+            index = next(
+                (i for i, m in enumerate(self.Messages) if m.role != Role.SYSTEM and not m.pinned), None
+            )
+            if index is not None:
+                self.index.remove(self.Messages.pop(index))
+        self.Messages.append(message)
+        self.index.add(message)
     
     async def add_system(self, message: Message):
-        if self.Messages[0].role != Role.SYSTEM:
+        if not self.Messages or self.Messages[0].role != Role.SYSTEM:
             self.Messages.insert(0, message)
         if len(self.Messages) > self.max_length:
-            self.Messages.pop(1)
+            self.index.remove(self.Messages.pop(1))
         
     async def has_system(self) -> bool:
-        return self.Messages[0].role == Role.SYSTEM
+        return bool(self.Messages) and self.Messages[0].role == Role.SYSTEM
 
     async def search(self, query: str) -> List[Message]:
         return self.Messages
 
     async def clear(self):
         self.Messages = []
+        self.index.clear()
 
     async def save(self):
         raise NotImplementedError("ListMemory does not support saving")
@@ -1,7 +1,7 @@
 from enum import Enum
 from typing import Any, List, Optional, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 
 
 class Role(str, Enum):
@@ -29,14 +29,6 @@ class AgentState(str, Enum):
     FINISHED = "FINISHED"
     ERROR = "ERROR"
 
-class QueueEnd(BaseModel):
-    """标记队列结束的消息"""
-
-class AgentDone(BaseModel):
-    """标记代理执行完成的消息"""
-    message: str = Field(default="代理执行完成")
-    reason: Optional[str] = Field(default=None)
-
 class Function(BaseModel):
     name: str
     arguments: str
@@ -54,12 +46,6 @@ class AgentResult(BaseModel):
     thinking: str
     content: str
 
-class AgentResultStream(BaseModel):
-    """代理执行结果流式"""
-    thinking: str
-    content: str
-    tool_calls: List[ToolCall] | None = None
-
 class Message:
     """Represents a chat message in the conversation"""
 
@@ -78,6 +64,10 @@ class Message:
         self.name = name
         self.tool_call_id = tool_call_id
         self.base64_image = base64_image
+        # 上下文压缩时原样保留该消息
+        self.pinned = False
+        # token计数缓存，由TokenCounter维护
+        self._token_cache = None
 
     def __add__(self, other) -> List["Message"]:
         """支持 Message + list 或 Message + Message 的操作"""
@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Coroutine, List, Set
+from utils.log import logger
+
+# 当前请求的取消范围，请求内启动的后台任务和打开的LLM流登记在这里
+current_scope: ContextVar["RequestScope | None"] = ContextVar("request_scope", default=None)
+
+# 不属于任何请求范围的后台任务，保持强引用避免任务在执行中被垃圾回收
+_background_tasks: Set[asyncio.Task] = set()
+
+
+class RequestScope:
+    """一次请求的取消范围：跟踪请求内启动的后台任务和打开的流。
+    请求结束或客户端断开时取消仍在运行的任务，并关闭登记的流，使上游LLM请求随之中止。
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.cancelled = False
+        self.closed = False
+        self._tasks: Set[asyncio.Task] = set()
+        self._streams: List[AsyncIterator] = []
+
+    def create_task(self, coro: Coroutine, name: str | None = None) -> asyncio.Task:
+        if self.closed:
+            coro.close()
+            raise RuntimeError(f"请求范围 {self.name} 已关闭，不能再启动任务")
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            logger.error(f"请求 {self.name} 的后台任务异常 | Task: {task.get_name()} | {type(error).__name__}: {error}")
+
+    def track_stream(self, stream: AsyncIterator) -> AsyncIterator:
+        """登记在范围内打开的流，范围关闭时统一关闭"""
+        if hasattr(stream, "aclose"):
+            self._streams.append(stream)
+        return stream
+
+    def cancel(self, reason: str = ""):
+        """取消范围内所有仍在运行的任务"""
+        if not self.cancelled:
+            self.cancelled = True
+            logger.info(f"取消请求 {self.name} | 原因: {reason} | 运行中的任务: {len(self._tasks)}")
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def aclose(self):
+        """取消仍在运行的任务并等待其结束，然后关闭登记的流"""
+        if self.closed:
+            return
+        self.closed = True
+        tasks = [task for task in self._tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for stream in reversed(self._streams):
+            try:
+                await stream.aclose()
+            except Exception as e:
+                logger.warning(f"关闭请求 {self.name} 的流失败: {type(e).__name__}: {e}")
+        self._streams.clear()
+
+    async def __aenter__(self) -> "RequestScope":
+        self._token = current_scope.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.aclose()
+        finally:
+            current_scope.reset(self._token)
+
+
+def spawn(coro: Coroutine[Any, Any, Any], name: str | None = None, detached: bool = False) -> asyncio.Task:
+    """启动后台任务：在请求范围内时由范围跟踪，请求结束或客户端断开时一起取消。
+    detached为True时任务不属于当前请求范围，也不继承范围，请求结束后继续执行。
+    """
+    scope = None if detached else current_scope.get()
+    if scope is not None and not scope.closed:
+        return scope.create_task(coro, name=name)
+    if detached:
+        # 在清除了请求范围的上下文副本中创建任务，任务内启动的子任务和打开的流不再登记到请求范围
+        context = contextvars.copy_context()
+        context.run(current_scope.set, None)
+        task = context.run(asyncio.create_task, coro, name=name)
+    else:
+        task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def track_stream(stream: AsyncIterator) -> AsyncIterator:
+    """把流登记到当前请求范围，不在请求范围内时原样返回"""
+    scope = current_scope.get()
+    if scope is not None and not scope.closed:
+        scope.track_stream(stream)
+    return stream
@@ -5,5 +5,6 @@ from .bash import Bash
 from .planning import PlanningTool
 from .rag_tool import RAGTool
 from .mcp import MCPClients
+from .cache import tool_result_cache
 
-__all__ = ["BaseTool", "ToolResult", "CLIResult", "ToolFailure", "ToolCollection", "GetWeather", "Bash", "PlanningTool", "RAGTool", "MCPClients"]
+__all__ = ["BaseTool", "ToolResult", "CLIResult", "ToolFailure", "ToolCollection", "GetWeather", "Bash", "PlanningTool", "RAGTool", "MCPClients", "tool_result_cache"]
@@ -1,5 +1,7 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Dict, Optional
 
 from pydantic import BaseModel, Field
 
@@ -8,10 +10,34 @@ class BaseTool(ABC, BaseModel):
     name: str
     description: str
     parameters: Optional[dict] = None
+    # 是否可以与同一轮的其他工具调用并发执行（无副作用、不依赖执行顺序）
+    parallel_safe: bool = False
+    # 同一工具同时执行的调用数上限，None表示不限制
+    max_concurrency: Optional[int] = None
+    # 单次调用的超时时间（秒），None时使用配置 tools.timeout
+    timeout: Optional[float] = None
+    # 相同参数总是得到相同结果且无副作用，结果可以缓存
+    idempotent: bool = False
+    # 缓存结果的有效期（秒），None时使用配置 tools.cache.ttl
+    cache_ttl: Optional[float] = None
+
+    _semaphore: Optional[asyncio.Semaphore] = None
 
     class Config:
         arbitrary_types_allowed = True
 
+    def concurrency_slot(self):
+        """获取一个并发名额，未设置max_concurrency时不限制"""
+        if not self.max_concurrency:
+            return nullcontext()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def cache_scope(self) -> str:
+        """缓存键中区分同名工具实例的部分，结果依赖实例配置（如检索的集合）的工具覆盖此方法"""
+        return ""
+
     async def __call__(self, **kwargs) -> Any:
         """使用给定参数执行工具。"""
         return await self.execute(**kwargs)
@@ -20,6 +46,12 @@ class BaseTool(ABC, BaseModel):
     async def execute(self, **kwargs) -> Any:
         """使用给定参数执行工具。"""
 
+    async def execute_stream(self, **kwargs) -> AsyncIterator[Any]:
+        """流式执行工具：先产出若干部分输出（str），最后产出完整结果。
+        默认直接执行并产出结果，可以增量输出的工具（如bash）覆盖此方法。
+        """
+        yield await self.execute(**kwargs)
+
     def to_param(self) -> Dict:
         """将工具转换为函数调用格式。"""
         return {
@@ -1,5 +1,8 @@
 import asyncio
-from typing import Optional
+import codecs
+from typing import AsyncIterator, Optional
+from core.budget import current_budget
+from core.config import config
 from core.tools.base import BaseTool, CLIResult
 from core.tools.errors import ToolError
 
@@ -11,10 +14,16 @@ _BASH_DESCRIPTION = """在终端中执行bash命令。
 
 class _BashSession:
     """一个bash会话."""
-    _timeout: float = 120.0  # seconds
+
+    def _timeout(self) -> float:
+        """命令的超时（秒），请求有执行预算时缩短到剩余时间"""
+        timeout = config.get("tools.bash.timeout", 120.0)
+        budget = current_budget.get()
+        return budget.timeout(timeout) if budget is not None else timeout
 
     async def run(self, command: str):
         """在bash会话中执行命令."""
+        timeout = self._timeout()
         proc = await asyncio.create_subprocess_shell(
             command,
             stdout=asyncio.subprocess.PIPE,
@@ -22,11 +31,46 @@ class _BashSession:
         )
 
         try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=self._timeout)
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
             return CLIResult(output=stdout.decode(), error=stderr.decode())
         except asyncio.TimeoutError:
-            proc.kill()
-            raise ToolError("命令执行超时")
+            raise ToolError(f"命令执行超时（{timeout:.0f}秒）")
+        finally:
+            # 超时或被取消时结束子进程，避免命令在后台继续运行
+            if proc.returncode is None:
+                proc.kill()
+
+    async def run_stream(self, command: str) -> AsyncIterator[str | CLIResult]:
+        """在bash会话中执行命令，边执行边产出标准输出，最后产出完整结果."""
+        proc = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        loop = asyncio.get_running_loop()
+        timeout = self._timeout()
+        deadline = loop.time() + timeout
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        output = []
+        try:
+            while True:
+                chunk = await asyncio.wait_for(proc.stdout.read(4096), timeout=max(0.0, deadline - loop.time()))
+                text = decoder.decode(chunk, final=not chunk)
+                if text:
+                    output.append(text)
+                    yield text
+                if not chunk:
+                    break
+            stderr = await asyncio.wait_for(stderr_task, timeout=max(0.0, deadline - loop.time()))
+            await proc.wait()
+        except asyncio.TimeoutError:
+            raise ToolError(f"命令执行超时（{timeout:.0f}秒）")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            stderr_task.cancel()
+        yield CLIResult(output="".join(output), error=stderr.decode())
 
 
 class Bash(BaseTool):
@@ -56,6 +100,14 @@ class Bash(BaseTool):
 
         raise ToolError("未提供命令.")
 
+    async def execute_stream(
+        self, command: str | None = None, **kwargs
+    ) -> AsyncIterator[str | CLIResult]:
+        if command is None:
+            raise ToolError("未提供命令.")
+        async for item in self._session.run_stream(command):
+            yield item
+
 
 if __name__ == "__main__":
     bash = Bash()
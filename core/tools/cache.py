@@ -0,0 +1,64 @@
+import hashlib
+import json
+from typing import Any, Dict
+from core.config import config
+from utils.cache import TTLCache
+
+
+def make_tool_key(name: str, scope: str, arguments: Dict[str, Any] | None) -> str:
+    """根据工具名、缓存范围和规范化后的参数生成缓存键，参数的键顺序和空白不影响结果"""
+    raw = json.dumps(
+        {"name": name, "scope": scope, "arguments": arguments or {}},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ToolResultCache:
+    """幂等工具的结果缓存：所有工具共用一个有容量上限的LRU，按工具分别统计命中情况。
+    只有声明了idempotent的工具会被缓存，失败的结果不缓存。
+    """
+
+    def __init__(self, enable: bool = True, max_entries: int = 2048, ttl: float = 600):
+        self.enable = enable
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._tools: Dict[str, Dict[str, int]] = {}
+
+    def _counter(self, name: str) -> Dict[str, int]:
+        return self._tools.setdefault(name, {"hits": 0, "misses": 0, "writes": 0})
+
+    def enabled_for(self, tool) -> bool:
+        return self.enable and tool.idempotent
+
+    def key(self, tool, arguments: Dict[str, Any] | None) -> str:
+        return make_tool_key(tool.name, tool.cache_scope(), arguments)
+
+    def get(self, tool, key: str) -> Any:
+        value = self.memory.get(key)
+        self._counter(tool.name)["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, tool, key: str, result: Any) -> None:
+        if result is None or getattr(result, "error", None):
+            return
+        self.memory.set(key, result, ttl=tool.cache_ttl)
+        self._counter(tool.name)["writes"] += 1
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self._tools.clear()
+
+    def stats(self) -> dict:
+        tools = {}
+        for name, counter in self._tools.items():
+            total = counter["hits"] + counter["misses"]
+            tools[name] = {**counter, "hit_rate": counter["hits"] / total if total else 0.0}
+        return {"enable": self.enable, **self.memory.stats(), "tools": tools}
+
+
+tool_result_cache = ToolResultCache(
+    enable=config.get("tools.cache.enable", True),
+    max_entries=config.get("tools.cache.max_entries", 2048),
+    ttl=config.get("tools.cache.ttl", 600),
+)
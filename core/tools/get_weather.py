@@ -7,6 +7,8 @@ _GET_WEATHER_DESCRIPTION = """获取天气信息"""
 class GetWeather(BaseTool):
     name: str = "get_weather"
     description: str = _GET_WEATHER_DESCRIPTION
+    parallel_safe: bool = True
+    idempotent: bool = True
     parameters: dict = {
         "type": "object",
         "properties": {
@@ -1,5 +1,7 @@
+import asyncio
+import inspect
 from contextlib import AsyncExitStack
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.sse import sse_client
@@ -7,6 +9,7 @@ from mcp.client.stdio import stdio_client
 from mcp.types import TextContent, ListToolsResult
 
 from utils.log import logger
+from core.config import config
 from core.tools.base import BaseTool, ToolResult
 from core.tools.tool_collection import ToolCollection
 
@@ -34,6 +37,40 @@ class MCPClientTool(BaseTool):
         except Exception as e:
             return ToolResult(error=f"执行工具时出错: {str(e)}")
 
+    async def execute_stream(self, **kwargs) -> AsyncIterator[str | ToolResult]:
+        """通过远程调用MCP服务器执行工具，服务器上报的进度作为部分输出产出。"""
+        if not self.session or "progress_callback" not in inspect.signature(self.session.call_tool).parameters:
+            # 未连接或MCP版本不支持进度回调时按普通调用执行
+            yield await self.execute(**kwargs)
+            return
+
+        progress: asyncio.Queue = asyncio.Queue()
+
+        async def on_progress(value: float, total: float | None, message: str | None = None):
+            progress.put_nowait(message or (f"进度: {value}/{total}" if total else f"进度: {value}"))
+
+        async def call():
+            try:
+                return await self.session.call_tool(self.original_name, kwargs, progress_callback=on_progress)
+            finally:
+                progress.put_nowait(None)
+
+        logger.info(f"[{self.server_id}] 执行工具: {self.original_name}")
+        task = asyncio.create_task(call())
+        try:
+            while (message := await progress.get()) is not None:
+                yield message
+            result = await task
+        except Exception as e:
+            yield ToolResult(error=f"执行工具时出错: {str(e)}")
+            return
+        finally:
+            task.cancel()
+        content_str = ", ".join(
+            item.text for item in result.content if isinstance(item, TextContent)
+        )
+        yield ToolResult(output=content_str or "未返回输出。")
+
 
 
 class MCPClients(ToolCollection):
@@ -100,10 +137,15 @@ class MCPClients(ToolCollection):
         for tool in response.tools:
             original_name = tool.name
             tool_name = f"mcp_{server_id}_{original_name}"
+            # 服务器声明为只读的工具可以并发调用
+            annotations = getattr(tool, "annotations", None)
+            read_only = bool(annotations and getattr(annotations, "readOnlyHint", False))
             server_tool = MCPClientTool(
                 name=tool_name,
                 description=f"[{server_id}] {tool.description}",
                 parameters=tool.inputSchema,
+                parallel_safe=read_only,
+                idempotent=self._cacheable(server_id, tool, read_only),
                 session=session,
                 server_id=server_id,
                 original_name=original_name,
@@ -113,6 +155,18 @@ class MCPClients(ToolCollection):
         self.tools = tuple(self.tool_map.values())
         logger.info(f"[{server_id}] 已连接，工具: {[tool.name for tool in response.tools]}")
 
+    @staticmethod
+    def _cacheable(server_id: str, tool, read_only: bool) -> bool:
+        """只读不代表结果不变（搜索、时间、状态类工具），MCP工具的结果默认不缓存。
+        配置 tools.cache.mcp 中列出的工具，或声明了只读、幂等且不访问外部环境（openWorldHint为false）的工具才缓存。
+        """
+        allowed = (config.get("tools.cache.mcp") or {}).get(server_id) or []
+        if allowed == "*" or tool.name in allowed:
+            return True
+        annotations = getattr(tool, "annotations", None)
+        return read_only and bool(getattr(annotations, "idempotentHint", False)) \
+            and getattr(annotations, "openWorldHint", None) is False
+
     async def list_tools(self) -> ListToolsResult:
         """列出所有工具。"""
         tools_result = ListToolsResult(tools=[])
@@ -11,6 +11,9 @@ class RAGTool(BaseTool):
 
     name: str = "rag"
     description: str = "一个用于执行RAG任务的工具，会去检索相关文档，并返回检索到的文档内容"
+    parallel_safe: bool = True
+    max_concurrency: int = 4
+    idempotent: bool = True
     parameters: dict = {
         "type": "object",
         "properties": {
@@ -25,6 +28,9 @@ class RAGTool(BaseTool):
     text_embedder: EmbeddingAgent = Field(...)
     reranker: AsyncRankAgent = Field(default=None)
 
+    def cache_scope(self) -> str:
+        return self.collection_name
+
     async def execute(self, query: str) -> str:
         """执行RAG任务"""
         rag = QuestionRag(query=query, 
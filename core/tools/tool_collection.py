@@ -1,8 +1,13 @@
 """用于管理多个工具的集合类。"""
-from typing import Any, Dict, List
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List
 
+from core.budget import current_budget
+from core.config import config
 from core.tools.errors import ToolError
 from core.tools.base import BaseTool, ToolFailure, ToolResult
+from core.tools.cache import tool_result_cache
 
 
 class ToolCollection:
@@ -27,12 +32,83 @@ class ToolCollection:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"工具 {name} 无效")
+        cache_key = None
+        if tool_result_cache.enabled_for(tool):
+            cache_key = tool_result_cache.key(tool, tool_input)
+            cached = tool_result_cache.get(tool, cache_key)
+            if cached is not None:
+                return cached
+        budget = current_budget.get()
+        if budget is not None and budget.exhausted:
+            return ToolFailure(error=f"工具 {name} 未执行: {budget.exhausted_reason}")
+        timeout = self._timeout(tool, budget)
         try:
-            result = await tool(**tool_input)
+            async with tool.concurrency_slot():
+                result = await asyncio.wait_for(tool(**tool_input), timeout=timeout)
+            if cache_key is not None:
+                tool_result_cache.set(tool, cache_key, result)
             return result
+        except asyncio.TimeoutError:
+            return ToolFailure(error=f"工具 {name} 执行超时（{timeout:.0f}秒）")
         except ToolError as e:
             return ToolFailure(error=e.message)
 
+    async def execute_stream(
+        self, *, name: str, tool_input: Dict[str, Any] = None
+    ) -> AsyncIterator[Any]:
+        """流式执行工具，先产出部分输出（str），最后产出完整结果；超时按整个执行过程计算"""
+        tool = self.tool_map.get(name)
+        if not tool:
+            yield ToolFailure(error=f"工具 {name} 无效")
+            return
+        cache_key = None
+        if tool_result_cache.enabled_for(tool):
+            cache_key = tool_result_cache.key(tool, tool_input)
+            cached = tool_result_cache.get(tool, cache_key)
+            if cached is not None:
+                yield cached
+                return
+        budget = current_budget.get()
+        if budget is not None and budget.exhausted:
+            yield ToolFailure(error=f"工具 {name} 未执行: {budget.exhausted_reason}")
+            return
+        timeout = self._timeout(tool, budget)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        async with tool.concurrency_slot():
+            stream = tool.execute_stream(**(tool_input or {}))
+            result = None
+            try:
+                while True:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        raise asyncio.TimeoutError
+                    try:
+                        item = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                    except StopAsyncIteration:
+                        break
+                    result = item
+                    yield item
+            except asyncio.TimeoutError:
+                yield ToolFailure(error=f"工具 {name} 执行超时（{timeout:.0f}秒）")
+            except ToolError as e:
+                yield ToolFailure(error=e.message)
+            else:
+                # 最后一项为完整结果，之前的部分输出不缓存
+                if cache_key is not None:
+                    tool_result_cache.set(tool, cache_key, result)
+            finally:
+                await stream.aclose()
+
+    @staticmethod
+    def _timeout(tool: BaseTool, budget) -> float | None:
+        """工具的超时：工具自身设置优先，否则使用配置；请求有执行预算时缩短到剩余时间"""
+        timeout = tool.timeout if tool.timeout is not None else config.get("tools.timeout")
+        return budget.timeout(timeout) if budget is not None else timeout
+
+    def is_parallel_safe(self, name: str) -> bool:
+        tool = self.tool_map.get(name)
+        return bool(tool and tool.parallel_safe)
+
     async def execute_all(self) -> List[ToolResult]:
         """顺序执行集合中的所有工具。"""
         results = []
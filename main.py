@@ -1,16 +1,18 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
-from core.llms import OpenAICoT, QwenCoT
+from core.llms import OpenAICoT, QwenCoT, MockCoT, LLMRouter, http_client_pool, usage_ledger
 from core.embeddings.silicon_agent import SiliconEmbeddingAgent
 from core.ranks import SiliconRankAgent
 from core.vector.milvus import MilvusVectorStore
 from core.config import config
 from apis import all_routers
 from fastapi.middleware.cors import CORSMiddleware
+from apis.middleware import LLMTagMiddleware
 
 llm_map = {
     "openai": OpenAICoT,
-    "qwen": QwenCoT
+    "qwen": QwenCoT,
+    "mock": MockCoT
 }
 
 @asynccontextmanager
@@ -20,21 +22,46 @@ async def lifespan(app: FastAPI):
     for provider_name in config.llm_providers:
         provider_config = config.llm_providers[provider_name]
         app.state.llm_list[provider_name] = llm_map[provider_config.model_base](
-            api_base=provider_config.api_base,
-            api_key=provider_config.api_key,
+            api_base=provider_config.get("api_base"),
+            api_key=provider_config.get("api_key"),
             model=provider_config.model,
             support_fn_call=True,
-            enable_thinking=False
+            enable_thinking=False,
+            max_length=provider_config.get("max_length", config.get("model.max_length", 32768)),
+            tokenizer_path=provider_config.get("tokenizer_path"),
+            rate_limit=provider_config.get("rate_limit"),
+            batch_api=provider_config.get("batch_api", False),
+            **provider_config.get("options", {})
         )
     for provider_name in config.llm_cot_providers:
         provider_config = config.llm_cot_providers[provider_name]
         app.state.llm_cot[provider_name] = llm_map[provider_config.model_base](
-            api_base=provider_config.api_base,
-            api_key=provider_config.api_key,
+            api_base=provider_config.get("api_base"),
+            api_key=provider_config.get("api_key"),
             model=provider_config.model,
             support_fn_call=True,
-            enable_thinking=True
+            enable_thinking=True,
+            max_length=provider_config.get("max_length", config.get("model.max_length", 32768)),
+            tokenizer_path=provider_config.get("tokenizer_path"),
+            rate_limit=provider_config.get("rate_limit"),
+            batch_api=provider_config.get("batch_api", False),
+            **provider_config.get("options", {})
         )
+    # 多提供商路由，未指定llm_name时由路由选择提供商
+    app.state.llm_router = None
+    app.state.llm_cot_router = None
+    if config.get("router.enable", False):
+        router_options = {
+            "hedge": config.get("router.hedge", False),
+            "hedge_quantile": config.get("router.hedge_quantile", 0.95),
+            "hedge_min_delay": config.get("router.hedge_min_delay", 1.0),
+            "hedge_max_delay": config.get("router.hedge_max_delay", 30.0),
+        }
+        providers = config.get("router.providers") or list(app.state.llm_list)
+        app.state.llm_router = LLMRouter({name: app.state.llm_list[name] for name in providers}, **router_options)
+        cot_providers = config.get("router.cot_providers") or list(app.state.llm_cot)
+        if cot_providers:
+            app.state.llm_cot_router = LLMRouter({name: app.state.llm_cot[name] for name in cot_providers}, **router_options)
     app.state.embedding = SiliconEmbeddingAgent(
         url=config.embedding.api_base,
         api_key=config.embedding.api_key,
@@ -56,9 +83,12 @@ async def lifespan(app: FastAPI):
     else:
         milvus = None
     app.state.milvus_store = milvus
+    usage_ledger.start()
     yield
+    await usage_ledger.stop()
     if config.milvus.enable:
         await app.state.milvus_store.close()
+    await http_client_pool.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -69,6 +99,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(LLMTagMiddleware)
 
 for router in all_routers:
     app.include_router(router)
@@ -5,7 +5,8 @@ from core.flow import PlanningFlow
 from core.agent import ToolCallAgent
 from core.mem import ListMemory
 from core.tools import Bash,GetWeather
-from core.schema import AgentResultStream, AgentDone, QueueEnd
+from core.events import EventType
+from core.budget import Budget
 
 async def main():
     llm_config = config.llm_providers["qwen"]
@@ -26,27 +27,24 @@ async def main():
         llm=llm,
         agents=[agent]
     )
+    # 预算让流程在到期前停止并返回已有结果，wait_for兜底整个事件流的消费
+    events = await flow.execute(r"今天杭州是否值得外出游玩", budget=Budget(wall_time=3600))
+
+    async def consume():
+        async for event in events:
+            if event.type == EventType.STEP_START:
+                print(f"\n[{event.source}] step {event.step}: {event.text}")
+            elif event.type in (EventType.THINKING_DELTA, EventType.CONTENT_DELTA, EventType.TOOL_OUTPUT):
+                print(event.text, end="", flush=True)
+            elif event.type == EventType.TOOL_CALL:
+                print("\ntool_call:", event.tool_call)
+            elif event.type in (EventType.TOOL_RESULT, EventType.ERROR, EventType.DONE):
+                print(f"\n{event.type.value}:", event.text)
+
     try:
-        queue = await asyncio.wait_for(
-            flow.execute(r"今天杭州是否值得外出游玩"),
-            timeout=3600
-        )
-        while True:
-            chunk = await queue.get()
-            if isinstance(chunk, AgentDone):
-                break
-            if isinstance(chunk, asyncio.Queue):
-                while True:
-                    result = await chunk.get()
-                    if isinstance(result, QueueEnd):
-                        break
-                    if result.thinking:
-                        print("thinking:", result.thinking)
-                    if result.content:
-                        print("content:", result.content)
-                    if result.tool_calls:
-                        print("tool_calls:", result.tool_calls)
+        await asyncio.wait_for(consume(), timeout=3660)
     except asyncio.TimeoutError:
+        await events.aclose()
         print("执行超时")
 
 if __name__ == "__main__":
@@ -1,21 +1,115 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import random
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 import os.path
+from core.config import config
+
+# LogRecord自带的属性，其余属性视为通过extra传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample"}
+
+
+class Payload:
+    """大对象的日志参数：只有日志真正输出时才序列化，超过上限时截断。
+    用法：logger.debug("Messages: %s", payload(messages))，日志级别未开启时不会产生任何序列化开销。
+    """
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars: int):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        if isinstance(self.value, str):
+            text = self.value
+        else:
+            text = json.dumps(self.value, ensure_ascii=False, default=str)
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}...(已截断，共{len(text)}字符)"
+        return text
+
+
+def payload(value, max_chars: int | None = None) -> Payload:
+    return Payload(value, config.get("logging.payload_max_chars", 2000) if max_chars is None else max_chars)
+
+
+class SamplingFilter(logging.Filter):
+    """按类别采样日志：通过extra={"sample": 类别}标记的记录按配置的比例保留，未标记的记录全部保留"""
+
+    def __init__(self, rates: dict | None = None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "sample", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，extra传入的字段作为独立的键"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """在调用方线程只做消息插值和截断，格式化和写文件交给监听线程"""
+
+    def __init__(self, log_queue: queue.Queue, max_message_chars: int):
+        super().__init__(log_queue)
+        self.max_message_chars = max_message_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        if self.max_message_chars and len(message) > self.max_message_chars:
+            message = f"{message[:self.max_message_chars]}...(已截断，共{len(message)}字符)"
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+_listener: QueueListener | None = None
+
 
 def setup_logger(level=logging.INFO, log_file=None):
+    global _listener
     logger = logging.getLogger('knowledge_system')
     logger.setLevel(level)
-    
+
+    text_formatter = logging.Formatter(
+        '%(asctime)s - %(filename)s - %(lineno)d - %(levelname)s - %(message)s'
+    )
+    handlers = []
+
     # 控制台处理器
     handler = logging.StreamHandler()
     handler.setLevel(level)
-    formatter = logging.Formatter(
-        '%(asctime)s - %(filename)s - %(lineno)d - %(levelname)s - %(message)s'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    
+    handler.setFormatter(text_formatter)
+    handlers.append(handler)
+
     # 文件处理器
     if log_file:
         # 确保日志目录存在
@@ -25,15 +119,33 @@ def setup_logger(level=logging.INFO, log_file=None):
             filename=log_file,
             when='midnight',
             interval=1,
-            backupCount=30,
+            backupCount=config.get("logging.backup_count", 30),
             encoding='utf-8'
         )
         file_handler.setLevel(level)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    
+        file_format = config.get("logging.file_format", "json")
+        file_handler.setFormatter(JsonFormatter() if file_format == "json" else text_formatter)
+        handlers.append(file_handler)
+
+    logger.addFilter(SamplingFilter(config.get("logging.sample", {})))
+    # 处理器在监听线程中执行，事件循环只负责把日志记录放入队列
+    log_queue = queue.Queue(-1)
+    logger.addHandler(_QueueHandler(log_queue, config.get("logging.max_message_chars", 8000)))
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
     return logger
 
+
+def stop_logging():
+    """停止监听线程，写完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 debug = os.environ.get('debug', 'False')
 level = logging.INFO
 if debug == 'True':
@@ -43,4 +155,4 @@ if debug == 'True':
 log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
 log_file = os.path.join(log_dir, 'knowledge_system.log')
 
-logger = setup_logger(level=level, log_file=log_file)
\ No newline at end of file
+logger = setup_logger(level=level, log_file=log_file)
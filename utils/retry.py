@@ -1,9 +1,165 @@
+import asyncio
+import random
 import time
+from email.utils import parsedate_to_datetime
 from functools import wraps
 from traceback import format_exc
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional, Tuple, Type
 
 from .log import logger
 
+# 可重试的HTTP状态码：超时、冲突、限流以及上游5xx
+RETRY_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    """异步重试策略：指数退避 + 抖动，支持Retry-After、状态码分类和单次尝试超时"""
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        jitter: float = 0.5,
+        attempt_timeout: float | None = None,
+        first_token_timeout: float | None = None,
+        max_retry_after: float = 60.0,
+        retry_status_codes: Iterable[int] = RETRY_STATUS_CODES,
+        retryable_exceptions: Tuple[Type[BaseException], ...] = (),
+    ):
+        """
+        Args:
+            max_retries: 首次调用失败后的最大重试次数
+            base_delay: 第一次重试的基础等待秒数，之后每次翻倍
+            max_delay: 单次退避的上限
+            jitter: 抖动比例，实际等待在 [delay*(1-jitter), delay] 之间
+            attempt_timeout: 单次尝试的超时（流式调用为建立连接的超时），None表示不限制
+            first_token_timeout: 流式调用等待首个片段的超时，None表示不限制
+            max_retry_after: 服务端Retry-After允许的最大等待秒数
+            retry_status_codes: 视为可重试的HTTP状态码
+            retryable_exceptions: 额外视为可重试的异常类型（如连接错误）
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempt_timeout = attempt_timeout
+        self.first_token_timeout = first_token_timeout
+        self.max_retry_after = max_retry_after
+        self.retry_status_codes = frozenset(retry_status_codes)
+        self.retryable_exceptions = (asyncio.TimeoutError, ConnectionError) + tuple(retryable_exceptions)
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        """判断异常是否值得重试"""
+        if isinstance(exc, AssertionError):
+            return False
+        status_code = getattr(exc, "status_code", None)
+        if isinstance(status_code, int):
+            return status_code in self.retry_status_codes
+        return isinstance(exc, self.retryable_exceptions)
+
+    def _retry_after(self, exc: BaseException) -> Optional[float]:
+        """读取异常响应头中的Retry-After（秒或HTTP日期）"""
+        response = getattr(exc, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def get_delay(self, attempt: int, exc: BaseException | None = None) -> float:
+        """第attempt次重试（从0开始）前需要等待的秒数"""
+        if exc is not None:
+            retry_after = self._retry_after(exc)
+            if retry_after is not None:
+                return min(retry_after, self.max_retry_after)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    @staticmethod
+    async def _with_timeout(awaitable: Awaitable, timeout: float | None):
+        if timeout is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, timeout)
+
+    async def _backoff(self, name: str, attempt: int, exc: BaseException) -> bool:
+        """失败后决定是否重试，需要重试时异步等待（不阻塞事件循环）"""
+        if attempt >= self.max_retries or not self.is_retryable(exc):
+            return False
+        delay = self.get_delay(attempt, exc)
+        logger.warning(
+            f'Attempt to run {name} {attempt + 1} failed, retry in {delay:.2f}s: {type(exc).__name__}: {exc}'
+        )
+        await asyncio.sleep(delay)
+        return True
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """按策略执行协程函数"""
+        name = getattr(func, "__name__", repr(func))
+        attempt = 0
+        while True:
+            try:
+                return await self._with_timeout(func(*args, **kwargs), self.attempt_timeout)
+            except Exception as e:
+                if not await self._backoff(name, attempt, e):
+                    raise
+                attempt += 1
+
+    async def call_stream(self, factory: Callable[[], Awaitable[AsyncIterator]]) -> AsyncIterator:
+        """按策略建立流式调用，在收到首个片段之前的失败都会重试。
+        首个片段到达后流已经对外可见，之后的失败直接抛给调用方。
+        """
+        name = getattr(factory, "__name__", repr(factory))
+        attempt = 0
+        while True:
+            stream = None
+            try:
+                stream = await self._with_timeout(factory(), self.attempt_timeout)
+                first = await self._with_timeout(stream.__anext__(), self.first_token_timeout)
+            except StopAsyncIteration:
+                return _empty_stream()
+            except Exception as e:
+                if stream is not None and hasattr(stream, "aclose"):
+                    try:
+                        await stream.aclose()
+                    except Exception:
+                        pass
+                if not await self._backoff(name, attempt, e):
+                    raise
+                attempt += 1
+                continue
+            return _prepend(first, stream)
+
+
+async def _empty_stream():
+    return
+    yield
+
+
+async def _prepend(first, stream: AsyncIterator):
+    try:
+        yield first
+        async for item in stream:
+            yield item
+    finally:
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+
 
 def retry(max_retries=3, delay_seconds=1, return_str=False):
     """
@@ -19,6 +175,23 @@ def retry(max_retries=3, delay_seconds=1, return_str=False):
 
     def decorator(func):
 
+        if asyncio.iscoroutinefunction(func):
+            policy = RetryPolicy(max_retries=max_retries - 1, base_delay=delay_seconds,
+                                 retryable_exceptions=(Exception,))
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await policy.call(func, *args, **kwargs)
+                except AssertionError:
+                    raise
+                except Exception:
+                    if return_str:
+                        return f'Max retries reached. Attempt to run {func.__name__} failed after {max_retries} times'
+                    raise
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             attempts = 0
@@ -40,4 +213,4 @@ def retry(max_retries=3, delay_seconds=1, return_str=False):
 
         return wrapper
 
-    return decorator
\ No newline at end of file
+    return decorator